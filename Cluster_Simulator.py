@@ -0,0 +1,266 @@
+"""
+Simulate a cluster of N nodes on one Linux machine, to see how the status broadcasts, findAvailableNode and MainFSM behave at scale.
+Every node is a network namespace on a bridge, running the real migrator.py with a scripted voltage trace instead of the ADC
+(simulatedADC.py) and stand-in LEDs. The simulator listens to the broadcasts on the bridge and reports, per cluster size:
+- broadcast load: packets and bytes per second that every node receives, packets lost (from the sequence numbers),
+  and the CPU used by the migrators
+- convergence: how long until every node has been heard, and how late a state change is seen after it happens
+- migration cascades: migrations read from the span logs of the nodes, chained when a process is migrated again,
+  and migrations per workload-hour (Placement_Benchmark.py simulates hours of solar traces without namespaces)
+
+    sudo python3 Cluster_Simulator.py --nodes 50 --nodes 100 --nodes 200 [--duration 60] [--workloads 1]
+                                      [--fail 0@20 --fail 7@30] [--trace 3=trace.txt] [--output cluster_results.jsonl]
+
+--fail NODE@SECONDS makes the supply of a node collapse at that time, --trace NODE=FILE gives a node its own voltage trace.
+The first --workloads nodes start a Synthetic_Workload.py process, so failing them migrates it (needs criu, like a node).
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import simulatedADC
+import statusProtocol
+import tracing
+import transfer
+from Migration_Benchmark import gitCommit, run, waitFor
+
+WORK_DIR = "/tmp/cluster-simulator"  # home directories of the simulated nodes
+BRIDGE = "migsim0"
+NAMESPACE = "migsim-"
+MONITOR_IP = "192.168.137.254"  # address of the bridge, where the simulator listens to the broadcasts
+FIRST_NODE_IP = 10  # node i gets 192.168.137.(10 + i), clear of the process alias 192.168.137.3
+MAX_NODES = 254 - FIRST_NODE_IP  # the last address is the bridge
+HEALTHY_VOLTS = 24
+COLLAPSE_VOLTS = 3
+COLLAPSE_TIME = 2  # seconds for a failing supply to go from healthy to collapsed
+STATUS_PORT = 12345
+
+
+def nodeIP(index: int) -> str:
+    return f"192.168.137.{FIRST_NODE_IP + index}"
+
+
+def setupCluster(nodes: int) -> None:
+    """ Create the bridge and a namespace per node, with a veth pair that is eth0 inside the node """
+    teardownCluster()
+    run(["ip", "link", "add", BRIDGE, "type", "bridge"])
+    run(["ip", "addr", "add", f"{MONITOR_IP}/24", "dev", BRIDGE])
+    run(["ip", "link", "set", BRIDGE, "up"])
+    for index in range(nodes):
+        namespace, veth = NAMESPACE + str(index), f"msveth{index}"
+        run(["ip", "netns", "add", namespace])
+        run(["ip", "link", "add", veth, "type", "veth", "peer", "name", f"{veth}p"])
+        run(["ip", "link", "set", veth, "master", BRIDGE, "up"])
+        run(["ip", "link", "set", f"{veth}p", "netns", namespace])
+        run(["ip", "-n", namespace, "link", "set", f"{veth}p", "name", "eth0"])
+        run(["ip", "-n", namespace, "addr", "add", f"{nodeIP(index)}/24", "dev", "eth0"])
+        run(["ip", "-n", namespace, "link", "set", "eth0", "up"])
+        run(["ip", "-n", namespace, "link", "set", "lo", "up"])
+        run(["ip", "-n", namespace, "route", "add", "default", "dev", "eth0"])  # the status broadcasts go to 255.255.255.255
+
+
+def teardownCluster() -> None:
+    """ Kill every process in the node namespaces, delete them and the bridge """
+    namespaces = subprocess.run(["ip", "netns", "list"], stdout=subprocess.PIPE).stdout.decode().split("\n")
+    for namespace in [line.split()[0] for line in namespaces if line.startswith(NAMESPACE)]:
+        for pid in subprocess.run(["ip", "netns", "pids", namespace], stdout=subprocess.PIPE).stdout.decode().split():
+            try:
+                os.kill(int(pid), signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        subprocess.run(["ip", "netns", "del", namespace])  # deletes the veth pair with it
+    subprocess.run(["ip", "link", "del", BRIDGE], stderr=subprocess.DEVNULL)
+
+
+def prepareHome(index: int, trace: str, workload: bool) -> str:
+    """ Create the home directory of a node with its voltage trace, and the workload if it starts one. returns the home directory """
+    home = os.path.join(WORK_DIR, str(index))
+    os.makedirs(home)
+    shutil.copy(trace, os.path.join(home, "voltage.txt"))
+    if workload:
+        os.makedirs(os.path.join(home, "videoboard"))
+        shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Synthetic_Workload.py"),
+                    os.path.join(home, "videoboard", "vidboardmain.py"))
+        open(os.path.join(home, "startflag.txt"), "w").close()
+    return home
+
+
+def startNode(index: int, home: str) -> subprocess.Popen:
+    """ Start the migrator of a node in its namespace, with its own /home/pi and /dev/shm (like Migration_Benchmark.startNode) """
+    migrator = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrator.py")
+    script = (f"mount -t tmpfs tmpfs /home && mkdir /home/pi && mount --bind {home} /home/pi"
+              f" && mount -t tmpfs tmpfs {transfer.STAGING_ROOT}"
+              f" && cd /home/pi && exec python3 -u {migrator} adctrace=/home/pi/voltage.txt")
+    log = open(os.path.join(home, "migrator.log"), "w")
+    return subprocess.Popen(["ip", "netns", "exec", NAMESPACE + str(index), "sh", "-c", script],
+                            stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+
+def cpuSeconds(pid: int) -> float:
+    """ Get the user and system CPU seconds of a process, 0 once it exited """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError):
+        return 0.0
+
+
+class BroadcastMonitor(threading.Thread):
+    """ Listens to the status broadcasts on the bridge, counting the load and the state changes of every node """
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, BRIDGE.encode())  # only the simulated cluster
+        self.sock.settimeout(0.5)
+        self.sock.bind(('', STATUS_PORT))
+        self.packets = 0
+        self.bytes = 0
+        self.firstSeen = {}  # ip -> time the first packet of the node arrived
+        self.states = {}  # ip -> last state seen
+        self.sequences = {}  # ip -> last sequence number seen
+        self.lost = 0  # packets missing from the sequence numbers
+        self.lateness = []  # seconds between a state change on a node and its first broadcast arriving
+        self.transitions = []  # (time, ip, old state, new state)
+        self._running = True  # sentinel value for the thread
+        super().__init__()
+
+    def run(self):
+        while self._running:
+            try:
+                data = self.sock.recvfrom(4096)[0]
+            except socket.timeout:
+                continue
+            now = time.time()
+            self.packets += 1
+            self.bytes += len(data)
+            try:
+                packet = statusProtocol.decode(data)
+            except ValueError:
+                continue
+            ip, state = packet["ip"], packet["state"]
+            self.firstSeen.setdefault(ip, now)
+            if ip in self.states and self.states[ip] != state:
+                self.transitions.append((now, ip, str(self.states[ip]), str(state)))
+                if "changed" in packet:
+                    self.lateness.append(now - packet["changed"])
+            self.states[ip] = state
+            if ip in self.sequences and packet["seq"] > self.sequences[ip] + 1:
+                self.lost += packet["seq"] - self.sequences[ip] - 1
+            self.sequences[ip] = packet["seq"]
+
+    def stop(self):
+        self._running = False  # set the sentinel value to stop the thread
+
+
+def migrationCascades(nodes: int) -> dict:
+    """
+    Read the migrations from the span logs of every node. A migration whose source node received the process
+    in an earlier migration continues that chain. returns the number of migrations, the chain lengths and the
+    nodes that were picked as the destination more than once.
+    """
+    migrations = []
+    for index in range(nodes):
+        path = os.path.join(WORK_DIR, str(index), os.path.basename(tracing.SPAN_LOG))
+        if os.path.exists(path):
+            migrations += [span for span in tracing.readSpans([path]) if span["phase"] == "total"]
+    migrations.sort(key=lambda span: span["start"])
+    chains = {}  # node currently holding the process -> hops so far
+    destinations = defaultdict(int)
+    for span in migrations:
+        hops = chains.pop(span["node"], 0) + 1
+        chains[span["peer"]] = hops
+        destinations[span["peer"]] += 1
+    return {"migrations": len(migrations), "chain_lengths": sorted(chains.values(), reverse=True),
+            "repeated_destinations": {ip: count for ip, count in destinations.items() if count > 1}}
+
+
+def simulate(nodes: int, args) -> dict:
+    """ Run a cluster of the given size for the duration and collect its results """
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+    os.makedirs(WORK_DIR)
+    traces = {}
+    healthy = os.path.join(WORK_DIR, "healthy.txt")
+    simulatedADC.writeTrace(healthy, [(0, HEALTHY_VOLTS)], "supply stays healthy")
+    for fail in args.fail:
+        index, seconds = fail.split("@")
+        traces[int(index)] = os.path.join(WORK_DIR, f"fail-{index}.txt")
+        simulatedADC.writeTrace(traces[int(index)], [(0, HEALTHY_VOLTS), (float(seconds), HEALTHY_VOLTS),
+                                                    (float(seconds) + COLLAPSE_TIME, COLLAPSE_VOLTS)], f"supply collapses at {seconds} s")
+    for trace in args.trace:
+        index, path = trace.split("=", 1)
+        traces[int(index)] = path
+
+    setupCluster(nodes)
+    monitor = BroadcastMonitor()
+    monitor.start()
+    processes = []
+    try:
+        start = time.time()
+        for index in range(nodes):
+            home = prepareHome(index, traces.get(index, healthy), index < args.workloads)
+            processes.append(startNode(index, home))
+        try:
+            waitFor(lambda: len(monitor.firstSeen) >= nodes, 60, "every node to broadcast")
+            allSeen = max(monitor.firstSeen.values()) - start
+        except TimeoutError:
+            allSeen = None
+        packets, sent, lost, cpu = monitor.packets, monitor.bytes, monitor.lost, [cpuSeconds(p.pid) for p in processes]
+        measureStart = time.time()
+        time.sleep(max(args.duration - (measureStart - start), 0))
+        seconds = time.time() - measureStart
+        packets, sent, lost = monitor.packets - packets, monitor.bytes - sent, monitor.lost - lost
+        cpu = [(cpuSeconds(p.pid) - before) / seconds * 100 for p, before in zip(processes, cpu)]
+        crashed = [nodeIP(index) for index, p in enumerate(processes) if p.poll() is not None]
+    finally:
+        monitor.stop()
+        monitor.join()
+        teardownCluster()
+
+    lateness = monitor.lateness
+    cascades = migrationCascades(nodes)
+    workloadHours = min(args.workloads, nodes) * args.duration / 3600
+    return {"nodes": nodes, "duration_s": args.duration, "commit": gitCommit(),
+            "all_seen_s": allSeen,
+            "packets_per_s": packets / seconds, "bytes_per_s": sent / seconds, "lost_packets": lost,
+            "node_cpu_percent_mean": sum(cpu) / len(cpu), "node_cpu_percent_max": max(cpu),
+            "state_changes": len(monitor.transitions),
+            "state_lateness_ms": {f"p{p}": tracing.percentile(lateness, p) * 1000 for p in (50, 95, 99)} if lateness else None,
+            "crashed": crashed,
+            "migrations_per_workload_hour": cascades["migrations"] / workloadHours if workloadHours else None,
+            **cascades}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, action="append", help="cluster size, can be repeated (default: 50, 100, 200)")
+    parser.add_argument("--duration", type=float, default=60, help="seconds every cluster runs, from the start of the first node")
+    parser.add_argument("--workloads", type=int, default=1, help="number of nodes that start with a workload")
+    parser.add_argument("--fail", action="append", default=[], help="NODE@SECONDS: the supply of the node collapses at that time")
+    parser.add_argument("--trace", action="append", default=[], help="NODE=FILE: voltage trace of the node")
+    parser.add_argument("--output", default="cluster_results.jsonl", help="results file, one JSON line per cluster size")
+    args = parser.parse_args()
+    if os.geteuid() != 0:
+        sys.exit("Needs root to create the network namespaces")
+    if max(args.nodes or [MAX_NODES]) > MAX_NODES:
+        sys.exit(f"At most {MAX_NODES} nodes fit in 192.168.137.0/24")
+
+    for nodes in args.nodes or [50, 100, 200]:
+        result = simulate(nodes, args)
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+        lateness = result["state_lateness_ms"] or {}
+        print(f"{nodes} nodes: all seen after {result['all_seen_s']} s, {result['packets_per_s']:.0f} packets/s "
+              f"({result['bytes_per_s'] / 1e3:.0f} kB/s) to every node, migrator CPU {result['node_cpu_percent_mean']:.1f}% "
+              f"(max {result['node_cpu_percent_max']:.1f}%), state change seen after p50 {lateness.get('p50', 0):.0f} ms "
+              f"p99 {lateness.get('p99', 0):.0f} ms, {result['migrations']} migrations, longest cascade "
+              f"{max(result['chain_lengths'], default=0)}, {len(result['crashed'])} nodes crashed")
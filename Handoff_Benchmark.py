@@ -0,0 +1,166 @@
+"""
+Benchmark of the outage a client sees when the alias IP of a process moves to another node, with and without the
+gratuitous ARP the migrator sends after it adds an alias (hostOps.announceAddress). Runs on a single Linux machine:
+a source node, a destination node and a client are network namespaces on one bridge, like the Pis and their clients on a switch.
+Both nodes serve HTTP on port 8000, the source holds the alias, and Outage_Probe.py requests the alias from the client
+while the alias moves. Every run appends one JSON line to the results file, with the commit it was measured on:
+
+    sudo python3 Handoff_Benchmark.py [--mode garp --mode none] [--runs 3] [--gap 0.5] [--persistent] [--output handoff_results.jsonl]
+    python3 Handoff_Benchmark.py --compare [--output handoff_results.jsonl]
+
+Without the announcement the client keeps sending to the MAC of the source until its ARP entry goes stale (tens of seconds
+with the kernel defaults). Needs root and iproute2.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from ipaddress import IPv4Address
+from statistics import median
+
+import hostOps
+from Migration_Benchmark import REPO, gitCommit, run
+
+NAMESPACE = "handoff-"
+BRIDGE = "lan"  # namespace suffix of the bridge that stands in for the switch
+NODES = {"src": "192.168.137.101", "dst": "192.168.137.102", "client": "192.168.137.50"}  # namespace suffix -> address
+ALIAS = "192.168.137.3"  # the alias of videoboard
+PORT = 8000
+MODES = ("garp", "none")  # announce the alias after it moved, or leave it to the ARP caches of the clients
+SETTLE_TIME = 2  # seconds the client probes before the alias moves, so its ARP entry points at the source
+PROBE_TIMEOUT = 120  # seconds the client probes at most, longer than an ARP entry stays valid without the announcement
+
+
+def inNode(node: str, command: list) -> list:
+    """ Prefix a command so that it runs inside the network namespace of a node """
+    return ["ip", "netns", "exec", NAMESPACE + node] + command
+
+
+def setupNetwork() -> None:
+    """ Create a namespace per node and one for the bridge, every node is attached to the bridge with eth0 """
+    teardownNetwork()
+    run(["ip", "netns", "add", NAMESPACE + BRIDGE])
+    run(["ip", "-n", NAMESPACE + BRIDGE, "link", "add", "br0", "type", "bridge"])
+    run(["ip", "-n", NAMESPACE + BRIDGE, "link", "set", "br0", "up"])
+    for node, ip in NODES.items():
+        namespace = NAMESPACE + node
+        run(["ip", "netns", "add", namespace])
+        run(["ip", "link", "add", f"ho-{node}", "type", "veth", "peer", "name", f"ho-{node}-p"])
+        run(["ip", "link", "set", f"ho-{node}", "netns", namespace])
+        run(["ip", "link", "set", f"ho-{node}-p", "netns", NAMESPACE + BRIDGE])
+        run(["ip", "-n", NAMESPACE + BRIDGE, "link", "set", f"ho-{node}-p", "master", "br0", "up"])
+        run(["ip", "-n", namespace, "link", "set", f"ho-{node}", "name", "eth0"])
+        run(["ip", "-n", namespace, "addr", "add", f"{ip}/24", "dev", "eth0"])
+        run(["ip", "-n", namespace, "link", "set", "eth0", "up"])
+        run(["ip", "-n", namespace, "link", "set", "lo", "up"])
+
+
+def teardownNetwork() -> None:
+    """ Delete the namespaces, which kills nothing but deletes their veth pairs and the bridge """
+    for node in list(NODES) + [BRIDGE]:
+        subprocess.run(["ip", "netns", "del", NAMESPACE + node], stderr=subprocess.DEVNULL)
+
+
+def startServers(directory: str) -> list:
+    """ Serve a page on port 8000 of every address of both nodes, so whichever node holds the alias answers """
+    with open(os.path.join(directory, "index.html"), "w") as f:
+        f.write("videoboard\n")
+    return [subprocess.Popen(inNode(node, ["python3", "-m", "http.server", str(PORT), "--bind", "0.0.0.0", "--directory", directory]),
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for node in ("src", "dst")]
+
+
+async def takeOver(announce: bool) -> None:
+    """
+    Add the alias in this namespace (--takeover). With announce through the migrator's own IPalias, which announces it
+    (migrator.announceAlias), waiting until every announcement went out. Without, the way IPalias added aliases before
+    """
+    if not announce:
+        hostOps.addAddress(ALIAS)
+        return
+    import migrator  # only in the destination namespace, it needs the packages of a node
+    migrator.IPalias(IPv4Address(ALIAS), True)
+    await asyncio.gather(*migrator.backgroundTasks)
+
+
+def handoffOnce(mode: str, gap: float, persistent: bool) -> dict:
+    """ Move the alias from the source to the destination while the client probes it, returns the summary of the probe """
+    run(["ip", "-n", NAMESPACE + "src", "addr", "add", f"{ALIAS}/24", "dev", "eth0"])
+    run(["ip", "-n", NAMESPACE + "client", "neigh", "flush", "all"])
+    with tempfile.NamedTemporaryFile(suffix=".jsonl") as output:
+        probe = subprocess.Popen(inNode("client", ["python3", os.path.join(REPO, "Outage_Probe.py"), f"http://{ALIAS}:{PORT}/",
+                                                   "--until-recovered", "--duration", str(PROBE_TIMEOUT), "--output", output.name]
+                                        + (["--persistent"] if persistent else [])), stdout=subprocess.DEVNULL)
+        try:
+            time.sleep(SETTLE_TIME)
+            run(["ip", "-n", NAMESPACE + "src", "addr", "del", f"{ALIAS}/24", "dev", "eth0"])
+            time.sleep(gap)  # the process is frozen and transferred
+            run(inNode("dst", ["python3", os.path.abspath(__file__), "--takeover"] + (["--announce"] if mode == "garp" else [])))
+            probe.wait(PROBE_TIMEOUT + 10)
+        finally:
+            probe.kill()
+            run(["ip", "-n", NAMESPACE + "dst", "addr", "flush", "to", ALIAS])
+        with open(output.name) as f:
+            return json.loads(f.readlines()[-1])
+
+
+def compare(path: str) -> None:
+    """ Print the median client outage per commit, mode and connection kind """
+    groups = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            result = json.loads(line)
+            groups[(result["commit"][:12], result["mode"], result["persistent"], result["gap_s"])].append(result)
+    print(f"{'commit':<13} {'mode':<6} {'persistent':>10} {'gap':>6} {'runs':>5} {'outage':>11} {'worst':>11} {'unrecovered':>12}")
+    for (commit, mode, persistent, gap), results in groups.items():
+        outages = [r["outage_ms"] for r in results]
+        print(f"{commit:<13} {mode:<6} {str(persistent):>10} {gap:>5}s {len(results):>5} {median(outages):>8.0f} ms {max(outages):>8.0f} ms "
+              f"{sum(r['ongoing'] for r in results):>12}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", action="append", choices=MODES, help="handoff mode, can be repeated (default: all)")
+    parser.add_argument("--runs", type=int, default=3, help="handoffs per mode")
+    parser.add_argument("--gap", type=float, default=0.5, help="seconds between removing the alias and adding it on the destination")
+    parser.add_argument("--persistent", action="store_true", help="the client keeps its connection open (see Outage_Probe.py)")
+    parser.add_argument("--output", default="handoff_results.jsonl", help="results file, one JSON line per handoff")
+    parser.add_argument("--compare", action="store_true", help="only print the medians of the results file")
+    parser.add_argument("--takeover", action="store_true", help=argparse.SUPPRESS)  # run inside the destination namespace
+    parser.add_argument("--announce", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.takeover:
+        asyncio.run(takeOver(args.announce))
+        sys.exit()
+    if args.compare:
+        compare(args.output)
+        sys.exit()
+    if os.geteuid() != 0:
+        sys.exit("Needs root to create the network namespaces")
+
+    commit = gitCommit()
+    setupNetwork()
+    pages = tempfile.TemporaryDirectory(prefix="handoff-")
+    servers = startServers(pages.name)
+    try:
+        for mode in args.mode or MODES:
+            for index in range(args.runs):
+                probe = handoffOnce(mode, args.gap, args.persistent)
+                result = {"commit": commit, "time": time.time(), "mode": mode, "run": index + 1, "gap_s": args.gap,
+                          "persistent": args.persistent, "outage_ms": probe["longest_ms"], "ongoing": probe["ongoing"],
+                          "probes": probe["probes"], "failures": probe["failures"]}
+                with open(args.output, "a") as f:
+                    f.write(json.dumps(result) + "\n")
+                print(f"{mode:<6} run {index + 1}: client outage {result['outage_ms']:.0f} ms"
+                      + (", not recovered" if result["ongoing"] else ""))
+    finally:
+        for server in servers:
+            server.kill()
+        teardownNetwork()
+        pages.cleanup()
+    compare(args.output)
@@ -0,0 +1,239 @@
+"""
+Reproducible migration benchmark on a single Linux machine, without Pis.
+Two nodes are emulated with network namespaces joined by a veth pair (optionally rate limited to the bandwidth of the real link).
+Each node runs the real migrator.py (noadc) with a private /home/pi and /dev/shm, so the real dump, transfer and restore
+paths are measured. The migrated process is Synthetic_Workload.py with a configurable RSS, dirty rate and compressibility.
+Every run appends one JSON line to the results file, with the commit it was measured on, so results can be compared across commits:
+
+    sudo python3 Migration_Benchmark.py [--mode stop-and-copy --mode stream ...] [--rss 64] [--dirty-rate 8]
+                                        [--compressible 0.5] [--rate 100mbit] [--runs 5] [--output benchmark_results.jsonl]
+    python3 Migration_Benchmark.py --compare [--output benchmark_results.jsonl]
+
+Needs root, criu, iproute2 (ip, tc), sudo and the packages in requirements.txt, like a node. The chunk stores are kept between runs so dedup is measured warm after its first run.
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from statistics import median
+
+import tracing
+import transfer
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+WORK_DIR = "/tmp/migration-benchmark"  # home directories of the emulated nodes
+NODES = {"src": "192.168.137.101", "dst": "192.168.137.102"}  # network namespace suffix -> address of the node
+NAMESPACE = "migbench-"
+MODES = {"stop-and-copy": [], "pre-copy": ["precopy"], "post-copy": ["postcopy"], "stream": ["stream"],
+         "compress": ["compress"], "dedup": ["dedup"]}  # benchmark mode -> migrator.py flags
+SETTLE_TIME = 2  # seconds for the nodes to see each other's broadcasts
+RUN_TIMEOUT = 300  # seconds a single migration may take before the run is abandoned
+
+
+def run(command: list) -> str:
+    """ Run a command, raises CalledProcessError if it fails """
+    return subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.decode()
+
+
+def inNode(node: str, command: list) -> list:
+    """ Prefix a command so that it runs inside the network namespace of a node """
+    return ["ip", "netns", "exec", NAMESPACE + node] + command
+
+
+def setupNetwork(rate=None) -> None:
+    """ Create a network namespace per node, joined by a veth pair that is eth0 in both (the migrator aliases eth0) """
+    teardownNetwork()
+    run(["ip", "link", "add", "migbench0", "type", "veth", "peer", "name", "migbench1"])
+    for index, (node, ip) in enumerate(NODES.items()):
+        namespace = NAMESPACE + node
+        run(["ip", "netns", "add", namespace])
+        run(["ip", "link", "set", f"migbench{index}", "netns", namespace])
+        run(["ip", "-n", namespace, "link", "set", f"migbench{index}", "name", "eth0"])
+        run(["ip", "-n", namespace, "addr", "add", f"{ip}/24", "dev", "eth0"])
+        run(["ip", "-n", namespace, "link", "set", "eth0", "up"])
+        run(["ip", "-n", namespace, "link", "set", "lo", "up"])
+        run(["ip", "-n", namespace, "route", "add", "default", "dev", "eth0"])  # the status broadcasts go to 255.255.255.255
+        if rate:
+            run(inNode(node, ["tc", "qdisc", "add", "dev", "eth0", "root", "tbf", "rate", rate, "burst", "64kb", "latency", "50ms"]))
+
+
+def teardownNetwork() -> None:
+    """ Kill everything left in the namespaces and delete them (which deletes the veth pair) """
+    for node in NODES:
+        namespace = NAMESPACE + node
+        if subprocess.run(["ip", "netns", "pids", namespace], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).returncode != 0:
+            continue
+        killNode(node)
+        subprocess.run(["ip", "netns", "del", namespace])
+
+
+def killNode(node: str) -> None:
+    """ Kill the migrator of a node and the processes it started (the workload, criu) """
+    pids = subprocess.run(["ip", "netns", "pids", NAMESPACE + node], stdout=subprocess.PIPE).stdout.decode().split()
+    for pid in pids:
+        try:
+            os.kill(int(pid), signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def prepareHomes(settings: dict) -> None:
+    """ Create an empty home directory for every node (keeping the chunk stores), with the workload on the source node """
+    for node in NODES:
+        home = os.path.join(WORK_DIR, node)
+        os.makedirs(home, exist_ok=True)
+        for entry in os.listdir(home):
+            if entry != "chunkstore":
+                path = os.path.join(home, entry)
+                shutil.rmtree(path) if os.path.isdir(path) and not os.path.islink(path) else os.remove(path)
+    source = os.path.join(WORK_DIR, "src")
+    os.makedirs(os.path.join(source, "videoboard"))
+    shutil.copy(os.path.join(REPO, "Synthetic_Workload.py"), os.path.join(source, "videoboard", "vidboardmain.py"))
+    with open(os.path.join(source, "videoboard", "workload.json"), "w") as f:
+        json.dump(settings, f)
+    open(os.path.join(source, "startflag.txt"), "w").close()  # the source node starts the workload as a new process
+
+
+def startNode(node: str, flags: list) -> subprocess.Popen:
+    """
+    Start the migrator of a node in its namespace. /home is replaced by a tmpfs holding the node's home directory
+    and /dev/shm by a fresh tmpfs, only for the processes of this node (ip netns exec gives them their own mount namespace).
+    """
+    home = os.path.join(WORK_DIR, node)
+    script = (f"mount -t tmpfs tmpfs /home && mkdir /home/pi && mount --bind {home} /home/pi"
+              f" && mount -t tmpfs tmpfs {transfer.STAGING_ROOT}"
+              f" && cd /home/pi && exec python3 -u {os.path.join(REPO, 'migrator.py')} noadc {' '.join(flags)}")
+    log = open(os.path.join(WORK_DIR, f"{node}.log"), "w")
+    return subprocess.Popen(inNode(node, ["sh", "-c", script]), stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+
+def waitFor(condition, timeout: float, what: str):
+    """ Poll a condition until it returns something truthy, raises TimeoutError after the timeout """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.1)
+    raise TimeoutError(f"Timed out waiting for {what}")
+
+
+def workloadServing() -> bool:
+    """ Check if the workload answers on the process alias address, from inside the source node """
+    probe = "import urllib.request; urllib.request.urlopen('http://192.168.137.3:8000/', timeout=1).read()"
+    return subprocess.run(inNode("src", ["python3", "-c", probe]), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+
+
+def txBytes(node: str) -> int:
+    """ Get the number of bytes sent on eth0 of a node """
+    return int(run(inNode(node, ["cat", "/sys/class/net/eth0/statistics/tx_bytes"])))
+
+
+def nodeSpans(node: str) -> list:
+    """ Get the spans that a node recorded in its span log """
+    path = os.path.join(WORK_DIR, node, os.path.basename(tracing.SPAN_LOG))
+    return tracing.readSpans([path]) if os.path.exists(path) else []
+
+
+def migrateOnce(mode: str, settings: dict, warmup: float) -> dict:
+    """ Run the workload on the source node, migrate it to the destination node, and collect the result of the migration """
+    prepareHomes(settings)
+    nodes = [startNode(node, MODES[mode]) for node in NODES]
+    try:
+        waitFor(workloadServing, 60, "the workload to start on the source node")
+        time.sleep(max(warmup, SETTLE_TIME))  # let the dirty rate settle and the nodes see each other
+        sent = txBytes("src")
+        open(os.path.join(WORK_DIR, "src", "force_migrate.txt"), "w").close()  # the way the HMI requests a migration
+
+        total = waitFor(lambda: next((s for s in nodeSpans("src") if s["phase"] == "total"), None), RUN_TIMEOUT, "the migration")
+        firstRequest = waitFor(lambda: next((s for s in nodeSpans("dst") if s["phase"] == "first-request"), None), 60,
+                               "the restored workload to serve a request")
+        sent = txBytes("src") - sent
+    finally:
+        for node, process in zip(NODES, nodes):
+            killNode(node)
+            process.wait()
+
+    spans = [span for span in nodeSpans("src") + nodeSpans("dst") if span["migration"] == total["migration"]]
+    dump = next(span for span in spans if span["phase"] == "dump")
+    phases = defaultdict(lambda: {"ms": 0.0, "cpu_ms": 0.0})
+    for span in spans:
+        phases[span["phase"]]["ms"] += span["duration_ms"]  # pre-copy rounds add up
+        phases[span["phase"]]["cpu_ms"] += span.get("cpu_ms", 0.0)
+    return {"migration": total["migration"],
+            "downtime_ms": next(span["duration_ms"] for span in spans if span["phase"] == "downtime"),
+            "total_ms": total["duration_ms"],
+            "service_gap_ms": (firstRequest["start"] - dump["start"]) / 1e6 + firstRequest["duration_ms"],  # one clock for both nodes
+            "bytes_sent": sent,
+            "transfer_bytes": next((span.get("bytes") for span in spans if span["phase"] == "transfer"), None),
+            "phases": dict(phases)}
+
+
+def gitCommit() -> str:
+    """ Get the commit the benchmark runs on, marked dirty if the tree has changes """
+    try:
+        commit = run(["git", "-C", REPO, "rev-parse", "HEAD"]).strip()
+        return commit + ("-dirty" if run(["git", "-C", REPO, "status", "--porcelain", "--untracked-files=no"]).strip() else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(path: str) -> None:
+    """ Print the median results per commit and mode """
+    groups = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            result = json.loads(line)
+            groups[(result["commit"][:12], result["mode"], result["rss_mb"], result["dirty_mb_s"], result["rate"])].append(result)
+    print(f"{'commit':<13} {'mode':<14} {'rss':>5} {'dirty':>6} {'rate':>8} {'runs':>5} {'downtime':>11} {'total':>11} {'gap':>11} {'sent':>10}")
+    for (commit, mode, rss, dirty, rate), results in groups.items():
+        downtime, total = median(r["downtime_ms"] for r in results), median(r["total_ms"] for r in results)
+        gap, sent = median(r["service_gap_ms"] for r in results), median(r["bytes_sent"] for r in results)
+        print(f"{commit:<13} {mode:<14} {rss:>5} {dirty:>6} {str(rate):>8} {len(results):>5} {downtime:>8.0f} ms {total:>8.0f} ms "
+              f"{gap:>8.0f} ms {sent / 1e6:>7.1f} MB")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", action="append", choices=list(MODES), help="migration mode, can be repeated (default: all)")
+    parser.add_argument("--rss", type=float, default=64, help="resident memory of the workload in MiB")
+    parser.add_argument("--dirty-rate", type=float, default=8, help="MiB per second the workload dirties")
+    parser.add_argument("--compressible", type=float, default=0.5, help="fraction of every page that compresses well")
+    parser.add_argument("--rate", help="bandwidth of the emulated link (tc rate, e.g. 100mbit), unlimited by default")
+    parser.add_argument("--runs", type=int, default=5, help="migrations per mode")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds the workload runs before it is migrated")
+    parser.add_argument("--output", default="benchmark_results.jsonl", help="results file, one JSON line per migration")
+    parser.add_argument("--compare", action="store_true", help="only print the medians of the results file per commit and mode")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.output)
+        sys.exit()
+    if os.geteuid() != 0:
+        sys.exit("Needs root to create the network namespaces and run criu")
+
+    settings = {"rss_mb": args.rss, "dirty_mb_s": args.dirty_rate, "compressible": args.compressible}
+    commit = gitCommit()
+    setupNetwork(args.rate)
+    try:
+        for mode in args.mode or list(MODES):
+            shutil.rmtree(WORK_DIR, ignore_errors=True)  # every mode starts with cold chunk stores
+            for index in range(args.runs):
+                try:
+                    result = migrateOnce(mode, settings, args.warmup)
+                except (TimeoutError, StopIteration) as e:
+                    print(f"{mode} run {index + 1} failed: {e}, see the node logs in {WORK_DIR}")
+                    continue
+                result = {"commit": commit, "time": time.time(), "mode": mode, "run": index + 1, "rate": args.rate, **settings, **result}
+                with open(args.output, "a") as f:
+                    f.write(json.dumps(result) + "\n")
+                print(f"{mode:<14} run {index + 1}: downtime {result['downtime_ms']:.0f} ms, total {result['total_ms']:.0f} ms, "
+                      f"service gap {result['service_gap_ms']:.0f} ms, {result['bytes_sent'] / 1e6:.1f} MB sent")
+    finally:
+        teardownNetwork()
+    compare(args.output)
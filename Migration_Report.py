@@ -0,0 +1,92 @@
+"""
+Aggregate the span logs of one or more nodes into per-phase latency percentiles over many migrations.
+Copy the migrate_spans.jsonl of every node to one machine and run:
+
+    python3 Migration_Report.py node1_spans.jsonl node2_spans.jsonl ... [--last]
+
+--last also prints the phases of the most recent migration as a bar graph, the way migrate_stats.txt used to.
+Evacuations of nodes with several processes (migrator.drainNode) are listed with their planned and actual makespan.
+With the warm standby (see standby.py), the RPO its rounds kept is summarized, and every failover of a buddy node is listed
+with the state it lost (RPO) and how long the process was gone: from the last status of the lost node until the restored
+process answered its first request.
+"""
+import sys
+from collections import defaultdict
+
+import tracing
+
+# order of the phases in the report: source node first, then the receiving node
+PHASES = ["standby-round", "evacuation", "connect", "pre-copy", "pre-copy-round", "dump", "alias-remove", "transfer", "flag", "downtime", "lazy-pages",
+          "delete", "total", "failover", "flag-detect", "alias-add", "restore-launch", "restore", "first-request"]
+
+
+def printPercentiles(spans: list) -> None:
+    """ Print p50/p95/p99 of every phase """
+    durations = defaultdict(list)
+    for span in spans:
+        durations[span["phase"]].append(span["duration_ms"])
+    migrations = len({span["migration"] for span in spans})
+    print(f"{len(spans)} spans from {migrations} migrations")
+    print(f"{'Phase':<16} {'count':>6} {'p50':>10} {'p95':>10} {'p99':>10}")
+    for phase in PHASES + sorted(set(durations) - set(PHASES)):
+        if durations[phase]:
+            values = durations[phase]
+            print(f"{phase:<16} {len(values):>6} " + " ".join(f"{tracing.percentile(values, p):>7.0f} ms" for p in (50, 95, 99)))
+
+
+def printLastMigration(spans: list, bar_width=50) -> None:
+    """ Print the phases of the most recent migration, on both nodes, as a bar graph in the order they started """
+    last = max(spans, key=lambda span: span["start"])["migration"]
+    migration = sorted((span for span in spans if span["migration"] == last), key=lambda span: span["start"])
+    total = max(span["duration_ms"] for span in migration) or 1
+    print(f"\nMigration {last}")
+    for span in migration:
+        print(f"{span['node']:<16} {span['phase']:<16} {span['duration_ms']:>8.0f} ms {'-' * int(span['duration_ms'] / total * bar_width)}")
+
+
+def printEvacuations(spans: list) -> None:
+    """ Print the planned makespan of every evacuation next to the actual one, and when every process was done """
+    evacuations = sorted((span for span in spans if span["phase"] == "evacuation"), key=lambda span: span["start"])
+    if not evacuations:
+        return
+    print(f"\n{'Evacuation':<14} {'node':<16} {'processes':>9} {'budget':>9} {'planned':>10} {'actual':>10}")
+    for span in evacuations:
+        budget = f"{span['budget_s']:.1f} s" if span.get("budget_s") is not None else "-"
+        print(f"{span['migration']:<14} {span['node']:<16} {span['processes']:>9} {budget:>9} "
+              f"{span['planned_ms'] / 1000:>8.1f} s {span['duration_ms'] / 1000:>8.1f} s")
+        for name, ip, plannedSeconds in span.get("plan", []):
+            actual = span.get("actual", {}).get(name)
+            print(f"    {name:<18} -> {ip or 'local disk':<16} planned {plannedSeconds:>6.1f} s, "
+                  f"actual {f'{actual:.1f} s' if actual is not None else 'failed'}")
+
+
+def printStandby(spans: list) -> None:
+    """ Print the RPO and period percentiles of the standby rounds, and the RPO and failover time of every failover """
+    rounds = [span for span in spans if span["phase"] == "standby-round" and not span.get("failed")]
+    rpos = [span["rpo_s"] for span in rounds if span.get("rpo_s") is not None]
+    if rpos:
+        print(f"\n{len(rounds)} standby rounds, " + ", ".join(
+            f"{label} p50 {tracing.percentile(values, 50):.1f} p99 {tracing.percentile(values, 99):.1f}" for label, values in
+            (("RPO s", rpos), ("period s", [span["period_s"] for span in rounds]), ("delta MB", [span["bytes"] / 1e6 for span in rounds]))))
+    failovers = sorted((span for span in spans if span["phase"] == "failover"), key=lambda span: span["start"])
+    if not failovers:
+        return
+    print(f"\n{'Failover':<14} {'node':<16} {'lost node':<16} {'policy':<8} {'RPO':>8} {'back after':>11}")
+    for span in failovers:
+        restored = [other for other in spans if other["migration"] == span["migration"] and other["phase"] in ("restore-launch", "first-request")]
+        end = max((other["start"] + other["duration_ms"] * 1e6 for other in restored), default=None)
+        back = f"{(end - span['start']) / 1e9:.1f} s" if end is not None else "-"
+        rpo = f"{span['rpo_s']:.1f} s" if span.get("rpo_s") is not None else "-"
+        print(f"{span['migration']:<14} {span['node']:<16} {span['peer']:<16} {span['policy']:<8} {rpo:>8} {back:>11}")
+
+
+if __name__ == '__main__':
+    paths = [arg for arg in sys.argv[1:] if not arg.startswith("--")] or [tracing.SPAN_LOG]
+    spans = tracing.readSpans(paths)
+    if not spans:
+        sys.exit("No spans found")
+    printPercentiles(spans)
+    printEvacuations(spans)
+    printStandby(spans)
+    if "--last" in sys.argv:
+        printLastMigration(spans)
@@ -0,0 +1,104 @@
+"""
+Measures the outage a client of a migrated process sees. Run it on a client of the process (or in the client namespace of
+Handoff_Benchmark.py), it requests the page of the process every --interval seconds and prints every outage it sees:
+
+    python3 Outage_Probe.py [url] [--interval 0.01] [--timeout 0.2] [--persistent] [--duration 60] [--until-recovered]
+                            [--output outage_probe.jsonl]
+
+An outage runs from the last request that was served before the failed ones to the first one served after them, so it
+includes everything the client waits for: the freeze of the process, the transfer, the restore and the time its ARP cache
+still points at the old node. The downtime span of the migrator only covers the part the nodes see.
+With --persistent every request goes over one kept-alive connection, like a video client, and a new one is opened after
+a failure; otherwise every request opens a new connection. A summary line is appended to --output if it is given.
+"""
+import argparse
+import http.client
+import json
+import time
+import urllib.parse
+import urllib.request
+
+URL = "http://192.168.137.3:8000/"  # videoboard on its alias IP
+
+
+class Prober:
+    """ Requests the page of a process over and over and records the outages between the served requests """
+
+    def __init__(self, url: str, timeout: float, persistent=False):
+        self.url = url
+        self.timeout = timeout
+        self.persistent = persistent
+        self.connection = None  # the kept-alive connection of --persistent, None until the next request opens one
+        self.probes = 0
+        self.failures = 0
+        self.lastServed = None  # monotonic time of the last served request
+        self.failed = 0  # failed requests since then
+        self.outages = []  # (start, length in ms, failed requests) of every outage that ended
+
+    def request(self) -> None:
+        """ Request the page once, raises OSError or HTTPException if it was not served """
+        if not self.persistent:
+            urllib.request.urlopen(self.url, timeout=self.timeout).read()
+            return
+        if self.connection is None:
+            parts = urllib.parse.urlsplit(self.url)
+            self.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=self.timeout)
+        self.connection.request("GET", urllib.parse.urlsplit(self.url).path or "/")
+        self.connection.getresponse().read()
+
+    def probe(self) -> bool:
+        """ Request the page once and update the outages. returns True if an outage ended with this request """
+        self.probes += 1
+        try:
+            self.request()
+        except (OSError, http.client.HTTPException):
+            self.failures += 1
+            self.failed += 1
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+            return False
+        now, ended = time.monotonic(), False
+        if self.failed > 0 and self.lastServed is not None:
+            length = (now - self.lastServed) * 1000
+            self.outages.append((self.lastServed, length, self.failed))
+            print(f"outage of {length:.0f} ms ({self.failed} failed requests)")
+            ended = True
+        self.lastServed, self.failed = now, 0
+        return ended
+
+    def summary(self) -> dict:
+        """ The outages so far, an outage that has not ended counts with its length until now """
+        lengths = [length for _, length, _ in self.outages]
+        ongoing = self.failed > 0 and self.lastServed is not None
+        return {"time": time.time(), "url": self.url, "persistent": self.persistent, "probes": self.probes, "failures": self.failures,
+                "outages_ms": lengths, "ongoing": ongoing,
+                "longest_ms": max(lengths + ([(time.monotonic() - self.lastServed) * 1000] if ongoing else []), default=0.0)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("url", nargs="?", default=URL, help="page of the process")
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between two requests")
+    parser.add_argument("--timeout", type=float, default=0.2, help="seconds a request may take before it counts as failed")
+    parser.add_argument("--persistent", action="store_true", help="keep one connection open instead of a new one per request")
+    parser.add_argument("--duration", type=float, help="seconds to probe for, until Ctrl-C by default")
+    parser.add_argument("--until-recovered", action="store_true", help="stop after the first outage ended")
+    parser.add_argument("--output", help="file to append the summary to as a JSON line")
+    args = parser.parse_args()
+
+    prober = Prober(args.url, args.timeout, args.persistent)
+    end = time.monotonic() + args.duration if args.duration else float("inf")
+    try:
+        while time.monotonic() < end:
+            if prober.probe() and args.until_recovered:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    summary = prober.summary()
+    print(f"{summary['probes']} requests, {summary['failures']} failed, {len(summary['outages_ms'])} outages, "
+          f"longest {summary['longest_ms']:.0f} ms" + (", still out when stopped" if summary["ongoing"] else ""))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(summary) + "\n")
@@ -0,0 +1,147 @@
+"""
+Simulated-cluster benchmark of migration placement: how many migrations every workload needs per hour it runs,
+when the destination is the first idle node (findAvailableNode before placement.py) and when it is ranked by placement.py.
+A migration to a node that loses its supply soon after only leads to another migration, so fewer is better.
+
+The cluster is simulated in time steps, without namespaces or criu, so hours of solar traces take seconds:
+every node gets a supply trace (full sun, passing clouds, and a sunset at a random time as the terrain shades it),
+broadcasts a status packet every step into a real nodeRegistry.NodeRegistry and placement.PlacementEngine running on the
+simulated clock, and migrates its workload when its supply drops below the migrate threshold. A node whose supply collapsed
+stops broadcasting, so the registry has to expire it. Both policies run on the same traces for every seed.
+
+    python3 Placement_Benchmark.py [--nodes 50] [--workloads 10] [--hours 6] [--seeds 10] [--output placement_results.jsonl]
+
+Every run appends one JSON line per seed and policy to the results file, with the commit it ran on.
+"""
+import argparse
+import bisect
+import json
+import random
+from collections import defaultdict
+from statistics import median
+
+import nodeRegistry
+import placement
+import simulatedADC
+from Migration_Benchmark import gitCommit
+from statusProtocol import NodeState
+
+STEP = 5  # simulated seconds between status packets
+HEALTHY_VOLTS = 24
+RECOVER_VOLTS = 16  # a node that shut down takes processes again above this
+COLLAPSE_VOLTS = 4  # below this a node is off and stops broadcasting (the shutdown threshold of migrator.py)
+SUNSET_RAMP = 2700  # seconds from full sun to dark
+CLOUDS_PER_HOUR = 0.8  # per node
+POLICIES = ("first-idle", "scored")
+
+
+def solarTrace(rng: random.Random, seconds: float) -> list:
+    """ (seconds, volts) points of one node: full sun with passing clouds until its sunset, somewhere in or after the run """
+    sunset = rng.uniform(0.15, 1.3) * seconds
+    points = [(0, HEALTHY_VOLTS)]
+    t = 0.0
+    while True:
+        t += rng.expovariate(CLOUDS_PER_HOUR / 3600)
+        if t > sunset - SUNSET_RAMP:
+            break
+        duration, depth, ramp = rng.uniform(300, 1800), rng.uniform(6, 16), rng.uniform(60, 300)
+        points += [(t, HEALTHY_VOLTS), (t + ramp, depth), (t + ramp + duration, depth), (t + 2 * ramp + duration, HEALTHY_VOLTS)]
+        t += 2 * ramp + duration
+    points += [(sunset - SUNSET_RAMP, HEALTHY_VOLTS), (sunset, 0)]
+    return points
+
+
+def volts(trace: list, times: list, t: float) -> float:
+    """ Supply voltage at time t, interpolated like simulatedADC.VoltageTrace """
+    index = bisect.bisect_right(times, t)
+    if index == len(trace):
+        return trace[-1][1]
+    (t0, v0), (t1, v1) = trace[index - 1], trace[index]
+    return v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+
+
+def simulate(traces: list, workloads: int, seconds: float, policy: str) -> dict:
+    """ Run the cluster with one placement policy. returns the migrations and how long workloads had nowhere to run """
+    now = [0.0]
+    clock = lambda: now[0]
+    registry = nodeRegistry.NodeRegistry(ttl=3 * STEP, clock=clock)
+    engine = placement.PlacementEngine(registry, clock=clock)
+    times = [[t for t, _ in trace] for trace in traces]
+    ips = [f"10.0.{i // 250}.{i % 250 + 1}" for i in range(len(traces))]
+    state = [NodeState.BUSY if i < workloads else NodeState.IDLE for i in range(len(traces))]
+    hosting = {i: i for i in range(workloads)}  # workload -> node running it, None while no node could take it
+    migrations, hops, stranded, failedPlacements = 0, defaultdict(int), 0.0, 0
+
+    def choose(exclude: int):
+        if policy == "first-idle":
+            ip = registry.anyInState(NodeState.IDLE)
+            return ips.index(ip) if ip is not None and ip != ips[exclude] else None
+        ranked = engine.rank(exclude=(ips[exclude],))
+        return ips.index(ranked[0]) if ranked else None
+
+    while now[0] < seconds:
+        supply = [volts(trace, t, now[0]) for trace, t in zip(traces, times)]
+        for node, v in enumerate(supply):  # nodes that cannot take a process
+            if state[node] == NodeState.MIGRATING:
+                state[node] = NodeState.SHUTDOWN
+            elif state[node] == NodeState.IDLE and v < placement.MIGRATE_VOLTS:
+                state[node] = NodeState.SHUTDOWN
+            elif state[node] == NodeState.SHUTDOWN and v >= RECOVER_VOLTS:
+                state[node] = NodeState.IDLE
+        for workload, node in hosting.items():
+            if node is not None and supply[node] >= placement.MIGRATE_VOLTS:
+                continue
+            target = choose(node if node is not None else -1)
+            if node is not None:
+                state[node] = NodeState.MIGRATING
+            if target is None:
+                failedPlacements += node is not None
+                hosting[workload] = None
+                stranded += STEP
+                continue
+            state[target] = NodeState.BUSY
+            hosting[workload] = target
+            migrations += 1
+            hops[workload] += 1
+            registry.update({"ip": ips[target], "state": NodeState.BUSY, "voltage": supply[target] / simulatedADC.ADC_SCALE})
+        for node, v in enumerate(supply):  # status broadcasts
+            if v >= COLLAPSE_VOLTS:
+                packet = {"ip": ips[node], "state": state[node], "voltage": v / simulatedADC.ADC_SCALE,
+                          "free_ram_mb": 512, "free_disk_mb": 16384}
+                engine.observe(packet)
+                registry.update(packet)
+        now[0] += STEP
+
+    workloadHours = workloads * seconds / 3600
+    return {"migrations": migrations, "migrations_per_workload_hour": migrations / workloadHours,
+            "max_hops": max(hops.values(), default=0), "stranded_fraction": stranded / (workloads * seconds),
+            "failed_placements": failedPlacements}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=50, help="nodes in the cluster")
+    parser.add_argument("--workloads", type=int, default=10, help="workloads, started on the first nodes")
+    parser.add_argument("--hours", type=float, default=6, help="simulated hours")
+    parser.add_argument("--seeds", type=int, default=10, help="number of random clusters, seeds 0 to N-1")
+    parser.add_argument("--output", default="placement_results.jsonl", help="results file, one JSON line per seed and policy")
+    args = parser.parse_args()
+
+    commit, seconds = gitCommit(), args.hours * 3600
+    results = defaultdict(list)
+    with open(args.output, "a") as f:
+        for seed in range(args.seeds):
+            rng = random.Random(seed)
+            traces = [solarTrace(rng, seconds) for _ in range(args.nodes)]
+            for policy in POLICIES:
+                result = {"policy": policy, "seed": seed, "nodes": args.nodes, "workloads": args.workloads, "hours": args.hours,
+                          "commit": commit, **simulate(traces, args.workloads, seconds, policy)}
+                f.write(json.dumps(result) + "\n")
+                results[policy].append(result)
+
+    print(f"{args.nodes} nodes, {args.workloads} workloads, {args.hours} h, median of {args.seeds} seeds")
+    print(f"{'policy':<12} {'migrations/workload-h':>22} {'max hops':>9} {'stranded':>9}")
+    for policy in POLICIES:
+        runs = results[policy]
+        print(f"{policy:<12} {median(r['migrations_per_workload_hour'] for r in runs):>22.2f} "
+              f"{median(r['max_hops'] for r in runs):>9.0f} {median(r['stranded_fraction'] for r in runs):>8.1%}")
@@ -0,0 +1,106 @@
+"""
+Compare the time until a migrated videoboard serves its first request, for the current stop-and-copy path and post-copy (lazy pages).
+Run on the node that should host videoboard, with the migrator service running (IDLE) on the receiving node:
+
+    sudo python3 PostCopy_Benchmark.py <receiving ip> [postcopy]
+
+Each run is appended to /home/pi/postcopy_benchmark.csv and the median of every mode recorded so far is printed.
+"""
+import asyncio
+import csv
+import sys
+import threading
+import time
+import urllib.request
+from ipaddress import IPv4Address
+from statistics import median
+
+import netifaces
+import migrator
+import transfer
+
+ALIAS_IP = IPv4Address("192.168.137.3")
+URL = f"http://{ALIAS_IP}:8000/"
+RESULTS = "/home/pi/postcopy_benchmark.csv"
+
+
+class RequestProber(threading.Thread):
+    """ Keep requesting the videoboard page and remember when it was last served before the outage and first served after it """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lastServed = None   # last time a request was served before the outage
+        self.firstServed = None  # first time a request was served after the outage
+        self._outage = False
+        self._running = True
+        super().__init__()
+
+    def run(self):
+        while self._running and self.firstServed is None:
+            try:
+                urllib.request.urlopen(URL, timeout=0.5).read()
+                if self._outage:
+                    self.firstServed = time.monotonic()
+                else:
+                    self.lastServed = time.monotonic()
+            except OSError:
+                self._outage = True
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._running = False
+
+
+def waitUntilServed(timeout=30) -> bool:
+    """ Wait until videoboard answers on the alias IP """
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            urllib.request.urlopen(URL, timeout=0.5).read()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+async def migrateWhileProbing(proc, receivingIP: IPv4Address, postCopy: bool) -> tuple:
+    """ Start videoboard, then migrate it while a prober requests the page. returns (prober, start, migrated) times """
+    await proc.run()
+    if not await asyncio.to_thread(waitUntilServed):
+        sys.exit("videoboard did not start")
+
+    prober = RequestProber()
+    prober.start()
+    start = time.monotonic()
+    await migrator.checkpointAndMigrateProcessToNode(proc, receivingIP, postCopy=postCopy)
+    migrated = time.monotonic()
+    await asyncio.to_thread(prober.join, 60)
+    prober.stop()
+    return prober, start, migrated
+
+
+if __name__ == '__main__':
+    receivingIP = IPv4Address(sys.argv[1])
+    postCopy = 'postcopy' in sys.argv
+    mode = "post-copy" if postCopy else "stop-and-copy"
+    migrator.selfState["ip"] = netifaces.ifaddresses('eth0')[2][0]['addr']  # the page server address sent to the receiver
+    migrator.transfers = transfer.ConnectionPool(transfer.loadKey())
+
+    proc = migrator.Process("videoboard", location="/home/pi/videoboard", aliasIP=ALIAS_IP)
+    prober, start, migrated = asyncio.run(migrateWhileProbing(proc, receivingIP, postCopy))
+    if prober.firstServed is None:
+        sys.exit("migrated videoboard never served a request")
+
+    firstRequest_ms = (prober.firstServed - start) * 1000
+    outage_ms = (prober.firstServed - prober.lastServed) * 1000
+    print(f"{mode}: first request served {firstRequest_ms:.0f} ms after the migration started, "
+          f"client outage {outage_ms:.0f} ms, migration returned after {(migrated - start) * 1000:.0f} ms")
+    with open(RESULTS, "a", newline="") as f:
+        csv.writer(f).writerow([time.time(), mode, f"{firstRequest_ms:.1f}", f"{outage_ms:.1f}"])
+
+    with open(RESULTS, newline="") as f:
+        runs = list(csv.reader(f))
+    for m in ("stop-and-copy", "post-copy"):
+        times = [float(r[2]) for r in runs if r[1] == m]
+        if times:
+            print(f"{m:<15} median time to first served request {median(times):.0f} ms over {len(times)} runs")
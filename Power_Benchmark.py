@@ -0,0 +1,122 @@
+"""
+Benchmark of the power-loss detection without a Pi: supply traces are replayed in place of the MCP3008 (simulatedADC.replayADC)
+through the real adcSampler.ADCSampler thread and powerSignal.PowerSignal, classified like migrator.watchPower:
+    failing    a loss is predicted before a migration could finish (migrator.isCutoffPredicted)
+    low        the filtered voltage is below the migrate threshold (migrator.isLossOfPower)
+    collapsed  the filtered voltage is below the shutdown threshold
+For every trace and sampling rate it reports how long before the supply actually crossed the migrate threshold the loss was
+predicted (lead), how long after the crossing it was detected (latency), predictions on traces that never cross (false),
+and what the sampler cost: the rate it reached, how late samples were (jitter), missed samples and CPU time.
+
+The synthetic traces are a collapse, a steady ramp down, a dip that recovers and a steady supply, with gaussian noise.
+Recorded traces (migrator.py adcrecord=<file>) replay with --trace, they run in real time, like the synthetic ones.
+
+    python3 Power_Benchmark.py [--rates 20 50 100] [--noise 0.3] [--trace recorded.txt ...] [--output power_results.jsonl]
+
+Every run appends one JSON line per trace and rate to the results file, with the commit it ran on.
+"""
+import argparse
+import json
+import threading
+import time
+from statistics import quantiles
+
+import adcSampler
+import powerSignal
+import simulatedADC
+from Migration_Benchmark import gitCommit
+
+MIGRATE_VOLTS = 12  # thresholds and migration timing of migrator.py
+SHUTDOWN_VOLTS = 4.0
+EXPECTED_MIGRATION_SECONDS = 10
+MIGRATION_MARGIN = 1.5
+HEALTHY_VOLTS = 24
+SYNTHETIC = {  # name -> (seconds, volts) points
+    "collapse": [(0, HEALTHY_VOLTS), (4, HEALTHY_VOLTS), (4.5, 2), (8, 2)],
+    "ramp": [(0, HEALTHY_VOLTS), (4, HEALTHY_VOLTS), (22, 6), (24, 6)],  # 1 V/s, reaches 12 V 12 s into the ramp
+    "dip": [(0, HEALTHY_VOLTS), (4, HEALTHY_VOLTS), (6, 15), (10, 15), (12, HEALTHY_VOLTS), (14, HEALTHY_VOLTS)],
+    "steady": [(0, HEALTHY_VOLTS), (12, HEALTHY_VOLTS)],
+}
+
+
+def crossing(trace: simulatedADC.VoltageTrace, volts: float, step=0.001):
+    """ Seconds into the trace at which it first falls below volts, None if it never does """
+    end = trace.times[-1]
+    for i in range(int(end / step) + 1):
+        if trace.at(i * step) < volts:
+            return i * step
+    return None
+
+
+def replay(points, rate: float, noise: float) -> dict:
+    """ Replay one trace in real time through the sampler and the power signal. returns the detection times and the sampler cost """
+    voltage, current = simulatedADC.replayADC(points, noise=noise)
+    ready = threading.Event()
+    signal = powerSignal.PowerSignal(MIGRATE_VOLTS, capacity=round(powerSignal.CAPACITY * rate / adcSampler.RATE))
+    sampler = adcSampler.ADCSampler(voltage, current, rate=rate, onBatch=ready.set)
+    firsts, level, count, batches = {}, None, 0, 0
+    end = voltage.start + voltage.times[-1] + 1
+    cpu = time.process_time()
+    sampler.start()
+    while time.monotonic() < end:  # the consumer side of migrator.watchPower, on a thread instead of the event loop
+        if not ready.wait(1):
+            continue
+        ready.clear()
+        batches += 1
+        count, times, voltages, _ = sampler.since(count)
+        for sampleTime, reading in zip(times, voltages):
+            signal.add(sampleTime, reading * simulatedADC.ADC_SCALE)
+        newLevel = ("collapsed" if signal.level() < SHUTDOWN_VOLTS else "low" if signal.level() < MIGRATE_VOLTS
+                    else "failing" if signal.predictedTime() < EXPECTED_MIGRATION_SECONDS * MIGRATION_MARGIN else "ok")
+        if newLevel != level:
+            level = newLevel
+            firsts.setdefault(level, time.monotonic() - voltage.start)
+    cpuPercent = (time.process_time() - cpu) / (voltage.times[-1] + 1) * 100  # sampler and consumer together
+    sampler.stop()
+    sampler.join()
+
+    times = sampler.window(voltage.times[-1] + 2)[0]
+    lateness = [(t - times[0]) - round((t - times[0]) * rate) / rate for t in times]  # seconds behind the fixed schedule
+    return {"firsts": firsts, "samples": sampler.count, "rate": sampler.rate, "overruns": sampler.overruns,
+            "jitter_p99_ms": quantiles(lateness, n=100)[98] * 1000 if len(lateness) > 1 else 0,
+            "wakeups_per_s": batches / (voltage.times[-1] + 1), "cpu_percent": cpuPercent}
+
+
+def summarize(name: str, trace: simulatedADC.VoltageTrace, result: dict) -> dict:
+    """ Lead of the prediction and latency of the detection relative to the true crossing of the migrate threshold """
+    crossed = crossing(trace, MIGRATE_VOLTS)
+    failing, low = result["firsts"].get("failing"), result["firsts"].get("low")
+    predicted = min((t for t in (failing, low) if t is not None), default=None)  # a fast collapse can skip failing
+    summary = {"trace": name, "crosses_at": crossed}
+    if crossed is None:
+        summary["false_trigger"] = predicted is not None
+    else:
+        summary["lead_s"] = crossed - predicted if predicted is not None else None
+        summary["latency_s"] = low - crossed if low is not None else None
+    summary.update({k: v for k, v in result.items() if k != "firsts"})
+    summary["levels"] = result["firsts"]
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rates", type=float, nargs="+", default=[adcSampler.RATE], help="ADC samples per second to try")
+    parser.add_argument("--noise", type=float, default=0.3, help="volts of gaussian noise added to the synthetic traces")
+    parser.add_argument("--trace", action="append", default=[], help="recorded trace to replay instead of the synthetic ones")
+    parser.add_argument("--output", default="power_results.jsonl", help="results file, one JSON line per trace and rate")
+    args = parser.parse_args()
+
+    traces = {path: simulatedADC.readTrace(path) for path in args.trace} or SYNTHETIC
+    commit = gitCommit()
+    print(f"{'trace':<12} {'rate':>5} {'lead s':>7} {'latency s':>10} {'false':>6} {'rate got':>9} {'p99 late ms':>12} "
+          f"{'missed':>7} {'wakeups/s':>10} {'cpu %':>6}")
+    with open(args.output, "a") as f:
+        for rate in args.rates:
+            for name, points in traces.items():
+                noise = args.noise if not args.trace else 0.0  # recorded traces have their own noise
+                result = summarize(name, simulatedADC.VoltageTrace(points), replay(points, rate, noise))
+                f.write(json.dumps({"rate": rate, "noise": noise, "commit": commit, **result}) + "\n")
+                fmt = lambda key, spec: format(result[key], spec) if result.get(key) is not None else "-"
+                print(f"{name:<12} {rate:>5g} {fmt('lead_s', '7.2f'):>7} {fmt('latency_s', '10.2f'):>10} "
+                      f"{str(result.get('false_trigger', '-')):>6} {result['rate']:>9.1f} {result['jitter_p99_ms']:>12.2f} "
+                      f"{result['overruns']:>7} {result['wakeups_per_s']:>10.1f} {result['cpu_percent']:>6.2f}")
@@ -0,0 +1,116 @@
+"""
+Latency of the operations on the migration critical path, as the shell commands migrator.py used to run
+and as the in-process replacements in hostOps.py. Run as root on a node (sudo is used for the shell commands, as migrator.py did):
+
+    sudo python3 Shellout_Benchmark.py [iterations] [interface=eth0] [address=192.168.137.250]
+
+The address is added to and removed from the interface, so pick one that is not in use. To try it without a node:
+
+    sudo ip netns add shellbench && sudo ip netns exec shellbench python3 Shellout_Benchmark.py 200 interface=lo address=10.0.0.1
+
+A stop-and-copy migration runs every operation the number of times in PER_MIGRATION, the last line sums what that saves.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from statistics import median
+
+import hostOps
+
+SUDO = "sudo " if shutil.which("sudo") else ""
+DUMP_FILES = ("core-1.img", "fs-1.img", "ids-1.img", "inventory.img", "mm-1.img", "pagemap-1.img", "pages-1.img", "pstree.img",
+              "seccomp.img", "stats-dump", "tcp-stream-1.img", "timens-0.img", "tty-info.img", "files.img", "fdinfo-2.img", "dump.log")
+DUMP_PATTERNS = ("core*", "fs*", "ids*", "invent*", "mm-*", "pagemap*", "pages*", "pstree*", "seccomp*", "stats*", "tcp*",
+                 "timens*", "tty*", "files*", "fdinfo*", "parent", "nohup.out", "dump.log", "restore.log", "flag.txt")
+PER_MIGRATION = {"address add": 1, "address del": 1, "find pid": 1, "rm dump files": 2, "rm flags": 2, "kill": 0, "touch": 0}
+
+
+def timeIt(function, setup=None) -> float:
+    """ Time one call of function in ms, after running setup (not timed) """
+    argument = setup() if setup else None
+    start = time.perf_counter()
+    function(argument) if setup else function()
+    return (time.perf_counter() - start) * 1000
+
+
+def shell(command: str) -> None:
+    subprocess.run(command, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def sleeper() -> subprocess.Popen:
+    """ Start a process that only waits to be killed """
+    return subprocess.Popen([sys.executable, "-c", "import time; time.sleep(600)"])
+
+
+def dumpFiles(directory: str) -> str:
+    """ Create empty files named like the images of a dump """
+    for name in DUMP_FILES:
+        hostOps.touch(os.path.join(directory, name))
+    return directory
+
+
+def percentile(times: list, fraction: float) -> float:
+    return sorted(times)[min(len(times) - 1, int(len(times) * fraction))]
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 100
+    options = dict(arg.split("=", 1) for arg in sys.argv[1:] if "=" in arg)
+    interface, address = options.get("interface", "eth0"), options.get("address", "192.168.137.250")
+    work = tempfile.mkdtemp()
+    flag = os.path.join(work, "cpflag.txt")
+    target = sleeper()  # findProcess and ps ax look for this one
+    marker = "time.sleep(600)"
+
+    def psScan():
+        lines = subprocess.run(["ps", "ax"], stdout=subprocess.PIPE).stdout.decode().split("\n")
+        return [line for line in lines if marker in line][-1].split()[0]
+
+    def addAddress():
+        shell(f"ip addr add {address}/24 dev {interface}")
+
+    def removeAddress():
+        shell(f"ip addr del {address}/24 dev {interface}")
+
+    def killShell(proc):
+        shell(f"{SUDO}kill -9 {proc.pid}")
+        proc.wait()
+
+    def killInProcess(proc):
+        hostOps.killProcess(proc.pid)
+        proc.wait()
+
+    operations = (  # name, (shell command, setup), (in-process call, setup)
+        ("address add", (lambda _: shell(f"{SUDO}ip addr add {address}/24 dev {interface}"), removeAddress),
+                        (lambda _: hostOps.addAddress(address, 24, interface), removeAddress)),
+        ("address del", (lambda _: shell(f"{SUDO}ip addr del {address}/24 dev {interface}"), addAddress),
+                        (lambda _: hostOps.deleteAddress(address, 24, interface), addAddress)),
+        ("find pid", (psScan, None), (lambda: hostOps.findProcess(marker), None)),
+        ("rm dump files", (lambda d: shell(f"cd {d} && {SUDO}rm -rf {' '.join(DUMP_PATTERNS)}"), lambda: dumpFiles(work)),
+                          (lambda d: hostOps.removePaths(*DUMP_PATTERNS, directory=d), lambda: dumpFiles(work))),
+        ("rm flags", (lambda _: shell(f"{SUDO}rm -rf {flag}"), lambda: hostOps.touch(flag)),
+                     (lambda _: hostOps.removePaths(flag), lambda: hostOps.touch(flag))),
+        ("kill", (killShell, sleeper), (killInProcess, sleeper)),
+        ("touch", (lambda: shell(f"touch {flag}"), None), (lambda: hostOps.touch(flag), None)),
+    )
+
+    print(f"{iterations} iterations, {'with' if SUDO else 'without'} sudo, ms per operation")
+    print(f"{'operation':<14} {'shell p50':>10} {'p95':>8} {'in-process p50':>15} {'p95':>8} {'speedup':>8}")
+    saved = 0.0
+    try:
+        for name, (shellCall, shellSetup), (call, setup) in operations:
+            shellTimes, times = [], []
+            for _ in range(iterations):  # alternate, so both see the same state of the machine
+                shellTimes.append(timeIt(shellCall, shellSetup))
+                times.append(timeIt(call, setup))
+            print(f"{name:<14} {median(shellTimes):>10.2f} {percentile(shellTimes, 0.95):>8.2f} "
+                  f"{median(times):>15.3f} {percentile(times, 0.95):>8.3f} {median(shellTimes) / median(times):>7.0f}x")
+            saved += PER_MIGRATION[name] * (median(shellTimes) - median(times))
+    finally:
+        removeAddress()
+        target.kill()
+        shutil.rmtree(work, ignore_errors=True)
+    print(f"saved on the critical path of a stop-and-copy migration: {saved:.1f} ms")
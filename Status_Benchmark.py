@@ -0,0 +1,43 @@
+"""
+Microbenchmark of the status broadcasts: encode and decode throughput on one core, and packet size,
+for the pickled selfState dict that used to be broadcast and for the statusProtocol packet.
+
+    python3 Status_Benchmark.py [iterations]
+
+The process is pinned to one CPU, so the numbers are per core. A node receives 5 packets per second from every other node,
+so the decode rate divided by 5 is the cluster size one core could keep up with.
+"""
+import os
+import pickle
+import sys
+import time
+
+import statusProtocol
+from statusProtocol import NodeState
+
+
+def rate(function, iterations: int) -> float:
+    """ Call a function repeatedly and return the calls per second """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return iterations / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+    # the dict that migrator.py broadcast before statusProtocol
+    selfState = {"ip": "192.168.137.12", "status": "online", "state": NodeState.BUSY, "current": 0.1234, "voltage": 0.4567,
+                 "manual": False, "migrate_cmd": False, "reboot_cmd": False, "shutdown_cmd": False, "changed": time.time()}
+    pickled = pickle.dumps(selfState)
+    packet = statusProtocol.encode(selfState, 42)
+    assert statusProtocol.decode(packet)["state"] == NodeState.BUSY
+
+    print(f"{'format':<16} {'bytes':>6} {'encode/s':>12} {'decode/s':>12} {'nodes/core':>11}")
+    for name, size, encode, decode in (
+            ("pickle", len(pickled), lambda: pickle.dumps(selfState), lambda: pickle.loads(pickled)),
+            ("statusProtocol", len(packet), lambda: statusProtocol.encode(selfState, 42), lambda: statusProtocol.decode(packet))):
+        encodes, decodes = rate(encode, iterations), rate(decode, iterations)
+        print(f"{name:<16} {size:>6} {encodes:>12,.0f} {decodes:>12,.0f} {decodes / 5:>11,.0f}")
@@ -0,0 +1,92 @@
+"""
+Synthetic workload for Migration_Benchmark.py. It stands in for videoboard/vidboardmain.py: it takes the same --bind_ip argument
+and serves HTTP on port 8000, so the migrator runs, dumps, restores and probes it exactly like the real process.
+It keeps a configurable amount of memory resident and dirties it at a configurable rate, so every migration mode
+sees a known image size, and pre-copy sees a known dirty rate.
+The settings are read from workload.json next to the script, so they travel with the process directory:
+
+    {"rss_mb": 64, "dirty_mb_s": 8, "compressible": 0.5}
+
+compressible is the fraction of every page that holds a repeating pattern instead of random bytes.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PAGE_SIZE = 4096
+SETTINGS_FILE = "workload.json"
+DIRTY_PERIOD = 0.01  # seconds between two batches of dirtied pages
+PATTERN = b"videoboard frame " * (PAGE_SIZE // 16)  # compressible filler for the pages
+
+
+def fillMemory(size: int, compressible: float) -> bytearray:
+    """ Allocate the memory and write every page, so all of it is resident and ends up in the images """
+    memory = bytearray(size)
+    randomBytes = int(PAGE_SIZE * (1 - compressible))
+    for offset in range(0, size, PAGE_SIZE):
+        memory[offset:offset + randomBytes] = os.urandom(randomBytes)
+        memory[offset + randomBytes:offset + PAGE_SIZE] = PATTERN[:PAGE_SIZE - randomBytes]
+    return memory
+
+
+class Dirtier(threading.Thread):
+    """ Writes to the memory at a fixed rate, sweeping through it one page at a time """
+
+    def __init__(self, memory: bytearray, rate: float):
+        self.memory = memory
+        self.pagesPerPeriod = int(rate * DIRTY_PERIOD / PAGE_SIZE)
+        self.cursor = 0
+        self.dirtied = 0  # pages dirtied since the start
+        self._running = True  # sentinel value for the thread
+        super().__init__(daemon=True)
+
+    def run(self):
+        pages = len(self.memory) // PAGE_SIZE
+        while self._running:
+            for _ in range(self.pagesPerPeriod):
+                offset = self.cursor * PAGE_SIZE + self.dirtied % PAGE_SIZE  # a different byte every sweep
+                self.memory[offset] = (self.memory[offset] + 1) % 256
+                self.cursor = (self.cursor + 1) % pages
+                self.dirtied += 1
+            time.sleep(DIRTY_PERIOD)
+
+    def stop(self):
+        self._running = False  # set the sentinel value to stop the thread
+
+
+def makeHandler(dirtier: Dirtier):
+    """ Create the request handler, it answers every GET with the number of dirtied pages """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = f"ok {dirtier.dirtied}\n".encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # the migrator polls the workload, do not log every request
+
+    return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bind_ip", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    settings = {"rss_mb": 64, "dirty_mb_s": 8, "compressible": 0.5}
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), SETTINGS_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            settings.update(json.load(f))
+
+    memory = fillMemory(int(settings["rss_mb"] * 1024 * 1024), settings["compressible"])
+    dirtier = Dirtier(memory, settings["dirty_mb_s"] * 1024 * 1024)
+    dirtier.start()
+    ThreadingHTTPServer((args.bind_ip, args.port), makeHandler(dirtier)).serve_forever()
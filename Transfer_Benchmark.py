@@ -0,0 +1,72 @@
+"""
+Compare the per-phase latency of the old per-call `sudo scp` under pexpect with the pooled transfer service,
+for the "transfer" and "flag" phases of a migration (the "Rsyncing" and "Finish flag" phases of the old migrate_stats.txt).
+Run on a node, with the migrator service running on the other node:
+
+    sudo python3 Transfer_Benchmark.py <other node ip> [directory] [repetitions]
+
+The directory (default /home/pi/videoboard) is copied to /tmp on the other node with scp and to /home/pi/transfer-benchmark
+with the transfer service. The finish flag phase of the service is timed as one request round trip on the pooled connection,
+so the other node does not try to restore anything. The same phases of the real migrations in the span log are printed alongside.
+scp copies the whole directory every time. The service only sends the files whose content the other node does not have
+(see appManifest.py): everything on the first run, then nothing unless a file changed, so both runs are reported.
+"""
+import os
+import sys
+import time
+from statistics import median
+
+import pexpect
+import tracing
+import transfer
+
+
+def scp(source: str, ip: str, destination: str, recursive=False, username="pi", password="pi") -> None:
+    """ Copy the way the migrator used to: a new sudo scp for every call, with the password typed in """
+    child = pexpect.spawn(f"sudo scp {'-r' if recursive else ''} {source} {username}@{ip}:{destination}", timeout=120)
+    child.expect([f"{username}@{ip}'s password: "])
+    child.sendline(password)
+    child.expect(pexpect.EOF)
+    child.close()
+    if child.exitstatus != 0:
+        raise RuntimeError(f"scp of {source} failed")
+
+
+def timed(function) -> float:
+    """ Run a function and return how long it took in ms """
+    start = time.perf_counter()
+    function()
+    return (time.perf_counter() - start) * 1000
+
+
+if __name__ == '__main__':
+    ip = sys.argv[1]
+    directory = sys.argv[2] if len(sys.argv) > 2 else "/home/pi/videoboard"
+    repetitions = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    os.system("touch /tmp/cpflag.txt")
+
+    pool = transfer.ConnectionPool(transfer.loadKey())
+    connect_ms = timed(lambda: pool.get(ip))  # paid once per peer, before the first migration
+    results = {"transfer": ([], []), "flag": ([], [])}
+    sent = []  # bytes the service sent on every run
+    for _ in range(repetitions):
+        results["transfer"][0].append(timed(lambda: scp(directory, ip, "/tmp/", recursive=True)))
+        results["flag"][0].append(timed(lambda: scp("/tmp/cpflag.txt", ip, "/tmp/")))
+        results["transfer"][1].append(timed(lambda: sent.append(pool.get(ip).sendFiles("transfer-benchmark", directory))))
+        results["flag"][1].append(timed(lambda: pool.get(ip).ping()))
+    pool.closeAll()
+
+    print(f"Median over {repetitions} runs, copying {directory} to {ip} (first connection of the pool took {connect_ms:.0f} ms)")
+    print(f"{'Phase':<15} {'scp':>10} {'service':>10}")
+    for phase, (old, new) in results.items():
+        print(f"{phase:<15} {median(old):>7.0f} ms {median(new):>7.0f} ms")
+    print(f"The service sent {sent[0] / 1e6:.1f} MB on the first run ({results['transfer'][1][0]:.0f} ms)"
+          + (f", {median(sent[1:]) / 1e6:.1f} MB on the later runs" if len(sent) > 1 else ""))
+
+    if os.path.exists(tracing.SPAN_LOG):
+        spans = tracing.readSpans([tracing.SPAN_LOG])
+        print(f"\nMigrations from this node ({tracing.SPAN_LOG}):")
+        for phase in ("transfer", "flag"):
+            durations = [span["duration_ms"] for span in spans if span["phase"] == phase]
+            if durations:
+                print(f"{phase:<15} p50 {tracing.percentile(durations, 50):.0f} ms over {len(durations)} migrations")
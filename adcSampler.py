@@ -0,0 +1,124 @@
+"""
+Samples the voltage and current channels of the ADC on a thread, at a fixed rate, into a preallocated ring buffer.
+The channels are anything with a .value like gpiozero's MCP3008: the real ADC, or a replay of a trace from simulatedADC.py.
+Consumers never block the sampler:
+    latest          (time, voltage, current) of the newest sample, replaced as a whole so it is read without a lock
+    since(count)    the samples added after an earlier count, to feed every sample into a filter (migrator.watchPower)
+    window(seconds) the samples of the last seconds
+The raw readings are stored, scaled like MCP3008.value. Every `batch` samples the onBatch callback is called,
+so a consumer on an event loop wakes up once per batch instead of once per sample.
+A recorder writes every sample to a trace file (seconds, volts, current reading) that simulatedADC.replayADC() plays back.
+"""
+import threading
+import time
+from array import array
+
+import simulatedADC
+
+RATE = 20  # samples per second
+BATCH = 2  # samples per onBatch call
+CAPACITY = 4096  # samples in the ring buffer, 3.4 minutes at 20 samples per second
+
+
+class TraceRecorder:
+    """ Writes samples to a trace file in the format of simulatedADC.readTrace, with the raw current reading as a third column """
+
+    def __init__(self, path: str, vScale=simulatedADC.ADC_SCALE):
+        self.file = open(path, "w")
+        self.vScale = vScale
+        self.start = None
+        self.file.write("# seconds volts current, recorded by adcSampler.TraceRecorder\n")
+
+    def write(self, times, voltages, currents) -> None:
+        if self.start is None and times:
+            self.start = times[0]
+        self.file.writelines(f"{t - self.start:.4f} {v * self.vScale:.4f} {c:.5f}\n"
+                             for t, v, c in zip(times, voltages, currents))
+        self.file.flush()  # the interesting part of a trace is the power loss at its end
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ADCSampler(threading.Thread):
+    """ Reads the voltage and current channels at a fixed rate into a ring buffer, see the module docstring """
+
+    def __init__(self, voltage, current, rate=RATE, batch=BATCH, capacity=CAPACITY, onBatch=None, recorder=None):
+        self.voltage, self.current = voltage, current
+        self.period = 1 / rate  # seconds between samples
+        self.batch = batch
+        self.capacity = capacity
+        self.times = array("d", bytes(8 * capacity))  # preallocated, so sampling never allocates
+        self.voltages = array("d", bytes(8 * capacity))
+        self.currents = array("d", bytes(8 * capacity))
+        self.count = 0  # samples taken so far, the next one goes to count % capacity
+        self.latest = None  # (time, voltage, current) of the newest sample
+        self.onBatch = onBatch
+        self.recorder = recorder
+        self.overruns = 0  # sample times that were missed because a read took longer than the period
+        self._running = True # sentinel value for the thread
+        super().__init__(daemon=True)
+
+    def sample(self) -> None:
+        """ Read both channels once into the ring buffer """
+        now = time.monotonic()
+        voltage, current = self.voltage.value, self.current.value
+        index = self.count % self.capacity
+        self.times[index], self.voltages[index], self.currents[index] = now, voltage, current
+        self.latest = (now, voltage, current)
+        self.count += 1  # published last, so a reader never sees a count whose sample is not written yet
+
+    def run(self):
+        deadline = time.monotonic()
+        while self._running:
+            start = self.count
+            for _ in range(self.batch):  # sample on a fixed schedule, a late sample does not shift the ones after it
+                self.sample()
+                deadline += self.period
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    missed = int(-delay // self.period) + 1
+                    self.overruns += missed
+                    deadline += missed * self.period
+            if self.recorder is not None:
+                self.recorder.write(*self.since(start)[1:])
+            if self.onBatch is not None:
+                self.onBatch()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def stop(self):
+        self._running = False # set the sentinel value to stop the thread
+
+    def since(self, count: int) -> tuple:
+        """
+        Get the samples taken after an earlier count (0 for all). returns (count, times, voltages, currents),
+        pass the count to the next call. Samples that were overwritten before they were read are skipped.
+        """
+        while True:
+            end = self.count
+            start = max(count, end - self.capacity + self.batch)  # the sampler may overwrite the oldest ones while they are copied
+            times, voltages, currents = [], [], []
+            for n in range(start, end):
+                index = n % self.capacity
+                times.append(self.times[index])
+                voltages.append(self.voltages[index])
+                currents.append(self.currents[index])
+            if self.count - start <= self.capacity:  # nothing copied was overwritten meanwhile
+                return end, times, voltages, currents
+
+    def window(self, seconds: float) -> tuple:
+        """ Get the (times, voltages, currents) of the samples of the last seconds """
+        _, times, voltages, currents = self.since(max(0, self.count - int(seconds / self.period) - 1))
+        first = next((i for i, t in enumerate(times) if t >= times[-1] - seconds), 0) if times else 0
+        return times[first:], voltages[first:], currents[first:]
+
+    @property
+    def rate(self) -> float:
+        """ Measured samples per second over the ring buffer """
+        times = self.window(self.capacity * self.period)[0]
+        if len(times) < 2 or times[-1] == times[0]:
+            return 0.0
+        return (len(times) - 1) / (times[-1] - times[0])
@@ -0,0 +1,110 @@
+"""
+Persistent hash manifests of the process directories, so a migration only sends the application files that the receiving
+node does not have with the same content, instead of the whole tree with every media file the process serves.
+Every node keeps one manifest per process directory in MANIFEST_DIR: relative path -> [size, modification time in ns, digest].
+A file is only hashed again when its size or modification time changed, so a large media file is hashed once, not on every
+migration. A node that received a file records the sender's digest with it, so it never hashes what it received.
+The image directories (IMAGE_DIRS) are left out: their files are new with every dump and are always sent.
+A directory is refreshed from several threads (the refresh when a process starts, standby rounds, migrations and the
+transfer server), so they all share one DirectoryManifest per directory (see manifestFor), and a refresh that is running
+is waited for instead of hashing the same files a second time.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+MANIFEST_DIR = "/home/pi/.manifests"  # on the SD card next to the process directories, so the digests survive a restart
+IMAGE_DIRS = ("images", "precopy")  # top level directories of CRIU images in a process directory, see migrator.py
+BLOCK_SIZE = 1024 * 1024  # bytes read at a time while hashing
+
+manifests = {}  # path of the manifest file -> DirectoryManifest, see manifestFor
+manifestsLock = threading.Lock()
+
+
+def newDigest():
+    """ Start a content hash, for a file that is hashed while it is received """
+    return hashlib.blake2b(digest_size=16)
+
+
+def fileDigest(path: str) -> str:
+    """ Get the content hash of a file """
+    digest = newDigest()
+    with open(path, "rb") as f:
+        while block := f.read(BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def isImage(path: str) -> bool:
+    """ Check whether a path (relative to the process directory) is in one of the image directories """
+    return path.split("/", 1)[0] in IMAGE_DIRS
+
+
+class DirectoryManifest:
+    """ The manifest of one process directory, loaded from MANIFEST_DIR and saved back when it changed. Thread safe """
+
+    def __init__(self, root: str, name=None, directory=MANIFEST_DIR):
+        self.root = root
+        self.path = os.path.join(directory, f"{name or os.path.basename(root)}.json")
+        self.entries = {}
+        self.changed = False
+        self.lock = threading.RLock()  # held for a whole refresh, so a second one waits and finds the files hashed
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):  # no manifest yet, or it was cut off when the node lost power, every file is hashed again
+            pass
+
+    def refresh(self) -> dict:
+        """ Hash the application files that are new or changed since the last refresh. returns relative path -> digest """
+        with self.lock:
+            return self._refresh()
+
+    def _refresh(self) -> dict:
+        seen = {}
+        for directory, dirs, files in os.walk(self.root):
+            if directory == self.root:
+                dirs[:] = [name for name in dirs if name not in IMAGE_DIRS]
+            for name in files:
+                path = os.path.join(directory, name)
+                if os.path.islink(path) or not os.path.isfile(path):
+                    continue
+                relative, stat = os.path.relpath(path, self.root), os.stat(path)
+                entry = self.entries.get(relative)
+                if entry is None or entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+                    entry = self.entries[relative] = [stat.st_size, stat.st_mtime_ns, fileDigest(path)]
+                    self.changed = True
+                seen[relative] = entry[2]
+        for relative in set(self.entries) - set(seen):  # removed since the last refresh
+            del self.entries[relative]
+            self.changed = True
+        self.save()
+        return seen
+
+    def received(self, relative: str, size: int, mtime: int, digest: str) -> None:
+        """ Record a file that was received with the digest the sender sent, call save() once all of them are in """
+        with self.lock:
+            self.entries[relative] = [size, mtime, digest]
+            self.changed = True
+
+    def save(self) -> None:
+        with self.lock:
+            if not self.changed:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd, temporary = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=os.path.basename(self.path), suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(temporary, self.path)  # replaced in one step, a power loss leaves the old or the new manifest
+            self.changed = False
+
+
+def manifestFor(root: str, name=None, directory=MANIFEST_DIR) -> DirectoryManifest:
+    """ Get the manifest of a process directory, the same one for every thread """
+    path = os.path.join(directory, f"{name or os.path.basename(root)}.json")
+    with manifestsLock:
+        if path not in manifests or manifests[path].root != root:
+            manifests[path] = DirectoryManifest(root, name, directory)
+        return manifests[path]
@@ -0,0 +1,107 @@
+"""
+Content-addressed store of image chunks, kept on every node so that migrations only send chunks the receiver does not already have.
+Chunks are files named by the hash of their content. The store has a size budget, and the least recently used chunks are evicted first.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+CHUNK_SIZE = 64 * 1024  # images are split into chunks of this size (a multiple of the page size, so unchanged pages give equal chunks)
+STORE_DIR = "/home/pi/chunkstore"  # on the SD card, so the chunks survive the node losing power
+STORE_BUDGET = 512 * 1024 * 1024  # maximum size of all chunks in the store, in bytes
+
+
+def chunkDigest(data: bytes) -> str:
+    """ Get the content hash of a chunk """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def fileManifest(path: str) -> list:
+    """ Split a file into chunks, returns the list of chunk digests in file order """
+    digests = []
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digests.append(chunkDigest(chunk))
+    return digests
+
+
+class ChunkStore:
+    """ Chunks kept on disk keyed by their digest, with least recently used eviction once the size budget is exceeded """
+
+    def __init__(self, directory=STORE_DIR, budget=STORE_BUDGET):
+        self.directory = directory
+        self.budget = budget
+        self.lock = threading.Lock()  # the store is shared by the receiving threads and the migration
+        self.chunks = OrderedDict()  # digest -> size, least recently used first
+        self.size = 0
+        os.makedirs(directory, exist_ok=True)
+        for entry in os.scandir(directory):
+            if entry.name.endswith(".tmp"):  # chunk that was being written when the node lost power
+                os.remove(entry.path)
+        entries = [entry for entry in os.scandir(directory) if entry.is_file()]
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):  # rebuild the LRU order from the access times
+            self.chunks[entry.name] = entry.stat().st_size
+            self.size += entry.stat().st_size
+
+    def __contains__(self, digest: str) -> bool:
+        with self.lock:
+            return digest in self.chunks
+
+    def missing(self, digests) -> list:
+        """
+        Get the digests (without duplicates, in order) that are not in the store.
+        The ones that are in the store are marked as recently used, so they are not evicted before they are read.
+        """
+        missing = {}
+        with self.lock:
+            for digest in digests:
+                if digest in self.chunks:
+                    self.chunks.move_to_end(digest)
+                else:
+                    missing[digest] = None
+        return list(missing)
+
+    def get(self, digest: str) -> bytes:
+        """ Read a chunk and mark it as recently used. raises KeyError if the chunk is not in the store """
+        with self.lock:
+            if digest not in self.chunks:
+                raise KeyError(digest)
+            self.chunks.move_to_end(digest)
+        path = os.path.join(self.directory, digest)
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)  # keep the LRU order across restarts
+        return data
+
+    def put(self, digest: str, data: bytes) -> None:
+        """ Add a chunk to the store (or mark it as recently used if it is already there), then evict down to the budget """
+        with self.lock:
+            if digest in self.chunks:
+                self.chunks.move_to_end(digest)
+                return
+        path = os.path.join(self.directory, digest)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)  # a chunk is either complete or absent, even if power is lost while writing it
+        with self.lock:
+            if digest not in self.chunks:  # another thread may have stored the same chunk meanwhile
+                self.chunks[digest] = len(data)
+                self.size += len(data)
+            self.evict()
+
+    def putFile(self, path: str) -> None:
+        """ Add every chunk of a file to the store """
+        with open(path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                self.put(chunkDigest(chunk), chunk)
+
+    def evict(self) -> None:
+        """ Remove the least recently used chunks until the store fits in its budget. Must be called with the lock held """
+        while self.size > self.budget and self.chunks:
+            digest, size = self.chunks.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(os.path.join(self.directory, digest))
+            except FileNotFoundError:
+                pass
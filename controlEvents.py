@@ -0,0 +1,67 @@
+"""
+Turns the control flag files (startflag*.txt, cpflag*.txt, force_*.txt) into events, so the main loop waits on an event queue
+instead of polling for the files. Uses inotify through ctypes, so there is nothing to install.
+The inotify file descriptor is registered with the asyncio event loop of the node (loop.add_reader), so no thread is needed.
+"""
+import ctypes
+import ctypes.util
+import fnmatch
+import os
+import struct
+
+IN_CLOSE_WRITE = 0x008  # a file opened for writing was closed (also touch on a new file), so a flag with content is complete
+IN_MOVED_TO = 0x080  # a file was renamed into the directory
+EVENT_HEADER = struct.Struct("iIII")  # struct inotify_event: wd, mask, cookie, len, followed by len bytes of name
+
+libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+
+class FlagWatcher:
+    """
+    Watches a directory with inotify for the flag files. Read it with readFlags() when its fd is readable.
+    names are file names or glob patterns (e.g. cpflag*.txt for the finish flags of every process)
+    """
+
+    def __init__(self, directory: str, names):
+        self.directory = directory
+        self.names = tuple(names)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, directory.encode(), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch on {directory} failed")
+
+    def presentFlags(self) -> list:
+        """ Get the flags that already exist, they were written before the watch started and will never produce an event """
+        return [name for name in sorted(os.listdir(self.directory)) if self.isFlag(name)]
+
+    def isFlag(self, name: str) -> bool:
+        return any(fnmatch.fnmatchcase(name, pattern) for pattern in self.names)
+
+    def readFlags(self) -> list:
+        """ Get the names of the flag files written since the last call, without blocking """
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        flags, offset = [], 0
+        while offset < len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0").decode()
+            offset += EVENT_HEADER.size + length
+            if self.isFlag(name):
+                flags.append(name)
+        return flags
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def consumeFlag(path: str) -> bool:
+    """ Remove a flag file. returns True if it was there, so a flag is acted on once even if two events arrive for it """
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
@@ -0,0 +1,189 @@
+"""
+Plans the evacuation of a node that hosts several processes: which node every process goes to, and in which order
+the transfers run, so the processes are running again as soon as possible and within the power the node has left.
+    assignment  every process goes to the destination where its transfer finishes first, among the nodes with the free RAM
+                for it. A lower placement score counts as SCORE_SECONDS of extra transfer time, so a slightly faster node
+                does not win over a much healthier one
+    order       higher priority first, then smallest first (shortest job first keeps the sum of the downtimes lowest)
+    uplink      transfers to different nodes run at the same time, as long as their rates add up to at most the uplink of
+                this node, transfers to the same node run one after the other (they share its pooled connection)
+    budget      a process whose transfer would end after the predicted power budget is dumped to local disk instead,
+                it is restored here when the power is back instead of being lost halfway through a transfer
+    standby     a process with a warm standby (see standby.py) only has its delta left to dump and send to its buddy node,
+                so going there costs the delta instead of the whole image
+All processes are dumped at once, a transfer can start when its dump is done (the image size at DUMP_RATE).
+UplinkGate admits the transfers of a running evacuation under the same bounds, in the order of the plan.
+"""
+import asyncio
+import math
+from contextlib import asynccontextmanager
+
+DUMP_RATE = 40e6  # bytes per second criu writes images at, for the planned end of a dump
+SCORE_SECONDS = 5  # seconds of transfer time a placement score of 0 costs, against a score of 1
+UPLINK = 11e6  # bytes per second this node can send in total, the 100 Mbit ethernet of the Pi
+
+
+class Workload:
+    """
+    A process to evacuate: its name, image size in bytes, resident memory in MiB and priority (higher goes first).
+    A process with a warm standby has a buddy node that already holds all but warmSize bytes of its image
+    """
+
+    def __init__(self, name: str, size: float, ramMB=0.0, priority=0, buddy=None, warmSize=0.0):
+        self.name = name
+        self.size = size
+        self.ramMB = ramMB
+        self.priority = priority
+        self.buddy = buddy
+        self.warmSize = warmSize
+
+    def sizeTo(self, ip) -> float:
+        """ Bytes to dump and send for the process to go to a node """
+        return min(self.warmSize, self.size) if self.buddy is not None and ip == self.buddy else self.size
+
+
+class Destination:
+    """ A node that can take processes: score from placement.py, bandwidth to it in bytes per second, free RAM (None if unknown) """
+
+    def __init__(self, ip, score: float, bandwidth: float, freeRamMB=None):
+        self.ip = ip
+        self.score = score
+        self.bandwidth = bandwidth
+        self.freeRamMB = freeRamMB
+
+
+class Transfer:
+    """ Where and when one process is planned to go. ip is None for a process that is dumped to local disk """
+
+    def __init__(self, workload: Workload, ip, order: int, start: float, finish: float, rate: float):
+        self.workload = workload
+        self.ip = ip
+        self.order = order  # position in the plan, the uplink is granted in this order
+        self.start = start  # seconds after the evacuation started
+        self.finish = finish
+        self.rate = rate
+
+    def __repr__(self) -> str:
+        target = self.ip if self.ip is not None else "local disk"
+        return f"<{self.workload.name} -> {target}, {self.start:.1f}-{self.finish:.1f} s>"
+
+
+class Plan:
+    """ The transfers of an evacuation in plan order, with its makespan (when the last process is done) and the budget """
+
+    def __init__(self, transfers: list, budget: float):
+        self.transfers = transfers
+        self.budget = budget
+
+    @property
+    def makespan(self) -> float:
+        return max((transfer.finish for transfer in self.transfers), default=0.0)
+
+    @property
+    def downtime(self) -> float:
+        """ Sum of the planned downtimes, every process is frozen from the start of the evacuation until its transfer is done """
+        return sum(transfer.finish for transfer in self.transfers if transfer.ip is not None)
+
+    def get(self, name: str) -> Transfer:
+        return next(transfer for transfer in self.transfers if transfer.workload.name == name)
+
+
+def uplinkUse(intervals: list, time: float) -> float:
+    """ Bytes per second used at a time by the planned (start, finish, rate) intervals """
+    return sum(rate for start, finish, rate in intervals if start <= time < finish)
+
+
+def earliestStart(intervals: list, ready: float, duration: float, rate: float, uplink: float) -> float:
+    """ Earliest time from ready on at which a transfer of duration at rate fits under the uplink next to the planned intervals """
+    for start in sorted({ready} | {finish for _, finish, _ in intervals if finish > ready}):
+        # the use only goes up where another interval starts, so checking those points is enough
+        points = [start] + [s for s, _, _ in intervals if start < s < start + duration]
+        if all(uplinkUse(intervals, point) + rate <= uplink * (1 + 1e-9) for point in points):
+            return start
+    return max([ready] + [finish for _, finish, _ in intervals])  # unreachable, after every interval the uplink is free
+
+
+def plan(workloads: list, destinations: list, uplink=UPLINK, budget=math.inf, dumpRate=DUMP_RATE) -> Plan:
+    """ Plan an evacuation, see the module docstring """
+    freeAt = {destination.ip: 0.0 for destination in destinations}  # when the last planned transfer to a node ends
+    freeRam = {destination.ip: destination.freeRamMB for destination in destinations}
+    intervals, transfers = [], []
+    for order, workload in enumerate(sorted(workloads, key=lambda workload: (-workload.priority, workload.size))):
+        best, bestCost = None, math.inf
+        for destination in destinations:
+            if freeRam[destination.ip] is not None and freeRam[destination.ip] < workload.ramMB:
+                continue
+            size = workload.sizeTo(destination.ip)
+            ready = size / dumpRate
+            rate = min(destination.bandwidth, uplink)
+            duration = size / rate
+            start = earliestStart(intervals, max(ready, freeAt[destination.ip]), duration, rate, uplink)
+            cost = start + duration + SCORE_SECONDS * (1 - destination.score)
+            if cost < bestCost:
+                best, bestCost = Transfer(workload, destination.ip, order, start, start + duration, rate), cost
+        if best is None or best.finish > budget:  # no node can take it, or it would not make it in time
+            transfers.append(Transfer(workload, None, order, 0.0, workload.size / dumpRate, 0.0))
+            continue
+        transfers.append(best)
+        intervals.append((best.start, best.finish, best.rate))
+        freeAt[best.ip] = best.finish
+        if freeRam[best.ip] is not None:
+            freeRam[best.ip] -= workload.ramMB
+    return Plan(transfers, budget)
+
+
+class UplinkGate:
+    """
+    Admits transfers while their planned rates add up to at most the uplink and no other transfer to the same node runs.
+    Waiting transfers are admitted in plan order, a later one goes ahead when an earlier one does not fit yet.
+    A transfer alone is always admitted. Only used from the event loop, so it needs no lock
+    """
+
+    def __init__(self, uplink=UPLINK):
+        self.uplink = uplink
+        self.used = 0.0
+        self.active = 0  # transfers admitted and not released yet
+        self.busy = set()  # nodes a transfer is running to
+        self.waiting = []  # (order, future, rate, ip) sorted by order
+
+    @asynccontextmanager
+    async def slot(self, order: int, rate: float, ip=None):
+        rate = min(rate, self.uplink)
+        admitted = asyncio.get_running_loop().create_future()
+        self.waiting.append((order, admitted, rate, ip))
+        self.waiting.sort(key=lambda entry: entry[0])
+        self.admit()
+        try:
+            await admitted
+        except asyncio.CancelledError:
+            if admitted.done() and not admitted.cancelled():  # admitted as it was cancelled, give the slot back
+                self.release(rate, ip)
+            else:
+                self.waiting = [entry for entry in self.waiting if entry[1] is not admitted]
+                self.admit()
+            raise
+        try:
+            yield
+        finally:
+            self.release(rate, ip)
+
+    def fits(self, rate: float, ip) -> bool:
+        return ip not in self.busy and (self.active == 0 or self.used + rate <= self.uplink * (1 + 1e-9))
+
+    def release(self, rate: float, ip) -> None:
+        self.used -= rate
+        self.active -= 1
+        self.busy.discard(ip)
+        self.admit()
+
+    def admit(self) -> None:
+        """ Admit the waiting transfers that fit, in plan order """
+        for entry in list(self.waiting):
+            _, admitted, rate, ip = entry
+            if self.fits(rate, ip):
+                self.waiting.remove(entry)
+                self.used += rate
+                self.active += 1
+                if ip is not None:
+                    self.busy.add(ip)
+                admitted.set_result(None)
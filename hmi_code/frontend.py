@@ -1,11 +1,12 @@
-import pickle
 import socket
 import sys
 import time
-from enum import Enum, auto
 from ipaddress import IPv4Address # TODO: use this to validate IP addresses and make displaying them easier
 import wexpect
 
+# statusProtocol.py is shared with the nodes: run with the repository root on PYTHONPATH, the exe bundles it (output/py-to-exe-config.json)
+from statusProtocol import NodeState, decode
+
 #TODO: Should not import "*". This is bad practice. Only import what you need
 from customWidgets import *
 from PySide6.QtCore import *
@@ -17,16 +18,6 @@ DEBUG = True # Set to True to enable debug messages
 nodeStatuses = {} # Holds the status of all nodes in the network using the format {"ip": (status_info, time_last_updated)}
 
 
-class NodeState(Enum):
-    IDLE = auto()			# Node is idle and ready to accept
-    BUSY = auto()			# Node is busy with processes and cannot accept processes
-    MIGRATING = auto()  	# Node is migrating to another and cannot accept processes
-    SHUTDOWN = auto()		# Node is shutting down and cannot accept processes
-
-    def __str__(self):
-        return self.name
-
-
 class MainWindow(QMainWindow):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -89,7 +80,7 @@ class asyncWorker(QThread):
 
         while self._running: # Loop until the thread is stopped using the sentinal value
             try:
-                PACKET = pickle.loads(sock.recvfrom(sockSize)[0])
+                PACKET = decode(sock.recvfrom(sockSize)[0])
 
                 nodeStatuses[PACKET['ip']] = PACKET, time.time() # Update the status of the node in the dictionary
 
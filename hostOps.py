@@ -0,0 +1,200 @@
+"""
+In-process replacements for the shell commands on the migration path (ip addr, kill, ps ax, rm -rf, touch).
+Each of those forked a shell and often sudo, which costs tens of ms on a Pi, several times per migration.
+The migrator service runs as root, so the same work is done here with syscalls:
+    addAddress/deleteAddress   IPv4 address aliases through an rtnetlink socket (RTM_NEWADDR/RTM_DELADDR)
+    announceAddress            gratuitous ARP through a packet socket (arping -U and -A)
+    killProcess                os.kill
+    findProcess                a scan of /proc/<pid>/cmdline
+    removePaths, touch         glob + os.remove/shutil.rmtree, and open()
+    residentMB, freeMemoryMB, freeDiskMB   /proc/<pid>/status, /proc/meminfo and statvfs (ps, free, df)
+See Shellout_Benchmark.py for the latency of each against the command it replaces.
+"""
+import glob
+import os
+import shutil
+import signal
+import socket
+import struct
+
+NETLINK_ROUTE = 0
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+NLMSG_ERROR = 2
+NLM_F_REQUEST = 0x001
+NLM_F_ACK = 0x004
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+RT_SCOPE_UNIVERSE = 0
+NLMSG_HEADER = struct.Struct("=IHHII")  # struct nlmsghdr: length, type, flags, sequence, port id
+IFADDRMSG = struct.Struct("=BBBBI")  # struct ifaddrmsg: family, prefix length, flags, scope, interface index
+RTATTR = struct.Struct("=HH")  # struct rtattr: length, type, followed by the value padded to 4 bytes
+NLMSG_ERRNO = struct.Struct("=i")  # an error message starts with the negative errno, 0 is an acknowledgement
+ETH_P_ARP = 0x0806
+ETH_P_IP = 0x0800
+ARP_REQUEST = 1
+ARP_REPLY = 2
+ETHERNET_HEADER = struct.Struct("!6s6sH")  # destination MAC, source MAC, ethertype
+ARP_PACKET = struct.Struct("!HHBBH6s4s6s4s")  # hardware type, protocol type, address lengths, operation, sender MAC and IP, target MAC and IP
+BROADCAST_MAC = b"\xff" * 6
+ARP_ANNOUNCEMENTS = 3  # gratuitous ARP rounds after an alias comes up, a single one may be lost while the switch relearns the port
+ARP_INTERVAL = 0.2  # seconds between the rounds
+NETLINK_TIMEOUT = 2  # seconds to wait for the kernel to answer an address change
+
+sequence = 0  # sequence number of the last netlink request
+
+
+def attribute(kind: int, value: bytes) -> bytes:
+    """ Pack a netlink attribute, padded to a multiple of 4 bytes """
+    data = RTATTR.pack(RTATTR.size + len(value), kind) + value
+    return data + b"\0" * (-len(data) % 4)
+
+
+def changeAddress(message: int, address: str, prefix: int, interface: str) -> bool:
+    """
+    Send an RTM_NEWADDR or RTM_DELADDR request for an IPv4 address and wait for the kernel's answer. returns True if it was applied,
+    raises OSError if no answer arrives within NETLINK_TIMEOUT
+    """
+    global sequence
+    sequence += 1
+    packed = socket.inet_aton(str(address))
+    body = IFADDRMSG.pack(socket.AF_INET, prefix, 0, RT_SCOPE_UNIVERSE, socket.if_nametoindex(interface))
+    body += attribute(IFA_LOCAL, packed) + attribute(IFA_ADDRESS, packed)
+    flags = NLM_F_REQUEST | NLM_F_ACK | (NLM_F_CREATE | NLM_F_EXCL if message == RTM_NEWADDR else 0)
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE) as sock:
+        sock.bind((0, 0))
+        sock.settimeout(NETLINK_TIMEOUT)  # a lost acknowledgement must not hang the caller
+        sock.sendto(NLMSG_HEADER.pack(NLMSG_HEADER.size + len(body), message, flags, sequence, 0) + body, (0, 0))
+        while True:
+            try:
+                reply = sock.recv(4096)
+            except socket.timeout:
+                raise OSError(f"netlink: no answer within {NETLINK_TIMEOUT} s ({address}/{prefix} dev {interface})")
+            offset = 0
+            while offset + NLMSG_HEADER.size <= len(reply):
+                length, kind, _, replySequence, _ = NLMSG_HEADER.unpack_from(reply, offset)
+                if kind == NLMSG_ERROR and replySequence == sequence:
+                    error, = NLMSG_ERRNO.unpack_from(reply, offset + NLMSG_HEADER.size)
+                    if error != 0:
+                        print(f"netlink: {os.strerror(-error)} ({address}/{prefix} dev {interface})")
+                    return error == 0
+                offset += (length + 3) & ~3
+
+
+def addAddress(address, prefix=24, interface="eth0") -> bool:
+    """ Same as `ip addr add <address>/<prefix> dev <interface>`. returns False if the address is already there """
+    return changeAddress(RTM_NEWADDR, address, prefix, interface)
+
+
+def deleteAddress(address, prefix=24, interface="eth0") -> bool:
+    """ Same as `ip addr del <address>/<prefix> dev <interface>`. returns False if the address is not there """
+    return changeAddress(RTM_DELADDR, address, prefix, interface)
+
+
+def announceAddress(address, interface="eth0") -> bool:
+    """
+    Broadcast a gratuitous ARP request and reply for an address that just came up on an interface, so switches learn the port
+    of its new MAC and clients update their ARP cache instead of sending to the old node until the entry expires.
+    Both kinds are sent, hosts differ in which one they accept. returns False if the interface cannot send them
+    """
+    try:
+        with open(f"/sys/class/net/{interface}/address") as f:
+            mac = bytes.fromhex(f.read().strip().replace(":", ""))
+        packed = socket.inet_aton(str(address))
+        with socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ARP)) as sock:
+            sock.bind((interface, 0))
+            for operation, target in ((ARP_REQUEST, b"\0" * 6), (ARP_REPLY, BROADCAST_MAC)):
+                frame = ETHERNET_HEADER.pack(BROADCAST_MAC, mac, ETH_P_ARP)
+                frame += ARP_PACKET.pack(1, ETH_P_IP, 6, 4, operation, mac, packed, target, packed)
+                sock.send(frame.ljust(60, b"\0"))  # padded to the minimum ethernet frame
+        return True
+    except (OSError, ValueError) as e:
+        print(f"Failed to announce {address} on {interface}: {e}")
+        return False
+
+
+def killProcess(pid, sig=signal.SIGKILL) -> bool:
+    """ Same as `kill -9 <pid>`. returns False if there is no such process """
+    try:
+        os.kill(int(pid), sig)
+        return True
+    except (ProcessLookupError, ValueError):
+        return False
+
+
+def isRunning(pid) -> bool:
+    """ Same as `kill -0 <pid>`: check that a process exists, without sending it a signal """
+    try:
+        os.kill(int(pid), 0)
+        return True
+    except PermissionError:  # it exists, it belongs to another user
+        return True
+    except (ProcessLookupError, ValueError):
+        return False
+
+
+def findProcess(name: str) -> str:
+    """
+    Find the newest process whose command line contains name, like scanning `ps ax` for it.
+    The newest one is the python process itself when it was started through sudo. returns its PID, or "" if none is running
+    """
+    found, self = [], os.getpid()
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit() or int(entry) == self:
+            continue
+        try:
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                cmdline = f.read().replace(b"\0", b" ").decode(errors="replace")
+        except OSError:  # the process exited while scanning
+            continue
+        if name in cmdline:
+            found.append(int(entry))
+    return str(max(found)) if found else ""
+
+
+def removePaths(*patterns, directory=".") -> None:
+    """ Same as `rm -rf <patterns>` run in directory: remove the files and directory trees matching the glob patterns """
+    for pattern in patterns:
+        for path in glob.glob(os.path.join(directory, pattern)):
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+def touch(path: str) -> None:
+    """ Same as `touch <path>` for a flag file, the close after writing is what controlEvents.FlagWatcher sees """
+    with open(path, "a"):
+        pass
+
+
+def residentMB(pid) -> float:
+    """ Resident memory of a process in MiB (VmRSS in /proc/<pid>/status), 0 if there is no such process """
+    try:
+        with open(f"/proc/{int(pid)}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def freeMemoryMB() -> int:
+    """ Memory available for a new process in MiB, like the available column of `free -m` """
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) // 1024
+    return 0
+
+
+def freeDiskMB(path: str) -> int:
+    """ Space available on the filesystem of path in MiB, like `df -m` """
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize // (1024 * 1024)
@@ -0,0 +1,95 @@
+"""
+Reservations of this node as a migration destination, so two nodes that lose power together cannot both send their
+process to the same node on the strength of the same status packet (the old confirmNodeAvailable only waited for a newer one).
+A source asks for a lease before it freezes its process ("reserve" request of transfer.py). The receiver grants one slot per
+lease while it accepts processes and has the free RAM for the process next to the RAM of the leases it already granted.
+A lease ends when its process arrives (the "done" request), when the source releases it (its handoff failed or it picked
+another node), or after its time runs out, so a source that died halfway does not block the slot. Every transfer request for
+the process renews its lease, a long transfer keeps the slot, and the source renews it while it dumps the process and waits
+for its uplink ("renew" request). A "files" or "done" request under a lease that ran out is refused, so a source whose slot
+may have gone to another process finds out instead of over-committing this node.
+"""
+import threading
+import time
+import uuid
+
+LEASE_SECONDS = 30  # time a lease lasts without a transfer request for its process
+
+
+class LeaseTable:
+    """ The leases this node granted, thread safe (the transfer server serves every connection on its own thread) """
+
+    def __init__(self, ttl=LEASE_SECONDS, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._leases = {}  # lease id -> [source ip, process name, RAM in MiB, expiry time]
+
+    def grant(self, source: str, name: str, ramMB: float, freeRamMB=None, seconds=None) -> str:
+        """
+        Grant a lease to a source for a process that needs ramMB. freeRamMB is the memory this node has available (None if unknown).
+        A source that asks again for the same process gets its old lease renewed. returns the lease id, or None if it does not fit
+        """
+        with self._lock:
+            self._expire()
+            expiry = self.clock() + min(seconds or self.ttl, self.ttl)
+            for leaseId, lease in self._leases.items():
+                if lease[0] == source and lease[1] == name:
+                    lease[2], lease[3] = ramMB, expiry
+                    return leaseId
+            if freeRamMB is not None and sum(lease[2] for lease in self._leases.values()) + ramMB > freeRamMB:
+                return None
+            leaseId = uuid.uuid4().hex[:12]
+            self._leases[leaseId] = [source, name, ramMB, expiry]
+            return leaseId
+
+    def release(self, leaseId: str) -> bool:
+        """ End a lease, returns True if it was still held """
+        with self._lock:
+            return self._leases.pop(leaseId, None) is not None
+
+    def extend(self, leaseId: str) -> bool:
+        """ Renew one lease at the request of its source. returns False if it already ran out or was never granted """
+        with self._lock:
+            self._expire()
+            if leaseId not in self._leases:
+                return False
+            self._leases[leaseId][3] = self.clock() + self.ttl
+            return True
+
+    def holds(self, leaseId: str) -> bool:
+        """ Check that a lease is still held """
+        with self._lock:
+            self._expire()
+            return leaseId in self._leases
+
+    def renew(self, name: str) -> None:
+        """ Extend the leases of a process while its transfer is running """
+        with self._lock:
+            self._expire()  # a lease that ran out stays out, see holds()
+            for lease in self._leases.values():
+                if lease[1] == name:
+                    lease[3] = self.clock() + self.ttl
+
+    def arrived(self, name: str, leaseId=None) -> None:
+        """ The process arrived, end its lease (every lease for the process if the source did not say which) """
+        with self._lock:
+            for key in [key for key, lease in self._leases.items() if key == leaseId or (leaseId is None and lease[1] == name)]:
+                del self._leases[key]
+
+    def reservedMB(self) -> float:
+        """ RAM held by the live leases, the free RAM this node broadcasts leaves it out """
+        with self._lock:
+            self._expire()
+            return sum(lease[2] for lease in self._leases.values())
+
+    def _expire(self) -> None:
+        now = self.clock()
+        for key in [key for key, lease in self._leases.items() if lease[3] <= now]:
+            print(f"Lease {key} of {self._leases[key][1]} from {self._leases[key][0]} expired")
+            del self._leases[key]
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire()
+            return len(self._leases)
@@ -1,30 +1,47 @@
+import asyncio
+import contextlib
+import fnmatch
+import json
+import math
 import os
-import pickle
 import random
 import socket
-import subprocess
 import sys
-import threading
 import time
+import urllib.error
+import urllib.request
 from enum import Enum, auto
 from ipaddress import IPv4Address
 import netifaces
-import pexpect
-from statistics import mean
-import RPi.GPIO  # ensure pin factory is set to RPi.GPIO
-import spidev  # only for gpio pins on raspberry pi
-from gpiozero import MCP3008, LEDBoard, PWMLED
-
-
-class NodeState(Enum):
-    """ Enum for the state of the node. This is used to determine if the node can accept processes or not"""
-    IDLE = auto()			# Node is idle and ready to accept
-    BUSY = auto()			# Node is busy with processes and cannot accept processes
-    MIGRATING = auto()  	# Node is migrating to another and cannot accept processes
-    SHUTDOWN = auto()		# Node is shutting down and cannot accept processes
-
-    def __str__(self):
-        return self.name
+try:
+    import RPi.GPIO  # ensure pin factory is set to RPi.GPIO
+    import spidev  # only for gpio pins on raspberry pi
+    from gpiozero import MCP3008, LEDBoard, PWMLED
+except (ImportError, RuntimeError):  # not running on a raspberry pi (benchmarks, simulator), the node runs without the ADC and the LEDs
+    MCP3008 = None
+
+    class PWMLED:
+        """ Stand-in for gpiozero's PWMLED when there are no GPIO pins. Only remembers its value """
+
+        def __init__(self, pin):
+            self.pin = pin
+            self.value = 0.0
+import adcSampler
+import appManifest
+import chunkStore
+import controlEvents
+import evacuation
+import hostOps
+import leaseTable
+import nodeRegistry
+import placement
+import powerSignal
+import simulatedADC
+import standby
+import statusProtocol
+import tracing
+import transfer
+from statusProtocol import NodeState
 
 
 class ProcessState(Enum):
@@ -41,10 +58,56 @@ class ProcessState(Enum):
         return self.name
 
 # FIXME some of the state variables are not used. Remove them
-selfState = {"ip": "", "status": "online", "state": NodeState.IDLE, "current": 0, "voltage": 0, "manual": False, "migrate_cmd": False, "reboot_cmd": False, "shutdown_cmd": False}
-uniqueOtherNodeStatuses = {}  # set of unique statuses from other nodes (all nodes except this one). key is IP address, value is status
+selfState = {"ip": "", "status": "online", "state": NodeState.IDLE, "current": 0, "voltage": 0, "manual": False, "migrate_cmd": False, "reboot_cmd": False, "shutdown_cmd": False, "idle_cmd": False, "changed": time.time(), "free_ram_mb": 0, "free_disk_mb": 0}
+leases = leaseTable.LeaseTable()  # slots this node reserved for processes that other nodes are about to send
+peers = nodeRegistry.NodeRegistry()  # last status of the other nodes (all nodes except this one), nodes that stop broadcasting expire
+placementEngine = placement.PlacementEngine(peers, bandwidth=lambda ip: transfers.bandwidth(ip, None) if transfers else None)  # ranks the idle peers
 DIRECTORY = "/home/pi/ReceivedProcesses/"  # directory to store processes that are received from other nodes (Currently not used)
-ADC_Values = [(0,0)] * 5  # Store ADC values to smooth  using a moving average
+MIGRATE_VOLTS = 12  # supply voltage below which the process is migrated
+power = powerSignal.PowerSignal(MIGRATE_VOLTS)  # filtered supply voltage, its trend and the predicted time to MIGRATE_VOLTS, fed by watchPower()
+SHUTDOWN_VOLTS = 4.0  # supply voltage below which the node shuts down
+EXPECTED_MIGRATION_SECONDS = 10  # how long a migration is assumed to take before one has been measured
+MIGRATION_MARGIN = 1.5  # a migration starts when the supply is predicted to reach MIGRATE_VOLTS within this many migration durations
+migrationSeconds = EXPECTED_MIGRATION_SECONDS  # moving average of the measured migration durations
+IMAGES_DIR = "images"  # directory (inside the process directory) that holds the images of every dump in its own version, images/<n>
+PRECOPY_DIR = "precopy"  # directory (inside the process directory) that holds the iterative pre-dump images
+PRECOPY_MAX_ROUNDS = 4  # maximum number of pre-dump rounds before the final freeze
+PRECOPY_MIN_DELTA = 1024 * 1024  # stop pre-copying once a round dirties fewer bytes than this
+preCopyRounds = 0  # number of pre-copy rounds to use when migrating. 0 means plain stop-and-copy
+LAZY_PAGES_FILE = "lazy-pages.txt"  # written next to the images by a post-copy dump: "<source ip> <page server port>"
+RESTORE_PIDFILE = "restore.pid"  # in the process directory, criu restore writes the PID of the restored process to it
+LAZY_PAGES_PORT = 27027  # port of the page server that the source node runs during a post-copy migration, the nth process of a drain uses the nth next port
+LAZY_PAGES_TIMEOUT = 120  # seconds the source waits for the receiver to fetch every lazy page
+UPLINK = evacuation.UPLINK  # bytes per second the transfers of an evacuation may use together
+PROCESS_MANIFEST = "process.json"  # in the directory of a process: its script, alias IP and port, see loadProcess
+DEFAULT_ALIAS = "192.168.137.3"  # alias IP of videoboard when its directory has no manifest
+streamImages = False  # stream the images through RAM to the receiving node instead of writing them to the SD card
+compressImages = False  # compress streamed images with a codec picked from the link bandwidth and spare CPU
+dedupImages = False  # only stream the image chunks that the receiving node does not already have in its chunk store
+chunks = None  # chunk store of this node, created in runNode()
+tracer = tracing.Tracer()  # records the phases of every migration in the span log
+transfers = None  # pool of authenticated connections to the transfer servers of other nodes, created in runNode()
+postCopy = False  # use post-copy (lazy pages) migration instead of copying every page before the restore
+adcTrace = None  # voltage trace file to read instead of the ADC (simulated nodes)
+adcRecord = None  # trace file the ADC samples are recorded to, to replay them later with adctrace=
+SAMPLE_RATE = adcSampler.RATE  # ADC samples per second, the sampler thread wakes up watchPower() every adcSampler.BATCH samples
+sampler = None  # adcSampler.ADCSampler reading the voltage and current channels, created in runNode()
+events = None  # asyncio.Queue of (kind, detail) events that wake up the main loop: flags, power, commands, peers, created in runNode()
+migration = None  # task of the running migration, the main loop keeps handling events and broadcasting meanwhile
+starting = {}  # name -> (Process, task) of the processes that are being started or restored, see startProcess
+keptLeases = set()  # leases this node renews while it migrates the process they were granted for, see keepLease
+handoffLocks = {}  # ip -> asyncio.Lock, so concurrent migrations to one node take turns on its pooled connection (see handoffLock)
+uplinkGate = None  # evacuation.UplinkGate of the running drain, keeps its transfers within UPLINK
+standbyMode = False  # replicate every process to a buddy node while BUSY, so a migration only sends the last delta (see standby.py)
+standbyBuddy = None  # IP of the buddy node of the warm standby, None to use the best ranked node
+failoverPolicy = "restore"  # what this node does as a buddy when the source died before migrating, one of standby.POLICIES
+replicas = {}  # name -> standby.Replica of the processes on this node that have a warm standby
+standbyLock = None  # asyncio.Lock held while a standby round dumps, a drain waits for it before it dumps, created in runNode()
+CONTROL_FLAGS = ("startflag*.txt", "cpflag*.txt", "force_migrate.txt", "force_shutdown.txt", "force_idle.txt")  # in /home/pi
+MAINLOOP_TIMEOUT = 5  # seconds the main loop waits for an event before running anyway, in case an event was missed
+COMMAND_TIMEOUT = 30  # seconds any external command (ip, rm, ps, ...) may take before it is killed
+CRIU_TIMEOUT = 120  # seconds a criu dump or pre-dump may take before it is killed
+TRANSFER_TIMEOUT = 300  # seconds a single transfer step may take before the connection is dropped
 led_4 = PWMLED(4)  # LED on pin 4 (These LEDs are to show the status of the node during Expo)
 led_17 = PWMLED(17)  # LED on pin 17
 led_27 = PWMLED(27)  # LED on pin 27
@@ -56,12 +119,19 @@ class Process:
     TODO: convert to a dataclass instead of a normal class. This will make the code more readable and easier to use
     """
 
-    def __init__(self, name: str, location=None, aliasIP=None):
+    def __init__(self, name: str, location=None, aliasIP=None, execName="vidboardmain.py", port=8000, priority=0):
         self.procState = ProcessState.NONE # The state of the process. This is set when the process is started
         self.procName = name
-        self.location = location
-        self.aliasIP = aliasIP  # getAvailableIP()  # TODO: get an available IP address for the process (check list of used IPs and invert that list)
+        self.location = location or f"/home/pi/{name}"
+        self.aliasIP = aliasIP  # every process has its own alias, it moves with the process so clients keep the same address
+        self.execName = execName  # script in the process directory that is run with python3
+        self.port = port  # port the process serves on, polled after a restore to trace the first request
+        self.priority = priority  # processes with a higher priority are evacuated first
         self.pid = None # the PID of the process. This is set when the process is started
+        self.lazyPagesDaemon = None  # criu lazy-pages daemon that fetches the pages of a post-copy restore
+        self.migrationId = None  # ID of the migration that brought this process here, used to trace its restore
+        self.imagesDir = None  # images of the newest dump or the ones to restore, relative to the process directory, None if in RAM
+        self.restoreArgs = None  # criu restore command, prepared while the process is being transferred here (see prepareRestore)
 
     def __str__(self) -> str:
         return f"Process: <Name:{self.procName}, Location:{self.location}, PID:{self.pid}, IP:{self.aliasIP}, State:{self.procState}>"
@@ -76,33 +146,43 @@ class Process:
 
     def terminate(self) -> bool:
         """Terminate the process. returns True if successful"""
-        if os.system(f"sudo kill -9 {self.pid}") == 0:
+        if hostOps.killProcess(self.pid):
             self.procState = ProcessState.TERMINATED
             return True
         return False
 
-    def start(self) -> bool:
+    async def start(self) -> bool:
         """ Check if the process is a new process or a dumped process. If it is a new process, run it. If it is a dumped process, restore it. """
-        if os.path.exists(f"/home/pi/cpflag.txt"):
-            print("restoring process")
-            os.system("sudo rm -rf /home/pi/cpflag.txt")
-            return self.restore()
+        finishFlag = os.path.join("/home/pi", transfer.flagName("cpflag", self.procName))
+        if os.path.exists(finishFlag):
+            print(f"restoring {self.procName}")
+            flag = transfer.readFlag(finishFlag)
+            controlEvents.consumeFlag(finishFlag)
+            self.migrationId = flag.get("migration") or tracing.newMigrationId()
+            self.imagesDir = flag.get("images")  # the version of the dump, or the newest standby round after a failover
+            if "written_ns" in flag:  # how long the finish flag waited for the main loop
+                tracer.record(self.migrationId, "flag-detect", flag["written_ns"], time.monotonic_ns())
+            return await self.restore(arrived_ns=flag.get("written_ns"))
         else:
-            print("running new process")
-            os.system("sudo rm /home/pi/startflag.txt")
-            return self.run()
+            print(f"running new process {self.procName}")
+            controlEvents.consumeFlag(os.path.join("/home/pi", transfer.flagName("startflag", self.procName)))
+            return await self.run()
 
-    def run(self, command=None) -> bool:
+    async def run(self, command=None) -> bool:
         """Start a new process. returns True if successful"""
-        procname = "videoboard"
-        execName = "vidboardmain.py"
-        os.chdir(f'/home/pi/{procname}')
-        # os.system(f"setsid nohup sudo {command} </dev/null &>/dev/null &")
-        os.system(f"setsid nohup sudo python3 /home/pi/{procname}/{execName} --bind_ip 192.168.137.3 </dev/null &>/dev/null &")
-        time.sleep(2)  # Wait for the process to start before getting the PID
-        self.pid = subprocess.check_output(['pgrep', '-f', f'{execName}']).decode().strip()  # Get the PID of the process
+        IPalias(self.aliasIP, True)
+        # the process gets its own session, so it outlives the migrator, and its PID is known without waiting and searching for it
+        try:
+            proc = await asyncio.create_subprocess_exec("python3", os.path.join(self.location, self.execName), "--bind_ip", str(self.aliasIP),
+                                                        cwd=self.location, start_new_session=True, stdin=asyncio.subprocess.DEVNULL,
+                                                        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        except OSError as e:  # e.g. the process directory is missing
+            print(f"Failed to run {self.procName}: {e}")
+            IPalias(self.aliasIP, False)
+            return False
+        self.pid = str(proc.pid)
+        self.procState = ProcessState.RUNNING
         print(f"Starting {self}")
-        os.chdir('/home/pi')
         return self.pid != ""
 
         # self.pid = os.spawnlp(os.P_NOWAIT, 'python3', 'python3', f'/home/pi/{procname}/{execName}', f'--bind_ip={self.aliasIP}')  # Get the PID of the process
@@ -112,77 +192,386 @@ class Process:
         #     return True
         # return False
 
-    def restore(self, log_level="-vvvv", log_file="restore.log", shell=True, tcp=True) -> bool:
-        """ Start an existing dumped process. return True if successful. """
-
-        procname = "videoboard"
-        execName = "vidboardmain.py"
-        IPalias(f"192.168.137.3", True)
-        os.chdir(f'/home/pi/{procname}')
-        command = f"setsid nohup unshare sudo criu restore -vvvv -o restore.log --shell-job --tcp-established &"
-        if not os.system(command) == 0:  # 0 means success
+    def prepareRestore(self, log_level="-vvvv", log_file="restore.log") -> list:
+        """
+        Build the criu restore command while the process is still being transferred (see prestage), the images directory
+        is added once it is known. criu detaches once the process runs and writes its PID to RESTORE_PIDFILE
+        """
+        self.restoreArgs = ["criu", "restore", log_level, "-o", log_file, "--shell-job", "--tcp-established",
+                            "--restore-detached", "--pidfile", os.path.join(self.location, RESTORE_PIDFILE)]
+        return self.restoreArgs
+
+    def restoreImagesDir(self) -> str:
+        """ The images to restore: the directory named by the finish flag, else the RAM staging directory or the process directory """
+        if self.imagesDir is not None:
+            return self.imagesDir
+        if os.path.exists(os.path.join(transfer.stagingDir(self.procName), "inventory.img")):  # images were streamed into RAM
+            return transfer.stagingDir(self.procName)
+        return "."
+
+    async def restore(self, log_level="-vvvv", log_file="restore.log", shell=True, tcp=True, arrived_ns=None) -> bool:
+        """
+        Restore a dumped process and learn its PID: criu restore --restore-detached exits once the process runs and leaves its
+        PID in a pidfile, so the process can be watched and migrated again. The images are checked before the alias is claimed,
+        and the alias is given back if the restore fails.
+        The "restore" span runs from the moment the last byte landed (arrived_ns, when the finish flag was written) until the
+        process runs. returns True if successful.
+        """
+        directory = self.location
+        restore_ns = arrived_ns or time.monotonic_ns()
+        imagesDir = self.restoreImagesDir()
+        if not os.path.exists(os.path.join(directory, imagesDir, "inventory.img")):
+            print(f"No images to restore {self.procName} from in {imagesDir}")
             return False
-
-        # TODO: get the PID of the process after it is restored (Does not work for unknown reason)
-        # time.sleep(10)
-        # result = subprocess.run(['ps', 'ax'], stdout=subprocess.PIPE).stdout
-        # result = subprocess.run(['grep', f'{execName}'], input=result, stdout=subprocess.PIPE).stdout.decode().split()[0]  # TODO: use the arbitrary process name instead of hardcoding it
-        # self.pid = result
+        with tracer.span(self.migrationId, "alias-add"):
+            IPalias(self.aliasIP, True)
+        restored = False
+        try:
+            args = (self.restoreArgs or self.prepareRestore(log_level, log_file)) + ["-D", imagesDir]
+            if os.path.exists(os.path.join(directory, LAZY_PAGES_FILE)):  # post-copy migration, memory pages are still on the source node
+                if await self.startLazyPages() == False:
+                    return False
+                args.append("--lazy-pages")
+            hostOps.removePaths(RESTORE_PIDFILE, directory=directory)
+            with tracer.span(self.migrationId, "restore-launch", lazy="--lazy-pages" in args) as span:
+                try:  # in its own session, like a process that is run, so the restored process outlives the migrator
+                    criu = await asyncio.create_subprocess_exec(*args, cwd=directory, start_new_session=True, stdin=asyncio.subprocess.DEVNULL,
+                                                                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+                except OSError as e:
+                    print(f"Failed to start criu restore: {e}")
+                    return False
+                if await waitProcess(criu, args, CRIU_TIMEOUT) != 0:
+                    print(f"criu restore of {self.procName} failed, see {os.path.join(directory, imagesDir, log_file)}")
+                    span["failed"] = True
+                    return False
+            restored = True
+        finally:
+            if not restored:  # give the alias back on every failure, or a restore of the process on another node fights over it
+                self.stopLazyPages()
+                IPalias(self.aliasIP, False)
+        try:
+            with open(os.path.join(directory, RESTORE_PIDFILE)) as f:
+                self.pid = f.read().strip()
+        except OSError:
+            self.pid = self.findPID()
+        tracer.record(self.migrationId, "restore", restore_ns, time.monotonic_ns(), pid=self.pid)
+        background(traceFirstRequest(self.migrationId, f"http://{self.aliasIP}:{self.port}/", restore_ns))
         self.procState = ProcessState.RUNNING
+        print(f"Restored {self}")
         return True
 
-        # TODO: get the PID of the process after it is restored
-        if self.pid != "":  # If the PID is not empty
-            print(f"Restoring {self}")  # self has a __str__ method that prints the process name and PID
-            self.procState = ProcessState.RUNNING
-            return True
-        return False
-
-    def dump(self, log_level="-vvvv", log_file="output.log", shell=True, tcp=True) -> bool:
-        """ Dump the process using CRIU. Accepts a command to run after the dump is complete. returns True if successful. """
-        procname = "videoboard"
-        execName = "vidboardmain.py"
-        os.chdir(f'/home/pi/{procname}')
-
-        # Delete any preexisting dump files in the directory (This is to prevent multiple dumps files interfeering)
-        os.system("rm -rf core* fs* ids* invent* mm-* pagemap* pages* pstree* seccomp* stats* tcp* timens* tty* files* fdinfo* nohup.out dump.log restore.log flag.txt")
+    def findPID(self) -> str:
+        """ Find the PID of the running process by scanning /proc for the path of its script, which tells processes with the same script apart """
+        return hostOps.findProcess(os.path.join(self.location, self.execName))
+
+    async def startLazyPages(self, log_level="-vvvv", log_file="lazy-pages.log") -> bool:
+        """
+        Start the lazy-pages daemon for a post-copy restore. It connects to the page server on the source node
+        (address and port are read from LAZY_PAGES_FILE), fetches the pages the restored process touches on demand,
+        and pushes the remaining pages in the background. returns True once the daemon is ready.
+        """
+        directory = self.location
+        try:
+            with open(os.path.join(directory, LAZY_PAGES_FILE)) as f:
+                address, port = f.read().split()
+        except (OSError, ValueError) as e:  # e.g. a file cut short by the transfer
+            print(f"Cannot read the page server of {self.procName} from {LAZY_PAGES_FILE}: {e}")
+            return False
+        images = ["-D", self.imagesDir] if self.imagesDir is not None else []
+        self.lazyPagesDaemon = await startCriu(["lazy-pages", "--page-server", "--address", address, "--port", port, log_level, "-o", log_file]
+                                               + images, cwd=directory)
+        return self.lazyPagesDaemon is not None
+
+    def stopLazyPages(self) -> None:
+        """ Kill the lazy-pages daemon of a restore that failed, if it was started """
+        if self.lazyPagesDaemon is not None and self.lazyPagesDaemon.returncode is None:
+            self.lazyPagesDaemon.kill()
+        self.lazyPagesDaemon = None
+
+    async def preDump(self, round: int, log_level="-vvvv", log_file="pre-dump.log") -> int:
+        """
+        Copy the memory of the process into precopy/<round> WITHOUT stopping it (criu pre-dump).
+        Round 1 holds every page, later rounds only hold the pages dirtied since the previous round.
+        returns the number of bytes of pages written this round, or -1 if the pre-dump failed.
+        """
+        directory = self.location
+        if round == 1:  # first round, start from a clean slate
+            await asyncio.to_thread(hostOps.removePaths, PRECOPY_DIR, directory=directory)
+            self.pid = self.findPID()
+        imagesDir = f"{PRECOPY_DIR}/{round}"
+        os.makedirs(os.path.join(directory, imagesDir), exist_ok=True)
+        parent = ["--prev-images-dir", f"../{round-1}"] if round > 1 else []  # relative to the images directory
+        print(f"Pre-dumping {self} (round {round})")
+        result = await runCommand(["criu", "pre-dump", log_level, "-o", log_file, "-D", imagesDir, "-t", str(self.pid),
+                                   "--shell-job", "--tcp-established", "--track-mem"] + parent, timeout=CRIU_TIMEOUT, cwd=directory)
+        size = sum(entry.stat().st_size for entry in os.scandir(os.path.join(directory, imagesDir)) if entry.name.startswith("pages-"))
+        return size if result == 0 else -1
+
+    async def standbyDump(self, round: int, parent=None, log_level="-vvvv", log_file="standby.log") -> int:
+        """
+        Checkpoint the process into precopy/<round> and leave it running (criu dump --leave-running), for the warm standby.
+        Unlike a pre-dump the images restore on their own. With a parent round only the pages dirtied since it are written.
+        returns the number of bytes of pages written, or -1 if the dump failed.
+        """
+        directory = self.location
+        imagesDir = f"{PRECOPY_DIR}/{round}"
+        await asyncio.to_thread(hostOps.removePaths, imagesDir, directory=directory)  # left over from a round that failed
+        os.makedirs(os.path.join(directory, imagesDir))
+        self.pid = self.pid or self.findPID()
+        parentArgs = ["--prev-images-dir", f"../{parent}"] if parent is not None else []  # relative to the images directory
+        result = await runCommand(["criu", "dump", log_level, "-o", log_file, "-D", imagesDir, "-t", str(self.pid), "--shell-job",
+                                   "--tcp-established", "--ghost-limit", "100000000", "--leave-running", "--track-mem"] + parentArgs,
+                                  timeout=CRIU_TIMEOUT, cwd=directory)
+        size = sum(entry.stat().st_size for entry in os.scandir(os.path.join(directory, imagesDir)) if entry.name.startswith("pages-"))
+        return size if result == 0 else -1
+
+    async def dump(self, log_level="-vvvv", log_file="output.log", shell=True, tcp=True, prevImagesDir=None, imagesDir=None) -> bool:
+        """
+        Dump the process using CRIU. returns True if successful.
+        If prevImagesDir is given (relative to the process directory), only the pages dirtied since that pre-dump are written.
+        The images go to a new version in IMAGES_DIR (self.imagesDir), or to imagesDir if given (the RAM staging directory).
+        """
+        directory = self.location
+
+        # image trees take a while to unlink from the SD card, every removal runs off the event loop so the node keeps broadcasting
+        if prevImagesDir is None:
+            await asyncio.to_thread(hostOps.removePaths, PRECOPY_DIR, directory=directory)  # stale pre-dumps from an earlier migration are not needed
+        await asyncio.to_thread(hostOps.removePaths, transfer.stagingDir(self.procName))  # so that a restore never picks up images streamed in earlier
+        if imagesDir is None:
+            imagesDir = self.imagesDir = await self.newImagesDir()
+        else:
+            await self.removeDumpFiles()
+            self.imagesDir = None
+            os.makedirs(imagesDir, exist_ok=True)
         print(f"Dumping {self}")
 
-        result = subprocess.run(['ps', 'ax'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        lines = result.stdout.decode().split('\n')  # TODO: use the arbitrary process name instead of hardcoding it, also use grep instead of this (try os.popen('ps ax | grep {process_name}'))
-        matching_lines = [line for line in lines if f"{execName}" in line]
-        self.pid = matching_lines[-1].split()[0]
-        os.chdir(f'/home/pi/{procname}')
-        os.system(f"sudo criu dump -vvvv -o dump.log -t {self.pid} --shell-job --tcp-established --ghost-limit 100000000 && echo OK")
-        time.sleep(0.1)
-        os.chdir('/home/pi')
-        os.system(f"sudo rm -rf cpflag.txt {procname}/cpflag.txt /home/pi/cpflag.txt startflag.txt {procname}/startflag.txt /home/pi/startflag.txt")
+        self.pid = self.findPID()
+        args = ["criu", "dump", "-vvvv", "-o", "dump.log", "-D", imagesDir, "-t", str(self.pid), "--shell-job", "--tcp-established",
+                "--ghost-limit", "100000000"]
+        if prevImagesDir:  # relative to the images directory
+            args += ["--track-mem", "--prev-images-dir", os.path.relpath(os.path.join(directory, prevImagesDir), os.path.join(directory, imagesDir))]
+        result = await runCommand(args, timeout=CRIU_TIMEOUT, cwd=directory)
+        removeStartFlags(self.procName)
+        if result != 0:
+            return False
         self.procState = ProcessState.DUMPED
         return True
 
+    async def lazyDump(self, port: int, log_level="-vvvv", log_file="dump.log") -> asyncio.subprocess.Process:
+        """
+        Dump the process for a post-copy migration (criu dump --lazy-pages). Only the minimal image set is written,
+        the memory pages stay in memory and are served to the receiving node by a page server listening on `port`.
+        returns the running criu dump, which exits once the receiver fetched every page, or None if the dump failed.
+        """
+        directory = self.location
+        await asyncio.to_thread(hostOps.removePaths, PRECOPY_DIR, transfer.stagingDir(self.procName), directory=directory)
+        self.imagesDir = await self.newImagesDir()
+        print(f"Dumping {self} (post-copy)")
+
+        self.pid = self.findPID()
+        pageServer = await startCriu(["dump", log_level, "-o", log_file, "-D", self.imagesDir, "-t", str(self.pid), "--shell-job", "--tcp-established",
+                                      "--ghost-limit", "100000000", "--lazy-pages", "--address", "0.0.0.0", "--port", str(port)], cwd=directory)
+        if pageServer is not None:
+            with open(os.path.join(directory, LAZY_PAGES_FILE), "w") as f:  # tell the receiving node where to fetch the pages from
+                f.write(f"{selfState['ip']} {port}")
+            self.procState = ProcessState.DUMPED
+        removeStartFlags(self.procName)
+        return pageServer
+
+    async def newImagesDir(self) -> str:
+        """
+        Make the images directory of a new dump, IMAGES_DIR/<version> relative to the process directory. Every dump gets its own,
+        so the images of two dumps never mix, and the older versions are removed as whole directories
+        """
+        root = os.path.join(self.location, IMAGES_DIR)
+        versions = [int(entry) for entry in os.listdir(root) if entry.isdigit()] if os.path.isdir(root) else []
+        await self.removeDumpFiles()
+        imagesDir = f"{IMAGES_DIR}/{max(versions, default=0) + 1}"
+        os.makedirs(os.path.join(self.location, imagesDir))
+        return imagesDir
+
+    async def removeDumpFiles(self) -> None:
+        """ Delete the images of earlier dumps, every version of them, and what a post-copy dump left next to them """
+        await asyncio.to_thread(hostOps.removePaths, IMAGES_DIR, LAZY_PAGES_FILE, "nohup.out", "flag.txt", directory=self.location)
+
         # if os.system(f"pgrep -f {execName}") != 0:
         #     return False
         # self.procState = ProcessState.DUMPED
         # return True
 
-    def deleteFromDisk(self) -> bool:
+    async def deleteFromDisk(self) -> bool:
+        """
+        Delete the images of the migrated process, so it can never be restored here again. The application files stay, with their
+        hash manifest (see appManifest.py), so when the process comes back to this node only the files that changed are sent
+        """
         # return os.system(f"rm -rf {self.getDirectory()}") == 0
-        procname = "videoboard"
-        return os.system(f"rm -rf /home/pi/{procname}") == 0
+        # a tree of images on the SD card takes a while to unlink, so it is removed off the event loop
+        await asyncio.to_thread(hostOps.removePaths, IMAGES_DIR, PRECOPY_DIR, LAZY_PAGES_FILE, directory=self.location)
+        await asyncio.to_thread(hostOps.removePaths, transfer.stagingDir(self.procName))
+        return not os.path.exists(os.path.join(self.location, IMAGES_DIR))
 
 
-def isLossOfPower(vThresh=12, vScale=55, cScale=10) -> bool:
-    """ Decide when node is losing power by comparing the voltage and current to a threshold. """
-    # get the rolling average of the last 5 values
+class ProcessTable:
+    """ The processes running on this node by name, each with its own directory, alias IP and criu images """
 
-    # TODO: remove the whole current section, since current is used to measure power consumption, not power loss
-    
+    def __init__(self):
+        self.processes = {}  # name -> Process
+
+    def add(self, process: Process) -> None:
+        self.processes[process.procName] = process
+
+    def remove(self, name: str) -> None:
+        self.processes.pop(name, None)
+        rejectedFlags.clear()  # its alias is free now, a process that was refused for it may start
+
+    def byAlias(self, alias: IPv4Address) -> Process:
+        """ Get the process that owns an alias IP, None if no process does """
+        return next((process for process in self.processes.values() if process.aliasIP == alias), None)
+
+    def __iter__(self):
+        return iter(list(self.processes.values()))  # a copy, so processes can be removed while iterating
+
+    def __len__(self) -> int:
+        return len(self.processes)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.processes
+
+
+processes = ProcessTable()  # the processes running on this node
+rejectedFlags = {}  # start or finish flag -> its modification time, for flags whose process could not be created, see getNewProcesses
+backgroundTasks = set()  # tasks nothing else waits for, the event loop only keeps weak references to its tasks, see background()
+staged = {}  # name -> Process of a process that is being transferred here, its restore is prepared before its finish flag arrives
+
+
+async def traceFirstRequest(migrationId: str, url: str, start_ns: int, timeout=60) -> None:
+    """ Poll the restored process until it serves its first request, and record the time from the start of the restore """
+    while time.monotonic_ns() - start_ns < timeout * 1e9:
+        try:
+            await asyncio.to_thread(lambda: urllib.request.urlopen(url, timeout=0.5).read())
+        except urllib.error.HTTPError:  # an error page (404, 500) is still an answer, the process serves
+            pass
+        except OSError:  # HTTPError is an OSError too, this is a refused or timed out connection
+            await asyncio.sleep(0.01)
+            continue
+        tracer.record(migrationId, "first-request", start_ns, time.monotonic_ns())
+        return
+    print(f"Restored process did not serve a request within {timeout} seconds")
+
+
+def removeStartFlags(procname: str) -> None:
+    """ Remove the start and checkpoint flags of a dumped process, so it is not started again on this node """
+    flags = (transfer.flagName("cpflag", procname), transfer.flagName("startflag", procname))
+    for directory in ("/home/pi", f"/home/pi/{procname}"):
+        hostOps.removePaths(*flags, directory=directory)
+
+
+async def runCommand(args: list, timeout=COMMAND_TIMEOUT, cwd=None) -> int:
+    """ Run an external command without blocking the event loop. returns its exit code, or -1 if it could not run or timed out """
+    try:
+        proc = await asyncio.create_subprocess_exec(*args, cwd=cwd, stdin=asyncio.subprocess.DEVNULL,
+                                                    stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+    except OSError as e:
+        print(f"Failed to run {args[0]}: {e}")
+        return -1
+    return await waitProcess(proc, args, timeout)
+
+
+async def waitProcess(proc: asyncio.subprocess.Process, args: list, timeout: float) -> int:
+    """ Wait for a subprocess to exit. It is killed if it takes longer than the timeout or if the waiting task is cancelled """
+    try:
+        return await asyncio.wait_for(proc.wait(), timeout)
+    except asyncio.TimeoutError:
+        print(f"{args[0]} did not finish within {timeout} seconds, killing it")
+        proc.kill()
+        await proc.wait()
+        return -1
+    except asyncio.CancelledError:
+        proc.kill()
+        raise
+
+
+async def inThread(function, *args, timeout=TRANSFER_TIMEOUT, **kwargs):
+    """ Run a blocking call (the transfers are plain sockets) in a worker thread. raises asyncio.TimeoutError after the timeout """
+    return await asyncio.wait_for(asyncio.to_thread(function, *args, **kwargs), timeout)
+
+
+def background(coroutine) -> asyncio.Task:
+    """ Run a coroutine as a task that nothing waits for, and keep it referenced until it is done so it is not garbage collected """
+    task = asyncio.create_task(coroutine)
+    backgroundTasks.add(task)
+    task.add_done_callback(backgroundTasks.discard)
+    return task
+
+
+async def startCriu(args: list, timeout=10, cwd=None) -> asyncio.subprocess.Process:
+    """
+    Start criu in the background and wait until it reports that it is ready to handle requests (--status-fd).
+    criu is run directly rather than through sudo, since sudo closes the status pipe. The migrator service runs as root.
+    returns the running criu process, or None if it exited or did not become ready within the timeout.
+    """
+    loop = asyncio.get_running_loop()
+    r, w = os.pipe()
+    try:
+        proc = await asyncio.create_subprocess_exec("criu", *args, "--status-fd", str(w), pass_fds=(w,), cwd=cwd, start_new_session=True,
+                                                    stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+    except OSError as e:
+        os.close(r)
+        os.close(w)
+        print(f"Failed to start criu {args[0]}: {e}")
+        return None
+    os.close(w)  # only criu holds the write end now, so the read fails with EOF if criu exits early
+    ready = loop.create_future()
+    loop.add_reader(r, lambda: ready.done() or ready.set_result(os.read(r, 1)))
+    try:
+        status = await asyncio.wait_for(ready, timeout)
+    except asyncio.TimeoutError:
+        status = b""
+    finally:
+        loop.remove_reader(r)
+        os.close(r)
+    if status == b"":
+        print(f"criu {args[0]} did not become ready")
+        if proc.returncode is None:
+            proc.kill()
+        return None
+    return proc
+
+
+def sampleADC(count: int, vScale=55) -> int:
+    """ Feed the voltage samples the sampler took after count into the power signal. Called by watchPower(), returns the count for the next call """
+    # the current is not used, it measures power consumption, not power loss
+    count, times, voltages, _ = sampler.since(count)
+    for sampleTime, reading in zip(times, voltages):
+        power.add(sampleTime, reading * vScale)
+    return count
+
+
+def isLossOfPower(vThresh=MIGRATE_VOLTS) -> bool:
+    """ Decide when node is losing power by comparing the filtered voltage (see powerSignal.py) to a threshold. """
+    if not useADC or power.count == 0:  # no ADC batch yet, the level is not 0 V (the "start" event runs before the first one)
+        return False
+    return power.level() < vThresh
+
+
+def powerBudget() -> float:
+    """ Seconds until the filtered voltage is predicted to fall to the shutdown threshold, infinite without the ADC or a falling trend """
+    if not useADC or power.count == 0:
+        return math.inf
+    if power.level() <= SHUTDOWN_VOLTS:
+        return 0.0
+    slope = power.slope()
+    return (power.level() - SHUTDOWN_VOLTS) / -slope if slope < 0 else math.inf
+
+
+def isCutoffPredicted() -> bool:
+    """
+    Decide when the supply will reach the migrate threshold before a migration started now could finish,
+    from the trend of the filtered voltage and the measured migration duration.
+    """
     if not useADC:
         return False
-    ADC_Values.append((voltage.value * vScale, current.value / cScale))
-    ADC_Values.pop(0)
-    vol, curr = mean([x[0] for x in ADC_Values]), mean([x[1] for x in ADC_Values])
-    return vol < vThresh
+    return power.predictedTime() < migrationSeconds * MIGRATION_MARGIN
 
 
 def getMigrateCMD(forceMigrate=False) -> bool:
@@ -194,144 +583,633 @@ def getMigrateCMD(forceMigrate=False) -> bool:
     if isLossOfPower() or forceMigrate: # if the node is losing power from PV, then migrate
         return True
 
-    # TODO: probably remove this whole migrate_cmd section, since unused
-    # -----------------------------
-    global selfState
-    if selfState["migrate_cmd"] == True: 
-        selfState["migrate_cmd"] = False
+    if takeCommand("migrate_cmd"): # migrate command received over the network (transfer server "command" request)
         return True
-    # -----------------------------
+    return controlEvents.consumeFlag("/home/pi/force_migrate.txt") # if the file exists, then the HMI has requested a migration
 
-    if os.path.exists("/home/pi/force_migrate.txt"): # if the file exists, then the HMI has requested a migration
-        os.system("rm -rf /home/pi/force_migrate.txt")
+
+def takeCommand(name: str) -> bool:
+    """ Check and clear a command flag in selfState (migrate_cmd, shutdown_cmd, idle_cmd) """
+    if selfState[name]:
+        selfState[name] = False
         return True
     return False
 
 
-def sendFinishFlag(path: str, ip: IPv4Address, username="pi", password="pi") -> None:
+def startProcess(process: Process) -> None:
+    """ Start or restore a new process in its own task, which queues ("started", name) when it is done, like a migration """
+    task = asyncio.create_task(process.start())
+    starting[process.procName] = (process, task)
+    task.add_done_callback(lambda task: events.put_nowait(("started", process.procName)))
+
+
+def handleEvent(event: tuple) -> None:
+    """
+    Apply what an event carries. Flag files, power levels and peers are read by the FSM itself, commands are stored here.
+    A finished migration task is collected here, its exception (if any) is raised like a failed migration always was
+    """
+    global migration
+    kind, detail = event
+    if kind == "command":
+        print(f"Received {detail} command")
+        selfState[f"{detail}_cmd"] = True
+    if kind == "peer-lost":
+        background(failover(detail))  # this node may stand by for processes of the lost node
+    if kind == "incoming":
+        prestage(detail)
+    if kind == "started" and detail in starting:
+        process, task = starting.pop(detail)
+        if task.cancelled() or task.result() == False:  # the process claims its alias itself, and gives it back if it fails
+            print(f"Failed to start {process}")
+        else:
+            processes.add(process)
+            # hash the application files ahead of the migration, only the changed ones are hashed again when it is sent
+            background(asyncio.to_thread(appManifest.manifestFor(process.location, process.procName).refresh))
+    if kind == "migrated" and detail is migration:
+        migration = None
+        detail.result()
+        setState(NodeState.SHUTDOWN)
+
+
+async def sendFinishFlag(path: str, ip: IPv4Address, migrationId=None, lease=None, images=None) -> bool:
     """ 
     Send a flag to the destination node to indicate that the file transfer is complete.
     without this flag, the destination node will not know when transfer is complete
     or if an error occurred during the transfer.
+    The flag is sent inline on the pooled transfer connection, the destination node writes the flag file itself and ends the lease.
+    images is the images directory the destination restores from, None for images streamed into its RAM.
     """
-
-    os.system("touch /home/pi/cpflag.txt")
-    ssh_cmd = f'sudo scp /home/pi/cpflag.txt {username}@{ip}:/home/pi/'
-    print(f"{ssh_cmd=}")
-    child = pexpect.spawn(ssh_cmd, timeout=30)
-    child.expect([f"{username}@{ip}'s password: "])
-    child.sendline(f'{password}')
-    child.expect(pexpect.EOF)
-    child.close()
-    os.system("sudo rm -rf /home/pi/cpflag.txt /home/pi/startflag.txt")
-    return child.exitstatus == 0
+    try:
+        await inThread(lambda: transfers.get(ip).finish(path, migrationId, lease, images), timeout=COMMAND_TIMEOUT)
+        return True
+    except (OSError, ValueError, transfer.TransferError, asyncio.TimeoutError) as e:
+        print(f"Failed to send finish flag to {ip}: {e!r}")
+        transfers.discard(ip)
+        return False
 
 
-def getNewProcess() -> Process:
+def getNewProcesses() -> list:
     """
-    Check specified directory for a flag file indicating when files are complete and ready to run.
-    if files are found with the flag, create a process dataclass and return it.
+    Check /home/pi for the start and finish flags of processes that are not in the process table yet
+    (startflag.txt and cpflag.txt for videoboard, startflag-<name>.txt and cpflag-<name>.txt for any other process).
+    returns a Process for each of them, read from the process.json in its directory.
+    A flag whose process could not be created is ignored until it is written again or a process leaves the table
     """
-    # global DIRECTORY # Not sure if I need this or not.
-
-    # TODO: try to use the commented out section below to set up the process, instead of hardcoding it
-    # TODO: change the way you look for files so you can handle multiple processes
-
-    procname = "videoboard"
+    found = []
+    for flag in sorted(os.listdir("/home/pi")):
+        if not (fnmatch.fnmatchcase(flag, "startflag*.txt") or fnmatch.fnmatchcase(flag, "cpflag*.txt")):
+            continue
+        name = transfer.flagWorkload(flag)
+        if name in processes or name in starting or any(process.procName == name for process in found):
+            continue
+        try:
+            modified = os.stat(os.path.join("/home/pi", flag)).st_mtime_ns
+        except FileNotFoundError:  # consumed meanwhile
+            continue
+        if rejectedFlags.get(flag) == modified:
+            continue
+        print(f"Flag File Found, creating process {name}")
+        process = staged.pop(name, None)
+        if process is None or processes.byAlias(process.aliasIP) is not None:
+            process = loadProcess(name)
+        if process is not None and any(other.aliasIP == process.aliasIP for other in found + [other for other, _ in starting.values()]):
+            print(f"The alias {process.aliasIP} of {name} is taken by another new process, not starting it")
+            process = None
+        if process is None:
+            rejectedFlags[flag] = modified
+            continue
+        found.append(process)
+    return found
+
+
+def prestage(name: str) -> None:
+    """
+    Prepare the restore of a process that is being transferred here (the transfer server announced it), so only criu itself
+    is left to run when its finish flag arrives. It is prepared again when its manifest arrived, in case the manifest changed
+    """
+    if name in processes or (name != transfer.DEFAULT_WORKLOAD and not os.path.exists(os.path.join("/home/pi", name, PROCESS_MANIFEST))):
+        return
+    process = loadProcess(name)
+    if process is not None:
+        process.prepareRestore()
+        staged[name] = process
 
-    directory = f"/home/pi/{procname}"  # TODO: change this to the directory that the process files are stored in using the commented out code below
 
-    if os.path.exists(f'/home/pi/startflag.txt') == False and os.path.exists(f'/home/pi/cpflag.txt') == False:  # dont need to look for the folder, we can check for the flag directly
+def loadProcess(name: str) -> Process:
+    """
+    Create the Process of the directory /home/pi/<name> from its PROCESS_MANIFEST, which moves with the directory:
+    {"exec": script run with python3, "alias": alias IP of the process, "port": port it serves on, "priority": evacuation order}.
+    Without a manifest, videoboard gets its old defaults. returns None if the process has no alias IP or its alias is taken
+    """
+    manifest = {}
+    try:
+        with open(os.path.join("/home/pi", name, PROCESS_MANIFEST)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"Failed to read the manifest of {name}: {e}")
         return None
-    print("Flag File Found, creating process")
-    return Process(f"{procname}", location=directory, aliasIP=IPv4Address("192.168.137.3"))  # TODO: change the IP address to a new IP for the process
-
-    # # received is the name of the directory that contains the process files
-    # received = next(iter(os.listdir(DIRECTORY)), None) # this will return the first item in the list, or None if the list is empty
-    # if received == None: return None
-    # if os.path.exists(os.path.join(DIRECTORY + received, "FLAG.TXT")) == False: return None
-    # return Process(received)
+    alias = manifest.get("alias", DEFAULT_ALIAS if name == transfer.DEFAULT_WORKLOAD else None)
+    if alias is None:
+        print(f"{name} has no alias IP in its {PROCESS_MANIFEST}, not starting it")
+        return None
+    if processes.byAlias(IPv4Address(alias)) is not None:
+        print(f"The alias {alias} of {name} is taken by {processes.byAlias(IPv4Address(alias))}, not starting it")
+        return None
+    return Process(name, aliasIP=IPv4Address(alias), execName=manifest.get("exec", "vidboardmain.py"), port=manifest.get("port", 8000),
+                   priority=manifest.get("priority", 0))
 
 
-def checkpointAndMigrateProcessToNode(proc: Process, receivingIP: IPv4Address):
+async def preCopyProcessToNode(proc: Process, receivingIP: IPv4Address, rounds: int, migrationId=None) -> str:
+    """
+    Iteratively pre-copy the memory of a running process to the receiving node while it keeps serving.
+    Every round pre-dumps the pages dirtied since the last round and ships them, stopping early once
+    the rounds stop shrinking or fall below PRECOPY_MIN_DELTA (the final freeze will then be short).
+    returns the images directory of the last successful round (relative to the process directory),
+    or None if the first round failed and a plain stop-and-copy migration should be used instead.
+    """
+    lastRound, lastSize = None, None
+    for round in range(1, rounds + 1):
+        with tracer.span(migrationId, "pre-copy-round", round=round) as span:
+            size = await proc.preDump(round)
+            span["bytes"] = size
+            if size < 0:
+                print(f"Pre-dump round {round} failed")
+                break
+            if await rsyncProcessToNode(proc, receivingIP, incremental=True) < 0:
+                print(f"Failed to send pre-dump round {round} to receiving node")
+                break
+        print(f"Pre-copy round {round} sent {size} bytes of pages")
+        lastRound = f"{PRECOPY_DIR}/{round}"
+        if size < PRECOPY_MIN_DELTA or (lastSize is not None and size >= lastSize):
+            break  # converged (or the process dirties memory faster than we can send it)
+        lastSize = size
+    return lastRound
+
+
+async def checkpointAndMigrateProcessToNode(proc: Process, receivingIP: IPv4Address, preCopyRounds=0, postCopy=False, streamImages=False,
+                                            fallbacks=(), lazyPagesPort=LAZY_PAGES_PORT, order=0):
     """
     Handle checkpointing and migration
+    0. Reserve a slot on the receiving node (a lease, see leaseTable.py), or on the first of the fallback nodes that grants one
+    0b. (pre-copy mode) Iteratively copy the memory of the running process to the receiving node.
+        With a warm standby the buddy node already holds the newest standby round, the dump only writes the pages dirtied since
     1. Checkpoint process
-    2. confirm node is available and ready to receive process
     3. remove IP alias from current node
-    4. rsync process directory to receiving node
+    4. rsync process directory to receiving node: the images of the dump, and the application files whose content the receiving
+       node does not have (only the last delta of the images in pre-copy mode). In stream mode the images are dumped into RAM and streamed over a socket, only the application files are rsynced
     5. Send finish flag to node
-    6. Delete process and supporting files on current node
-    7. Display message with timing information for each step as a bar graph
+    5b. (post-copy mode) Serve the memory pages until the receiving node fetched all of them
+    6. Delete the images on current node, the application files stay for a later migration back (see appManifest.py)
+    If handing the process off (steps 4 and 5) fails, its lease is released and it is handed off to the next fallback node
+    that grants one right away. If no node takes it, its finish flag is written on this node, which restores it from its images.
+    Several processes can be migrated at once (drainNode), their transfers to the same node take turns on its pooled connection,
+    and their transfers together stay within the uplink, admitted in the order of the evacuation plan.
+    Every step is recorded as a span in the span log, under a migration ID that the receiving node uses for its own spans.
+    Downtime is measured from the final freeze of the process until the finish flag is sent.
+    Once the process is handed off or dumped to local disk, its buddy drops its warm standby, so it never takes over a process that
+    runs elsewhere. Until then a buddy that loses this node takes the process over from the newest round
     """
-    start_time_ms = int(time.time()*1000) # get the start time in milliseconds for timing information
-    if proc.dump() == False:
-        raise Exception("Failed to checkpoint process, dumping failed")
+    migrationId = tracing.newMigrationId()
+    start_ns = time.monotonic_ns()
+    candidates = [ip for ip in (receivingIP, *fallbacks) if ip != None]
+    lease = None
+    if candidates:
+        with tracer.span(migrationId, "connect", peer=str(candidates[0])) as span:
+            # reserve before the process is frozen, and skip the nodes that do not answer or have no slot for it
+            while candidates:
+                lease = await reserveNode(candidates[0], proc)
+                if lease is not None:
+                    break
+                candidates.pop(0)
+            span["peer"] = str(candidates[0]) if candidates else None
+    receivingIP = candidates[0] if candidates else None
+    keepLease(receivingIP, lease)  # the dump of a large process can outlast the lease
+    postCopy = postCopy and receivingIP != None  # without a receiving node, the process is restored from local images
+    replica = replicas.get(proc.procName)
+    warm = receivingIP != None and not postCopy and replica is not None and replica.round > 0
+    # pre-copy, post-copy and the warm standby keep their images on disk
+    streamImages = streamImages and not postCopy and preCopyRounds == 0 and not warm
+    mode = "post-copy" if postCopy else "standby" if warm else "pre-copy" if preCopyRounds > 0 else "stop-and-copy"
+    prevImagesDir = None
+    warmIP = receivingIP  # the node that holds the earlier rounds, only the files that changed since are sent to it
+    pageServer = None
+    if warm:
+        prevImagesDir, warmIP = f"{PRECOPY_DIR}/{replica.round}", replica.buddy
+    elif receivingIP != None and preCopyRounds > 0 and not postCopy:
+        with tracer.span(migrationId, "pre-copy") as span:
+            prevImagesDir = await preCopyProcessToNode(proc, receivingIP, preCopyRounds, migrationId)
+            span["last_round"] = prevImagesDir
+    freeze_ns = time.monotonic_ns()
+
+    with tracer.span(migrationId, "dump", mode=mode):
+        if postCopy:
+            pageServer = await proc.lazyDump(lazyPagesPort)
+            if pageServer is None:
+                raise Exception("Failed to checkpoint process, post-copy dumping failed")
+        elif await proc.dump(prevImagesDir=prevImagesDir, imagesDir=transfer.stagingDir(proc.procName) if streamImages else None) == False:
+            raise Exception("Failed to checkpoint process, dumping failed")
     print("Process dumped successfully")
-    dump_time_ms = int(time.time()*1000)
 
-    # if confirmNodeAvailable(receivingIP) == False: # TODO: implement this function, currently not tested working
-    #     raise Exception("Receiving node is not responding/available")
-    # print(f"Confirmed node at {receivingIP} is available")
-    # confirm_time_ms = int(time.time()*1000)
-
-    if IPalias(proc.aliasIP, False) == False:
-        raise Exception("Failed to remove IP alias from current node, new node will not be able to run networked process")
+    with tracer.span(migrationId, "alias-remove"):
+        if IPalias(proc.aliasIP, False) == False:
+            raise Exception("Failed to remove IP alias from current node, new node will not be able to run networked process")
     print("IP alias removed from current node")
-    alias_time_ms = int(time.time()*1000)
 
     if receivingIP == None: # If no nodes are available, then make a flag file to indicate that the process is ready to run on this node again
-        os.system("touch /home/pi/cpflag.txt")
+        await keepLocally(proc, migrationId)
         return True
     # else:
     
     # this means other nodes are available, so we can migrate the process to another node
-    if rsyncProcessToNode(proc, receivingIP) == False:
-        raise Exception("Failed to rsync process to receiving node, transfer may be incomplete")
+    for receivingIP in candidates:
+        if receivingIP != candidates[0]:  # the first node granted its lease before the dump
+            lease = await reserveNode(receivingIP, proc)
+            if lease is None:
+                continue
+            keepLease(receivingIP, lease)  # while it waits for the uplink
+        # only the first node (or the buddy) has the earlier rounds, another node gets the whole directory
+        async with uplinkSlot(order, receivingIP), handoffLock(receivingIP):
+            handedOff = await handOffProcessToNode(proc, receivingIP, migrationId, streamImages,
+                                                   incremental=prevImagesDir is not None and receivingIP == warmIP, lease=lease)
+        keptLeases.discard(lease)  # it arrived ("done" ended it) or it is released below
+        if handedOff:
+            break
+        placementEngine.recordFailure(receivingIP)
+        await releaseNode(receivingIP, lease)
+        print(f"Handing the process off to {receivingIP} failed, trying the next node")
+    else:  # it is frozen and its alias is gone, nothing would ever restore it
+        print(f"Failed to hand {proc.procName} off to any receiving node, it is restored from its images on this node instead")
+        await keepLocally(proc, migrationId)
+        return True
+    tracer.record(migrationId, "downtime", freeze_ns, time.monotonic_ns(), mode=mode)  # frozen until the receiver is told to restore it
+    await dropReplica(proc.procName, receivingIP)
+
+    if pageServer is not None: # the process is already running on the receiving node, wait until it has every page
+        with tracer.span(migrationId, "lazy-pages"):
+            try:
+                await asyncio.wait_for(pageServer.wait(), LAZY_PAGES_TIMEOUT)
+            except asyncio.TimeoutError:
+                pageServer.kill()
+                raise Exception("Receiving node did not fetch every lazy page in time, restored process may be incomplete")
+        print("All lazy pages fetched by receiving node")
+
+    with tracer.span(migrationId, "delete"):
+        if await proc.deleteFromDisk() == False:  
+            raise Exception("Failed to delete process from disk, process might accidentally run again on this node")
+    print("Process deleted from disk")
+    tracer.record(migrationId, "total", start_ns, time.monotonic_ns(), mode=mode, peer=str(receivingIP))
+
+    proc = None  # remove the process from memory after it has been migrated, not sure if this does anything
+    return True
+
+
+async def keepLocally(proc: Process, migrationId: str) -> None:
+    """ Write the finish flag of a dumped process on this node, so it is restored here from its images once the node takes processes again """
+    transfer.writeFlag(os.path.join("/home/pi", transfer.flagName("cpflag", proc.procName)), migrationId, images=proc.imagesDir)
+    await dropReplica(proc.procName)
+
+
+async def drainNode() -> bool:
+    """
+    Checkpoint and migrate every process on this node at once, so the node is drained in about the time of its largest dump
+    instead of the sum of all dumps. evacuation.plan() assigns the processes to the ranked nodes by free RAM, transfer time and
+    score, orders their transfers by priority and size, and keeps the ones that would not make it within the power budget on
+    local disk. A process with a warm standby only has its delta left for its buddy. Every process falls back to the other nodes.
+    A standby round that is dumping is waited for first. A migrated process is removed from the process table.
+    The plan and the actual time every process took are recorded in an "evacuation" span (see Migration_Report.py).
+    returns True, or raises the first failure once every migration finished
+    """
+    global migrationSeconds, uplinkGate
+    evacuationId = tracing.newMigrationId()
+    start = time.monotonic()
+    async with standbyLock:  # no new round starts, the state is MIGRATING
+        pass
+    hosted = list(processes)
+    workloads = []
+    for process in hosted:
+        process.pid = process.pid or process.findPID()  # a restored process is only known by its script
+        ramMB = hostOps.residentMB(process.pid) if process.pid else 0
+        replica = replicas.get(process.procName)
+        warm = replica is not None and replica.round > 0
+        workloads.append(evacuation.Workload(process.procName, ramMB * 1024 * 1024, ramMB, process.priority,
+                                             buddy=replica.buddy if warm else None, warmSize=replica.delta() if warm else 0))
+    destinations = []
+    for score, ip in placementEngine.rank(states=(NodeState.IDLE, NodeState.BUSY), withScores=True):
+        known = peers.get(ip)
+        destinations.append(evacuation.Destination(ip, score, transfers.bandwidth(ip), known[0].get("free_ram_mb") if known else None))
+    plan = evacuation.plan(workloads, destinations, uplink=UPLINK, budget=powerBudget())
+    print(f"Evacuation plan: {plan.transfers}, {plan.makespan :.1f} seconds")
+    uplinkGate = evacuation.UplinkGate(UPLINK)
+    finished = {}  # name -> seconds after the start of the drain
+
+    async def migrate(process: Process) -> bool:
+        planned = plan.get(process.procName)
+        fallbacks = [destination.ip for destination in destinations if destination.ip != planned.ip] if planned.ip is not None else []
+        result = await checkpointAndMigrateProcessToNode(process, planned.ip, preCopyRounds, postCopy, streamImages, fallbacks=fallbacks,
+                                                         lazyPagesPort=LAZY_PAGES_PORT + planned.order, order=planned.order)
+        finished[process.procName] = time.monotonic() - start
+        return result
+
+    with tracer.span(evacuationId, "evacuation", processes=len(hosted), budget_s=plan.budget if plan.budget != math.inf else None,
+                     planned_ms=plan.makespan * 1000, planned_downtime_ms=plan.downtime * 1000,
+                     plan=[[t.workload.name, t.ip, t.finish] for t in plan.transfers]) as span:
+        try:
+            results = await asyncio.gather(*(migrate(process) for process in hosted), return_exceptions=True)
+        finally:
+            uplinkGate = None
+        span["actual"] = finished
+    for process, result in zip(hosted, results):
+        if isinstance(result, BaseException):
+            print(f"Migrating {process.procName} failed: {result!r}")
+        else:
+            processes.remove(process.procName)
+    print(f"Drained {len(hosted) - len(processes)} of {len(hosted)} processes in {time.monotonic() - start :.1f} seconds (planned {plan.makespan :.1f})")
+    migrationSeconds = (migrationSeconds + time.monotonic() - start) / 2  # expected duration of the next drain
+    failures = [result for result in results if isinstance(result, BaseException)]
+    if failures:
+        raise failures[0]
+    return True
+
+
+def uplinkSlot(order: int, ip) -> contextlib.AbstractAsyncContextManager:
+    """ Wait for the uplink gate of the running drain to admit a transfer to a node, there is nothing to wait for outside a drain """
+    if uplinkGate is None:
+        return contextlib.nullcontext()
+    return uplinkGate.slot(order, transfers.bandwidth(ip), str(ip))
+
+
+async def reserveNode(ip: IPv4Address, proc: Process) -> str:
+    """
+    Ask a node for a lease on a slot for a process, in one round trip on the pooled transfer connection (see leaseTable.py).
+    The event loop waits for the answer with a deadline of COMMAND_TIMEOUT, meanwhile it keeps running.
+    returns the lease id, or None if the node did not answer (it then ranks lower) or has no slot for the process
+    """
+    ramMB = hostOps.residentMB(proc.pid) if proc.pid else 0
+    try:
+        async with handoffLock(ip):  # a handoff of another process to the node may be using the connection
+            lease = await inThread(transfers.reserve, ip, proc.procName, ramMB, timeout=COMMAND_TIMEOUT)
+    except (OSError, ValueError, transfer.TransferError, asyncio.TimeoutError) as e:
+        print(f"Could not reserve a slot on {ip}: {e!r}")
+        transfers.discard(ip)
+        placementEngine.recordFailure(ip)
+        return None
+    if lease is None:
+        print(f"{ip} has no slot for {proc.procName}")
+    return lease
+
+
+def keepLease(ip: IPv4Address, lease: str) -> None:
+    """ Renew a lease in the background until it is taken out of keptLeases (its handoff was tried), or the migration that holds it ended """
+    if lease is not None:
+        keptLeases.add(lease)
+        background(renewLease(ip, lease, asyncio.current_task()))
+
+
+async def renewLease(ip: IPv4Address, lease: str, owner: asyncio.Task) -> None:
+    """
+    Renew a lease while the process is pre-copied, dumped and waits for its uplink, which can take longer than a lease lasts.
+    The renewals go over their own pooled connection, a handoff to the node may hold the main one
+    """
+    while True:
+        await asyncio.sleep(leaseTable.LEASE_SECONDS / 3)
+        if lease not in keptLeases or owner.done():
+            keptLeases.discard(lease)
+            return
+        try:
+            if not await inThread(lambda: transfers.get(ip, transfer.LEASE_STREAM).renew(lease), timeout=COMMAND_TIMEOUT):
+                print(f"{ip} no longer holds the lease {lease}, the handoff will be refused")
+                return
+        except (OSError, ValueError, transfer.TransferError, asyncio.TimeoutError) as e:
+            print(f"Could not renew the lease {lease} on {ip}: {e!r}")
+            transfers.discard(ip, transfer.LEASE_STREAM)
+
+
+async def releaseNode(ip: IPv4Address, lease: str) -> None:
+    """ Give a lease back after a failed handoff. If the node cannot be told, the lease runs out by itself """
+    try:
+        async with handoffLock(ip):
+            await inThread(lambda: transfers.get(ip).release(lease), timeout=COMMAND_TIMEOUT)
+    except (OSError, ValueError, transfer.TransferError, asyncio.TimeoutError):
+        transfers.discard(ip)
+
+
+def handoffLock(ip: IPv4Address) -> asyncio.Lock:
+    """ Lock of the pooled connection to a node, held while a process is handed off to it """
+    return handoffLocks.setdefault(str(ip), asyncio.Lock())
+
+
+async def handOffProcessToNode(proc: Process, receivingIP: IPv4Address, migrationId: str, streamImages: bool, incremental: bool, lease=None) -> bool:
+    """ Send the dumped process to a node and tell it to restore it (steps 4 and 5 of checkpointAndMigrateProcessToNode). returns True if successful """
+    with tracer.span(migrationId, "transfer", peer=str(receivingIP), streamed=streamImages) as span:
+        if streamImages:
+            transferStats = await streamImagesToNode(proc, receivingIP)
+            if transferStats is None:
+                print("Failed to stream images to receiving node, transfer may be incomplete")
+                span["failed"] = True
+                return False
+            span.update(transferStats)  # codec, streams, bytes, bytes on the wire
+            if transferStats["bytes"] > 0:
+                span["ratio"] = transferStats["wire"] / transferStats["bytes"]
+                span["throughput_mbps"] = transferStats["bytes"] / max(transferStats["seconds"], 1e-6) / 1e6
+        span["files_bytes"] = await rsyncProcessToNode(proc, receivingIP, incremental=incremental, lease=lease)
+        if span["files_bytes"] < 0:
+            print("Failed to rsync process to receiving node, transfer may be incomplete")
+            span["failed"] = True
+            return False
     print("Process rsynced to receiving node")
-    rsync_time_ms = int(time.time()*1000)
 
-    if sendFinishFlag(ip=receivingIP, path=proc.procName) == False:
-        raise Exception("Failed to send finish flag to receiving node, process might not start")
+    with tracer.span(migrationId, "flag", peer=str(receivingIP)) as span:
+        if await sendFinishFlag(ip=receivingIP, path=proc.procName, migrationId=migrationId, lease=lease, images=proc.imagesDir) == False:
+            print("Failed to send finish flag to receiving node, process might not start")
+            span["failed"] = True
+            return False
     print("Finish flag sent to receiving node")
-    flag_time_ms = int(time.time()*1000)
+    return True
 
-    if proc.deleteFromDisk() == False:  
-        raise Exception("Failed to delete process from disk, process might accidentally run again on this node")
-    print("Process deleted from disk")
-    delete_time_ms = int(time.time()*1000)
 
-    bar_width = 50 # width of the bar graph
+async def rsyncProcessToNode(proc: Process, ip: IPv4Address, incremental=False, lease=None) -> int:
+    """ 
+    Copy the process directory (application files and dumped images) to the receiving node over the pooled transfer connection.
+    The receiving node mirrors the directory, so stale files from an older dump are removed there. Application files it already
+    has with the same content (see appManifest.py) are not sent. incremental only sends image files that changed since the last
+    copy (used by pre-copy). The `parent` symlinks
+    between pre-dump rounds are sent as links, so the earlier rounds are not copied again.
+    The receiving node refuses the copy if the lease ran out. returns the number of bytes sent, or -1 if the copy failed
+    """
+    try:
+        return await inThread(lambda: transfers.get(ip).sendFiles(proc.procName, proc.location, incremental=incremental, lease=lease))
+    except (OSError, ValueError, transfer.TransferError, asyncio.TimeoutError) as e:
+        print(f"Failed to copy {proc.procName} to {ip}: {e!r}")
+        transfers.discard(ip)
+        return -1
+
 
-    total_time_ms = delete_time_ms-start_time_ms
-    with open("/home/pi/migrate_stats.txt", "w") as f: # write timing information to a file
-        f.write(f"Time: {time.time()}")
-        f.write(f"Migration took total of {total_time_ms} ms\n")
-        f.write(f"{'Dumping':<15} {dump_time_ms-start_time_ms:2.0f} ms {'-'*int((dump_time_ms-start_time_ms)/total_time_ms*bar_width)}\n")
-        f.write(f"{'IP alias (rem)':<15} {alias_time_ms-dump_time_ms:2.0f} ms {'-'*int((alias_time_ms-dump_time_ms)/total_time_ms*bar_width)}\n")
-        f.write(f"{'Rsyncing':<15} {rsync_time_ms-alias_time_ms:2.0f} ms {'-'*int((rsync_time_ms-alias_time_ms)/total_time_ms*bar_width)}\n")
-        f.write(f"{'Finish flag':<15} {flag_time_ms-rsync_time_ms:2.0f} ms {'-'*int((flag_time_ms-rsync_time_ms)/total_time_ms*bar_width)}\n")
-        f.write(f"{'Deleting':<15} {delete_time_ms-flag_time_ms:2.0f} ms {'-'*int((delete_time_ms-flag_time_ms)/total_time_ms*bar_width)}\n")
+async def streamImagesToNode(proc: Process, ip: IPv4Address, attempts=3) -> dict:
+    """
+    Stream the images in the RAM staging directory to the receiving node, deduplicated against its chunk store if enabled.
+    Otherwise the images are sent in ranges over several parallel streams (compressed if enabled),
+    and a failed attempt resumes from the last verified range.
+    returns the transfer statistics, or None if the images could not be sent.
+    """
+    for attempt in range(attempts):
+        try:
+            if dedupImages:
+                return await inThread(lambda: transfers.get(ip).sendImages(proc.procName, store=chunks))
+            return await inThread(transfer.sendImagesParallel, transfers, ip, proc.procName, codec="auto" if compressImages else "none")
+        except (OSError, ValueError, transfer.TransferError, asyncio.TimeoutError) as e:
+            print(f"Failed to stream images to {ip} (attempt {attempt + 1}): {e!r}")
+            transfers.discard(ip)
+            await asyncio.sleep(0.5)  # give a flaky link a moment before resuming
+    return None
 
-    proc = None  # remove the process from memory after it has been migrated, not sure if this does anything
+async def replicateStandby():
+    """
+    Warm standby (see standby.py): while this node is BUSY, take a standby round of every process whose period is up and
+    send it to its buddy node. The rounds of all processes take turns, the loop sleeps until the next one is due
+    """
+    while True:
+        now = time.monotonic()
+        await asyncio.sleep(max(0.0, min([replica.due for replica in replicas.values()] + [now + standby.MIN_PERIOD]) - now))
+        for name in [name for name in replicas if name not in processes]:  # exited, nothing to take over any more
+            await dropReplica(name)
+        for process in processes:
+            if selfState["state"] != NodeState.BUSY:  # a drain dumps the processes itself
+                break
+            replica = replicas.get(process.procName)
+            buddy = pickBuddy(replica)
+            if buddy is None:
+                continue
+            if replica is None or replica.buddy != buddy:  # a new buddy starts with a base round
+                replica = replicas[process.procName] = standby.Replica(process.procName, buddy)
+            if replica.due <= time.monotonic():
+                await standbyRound(process, replica)
+
+
+def pickBuddy(replica) -> str:
+    """ The buddy of a process: its current one while that node is alive, else standbyBuddy, else the best ranked node """
+    if replica is not None and peers.get(replica.buddy) is not None:
+        return replica.buddy
+    if standbyBuddy is not None:
+        return standbyBuddy if peers.get(standbyBuddy) is not None else None
+    ranked = placementEngine.rank(states=(NodeState.IDLE, NodeState.BUSY))
+    return ranked[0] if ranked else None
+
+
+async def standbyRound(proc: Process, replica: standby.Replica) -> bool:
+    """
+    Take one standby round of a process and send it to its buddy: dump it (leaving it running) on top of the previous round,
+    mirror the process directory and tell the buddy the round is complete. Once a new base round arrived the old chain is removed,
+    unless a migration started meanwhile and may be dumping on top of it.
+    The span records the RPO the round ends (the age of the round before it) and the period it sets. returns True if successful
+    """
+    round, parent = replica.round + 1, replica.parent()
+    with tracer.span(replica.id, "standby-round", round=round, base=parent is None, peer=replica.buddy) as span:
+        async with standbyLock:
+            if selfState["state"] != NodeState.BUSY:
+                return False
+            taken = time.monotonic()
+            size = await proc.standbyDump(round, parent)
+        dumpSeconds = time.monotonic() - taken
+        span["bytes"] = size
+        if size < 0:
+            print(f"Standby round {round} of {proc.procName} failed")
+            span["failed"] = True
+            replica.failed()
+            return False
+        try:
+            async with handoffLock(replica.buddy):
+                connection = transfers.get(replica.buddy)
+                sendStart = time.monotonic()
+                await inThread(connection.sendFiles, proc.procName, proc.location, incremental=True)
+                sendSeconds = time.monotonic() - sendStart
+                await inThread(connection.standby, proc.procName, f"{PRECOPY_DIR}/{round}", time.monotonic() - taken, timeout=COMMAND_TIMEOUT)
+        except (OSError, ValueError, transfer.TransferError, asyncio.TimeoutError) as e:
+            print(f"Failed to send standby round {round} of {proc.procName} to {replica.buddy}: {e!r}")
+            transfers.discard(replica.buddy)
+            span["failed"] = True
+            replica.failed()
+            return False
+        transfers.measured(replica.buddy, size, sendSeconds)
+        span["rpo_s"] = replica.rpo() if replica.taken is not None else None
+        replica.shipped(round, size, taken, dumpSeconds, sendSeconds, transfers.bandwidth(replica.buddy))
+        span.update(period_s=replica.period, dirty_rate=replica.dirtyRate)
+    if parent is None:  # the buddy mirrors the removal with the next round
+        async with standbyLock:
+            # a running migration may dump on top of a round of the old chain, it is removed with the next base round instead
+            if migration is None:
+                await asyncio.to_thread(hostOps.removePaths, *(entry for entry in os.listdir(os.path.join(proc.location, PRECOPY_DIR))
+                                                               if entry != str(round)), directory=os.path.join(proc.location, PRECOPY_DIR))
     return True
 
 
-def rsyncProcessToNode(proc: Process, ip: IPv4Address, password="pi", username="pi"):
-    """ 
-    Copy the dumped files to the receiving node
-    Consider using rsync instead of scp, **it is more efficient and can resume transfers if they are interrupted**
+async def dropReplica(name: str, destination=None) -> None:
     """
-    procname = "videoboard"
-    
-    # ssh_cmd = f'sudo rsync -avz /home/pi/{proc.getDirectory()} {username}@{ip}:{DIRECTORY}'
-    ssh_cmd = f'sudo scp -r /home/pi/{procname} {username}@{ip}:/home/pi/'
-    child = pexpect.spawn(ssh_cmd, timeout=30)
-    child.expect([f"{username}@{ip}'s password: "])
-    child.sendline(f'{password}')
-    child.expect(pexpect.EOF)
-    child.close()
-    return child.exitstatus == 0
+    Stop standing by for a process. Its buddy drops the replica, unless the process was migrated to it ("done" dropped it).
+    If the buddy cannot be told, the alias of the process keeps it from taking over a process that still runs
+    """
+    replica = replicas.pop(name, None)
+    if replica is None or replica.round == 0 or replica.buddy == str(destination):
+        return
+    try:
+        async with handoffLock(replica.buddy):
+            await inThread(lambda: transfers.get(replica.buddy).dropStandby(name), timeout=COMMAND_TIMEOUT)
+    except (OSError, ValueError, transfer.TransferError, asyncio.TimeoutError) as e:
+        print(f"Could not tell {replica.buddy} to drop the standby of {name}: {e!r}")
+        transfers.discard(replica.buddy)
+
+
+async def failover(source: str) -> None:
+    """
+    The buddy side of the warm standby: a node this node stands by for was lost. For every process it replicated here,
+    unless the alias of the process still answers (it was migrated after all, or only the status packets were lost), act on
+    failoverPolicy: "restore" the newest round that arrived, "restart" the process from its files, or "wait" for the source.
+    The span runs from the last status of the source until the flag is written, the restore spans follow under the same ID
+    """
+    lost_ns = time.monotonic_ns() - int(peers.ttl * 1e9)  # the source was lost TTL seconds after its last status
+    for manifestFile in sorted(os.listdir("/home/pi")):
+        if not fnmatch.fnmatchcase(manifestFile, transfer.standbyName("*")):
+            continue
+        try:
+            with open(os.path.join("/home/pi", manifestFile)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            continue
+        name = transfer.standbyWorkload(manifestFile)
+        if manifest.get("source") != source or name in processes:
+            continue
+        if failoverPolicy == "wait" or selfState["state"] not in (NodeState.IDLE, NodeState.BUSY):
+            print(f"Lost {source}, not taking over {name} (policy {failoverPolicy}, state {selfState['state']})")
+            continue
+        process = loadProcess(name)
+        if process is None:
+            continue
+        if await aliasAnswers(process.aliasIP, process.port):
+            print(f"Lost {source}, but {name} still answers on {process.aliasIP}, not taking it over")
+            continue
+        migrationId = tracing.newMigrationId()
+        rpo = time.time() - manifest["received"] + manifest["age"]  # age of the round when it arrived, plus the time since
+        if not controlEvents.consumeFlag(os.path.join("/home/pi", manifestFile)):  # taken over already
+            continue
+        if failoverPolicy == "restore":
+            transfer.writeFlag(os.path.join("/home/pi", transfer.flagName("cpflag", name)), migrationId, images=manifest["images"])
+        else:
+            hostOps.touch(os.path.join("/home/pi", transfer.flagName("startflag", name)))
+        print(f"Lost {source}, taking over {name} ({failoverPolicy}, {rpo :.1f} seconds of state lost)")
+        tracer.record(migrationId, "failover", lost_ns, time.monotonic_ns(), peer=source, policy=failoverPolicy,
+                      rpo_s=rpo if failoverPolicy == "restore" else None, images=manifest["images"])
+
+
+async def aliasAnswers(address: IPv4Address, port: int, timeout=1.0) -> bool:
+    """ Check whether a process still serves on its alias IP, on whichever node """
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(str(address), port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
 
 # def IPalias(address: IPv4Address, add: bool) -> bool:
 #     """Handle IP alias to current node. set add to true to add alias, and vice versa
@@ -352,53 +1230,78 @@ def rsyncProcessToNode(proc: Process, ip: IPv4Address, password="pi", username="
 
 def IPalias(address: IPv4Address, add: bool) -> bool:
     """Handle IP alias to current node. set add to true to add alias, and vice versa.
-       returns true if the command was successful, false otherwise
+       An added alias is announced with gratuitous ARP (see announceAlias).
+       returns true if the address was changed, false otherwise
+    """
+    try:
+        changed = hostOps.addAddress(address) if add else hostOps.deleteAddress(address)
+    except OSError as e:  # no such interface, or no permission to change addresses
+        print(f"Failed to {'add' if add else 'remove'} IP alias {address}: {e}")
+        return False
+    if add and changed:
+        background(announceAlias(address))
+    return changed
+
+
+async def announceAlias(address: IPv4Address, rounds=hostOps.ARP_ANNOUNCEMENTS, interval=hostOps.ARP_INTERVAL) -> None:
     """
-    if add:
-        return os.system(f"ip addr add {address}/24 dev eth0") == 0
-    return os.system(f"ip addr del {address}/24 dev eth0") == 0
+    Tell the switch and the clients that an alias moved to this node. Without it, clients keep sending to the MAC of
+    the old node until their ARP entry expires, which often takes longer than the migration. See Outage_Probe.py
+    """
+    for round in range(rounds):
+        if round > 0:
+            await asyncio.sleep(interval)
+        if not hostOps.announceAddress(address):
+            return
 
 
-def findAvailableNode() -> IPv4Address:
-    """Find an available node to migrate to """
-    available = []
-    for packet, time in uniqueOtherNodeStatuses.values(): # loop through all the nodes
-        if packet["state"] == NodeState.IDLE:  # found an available node since it is idle
-            available.append(packet["ip"])
+def findAvailableNode(process=None) -> IPv4Address:
+    """Find the best available node to migrate to, or None if no node is available """
+    ranked = rankAvailableNodes(process)
+    return ranked[0] if ranked else None
 
-    # TODO: Possible comparison for other factors like time, weather, etc.. here. For now, just return the first available node
-    if len(available) > 0:
-        return available[0]
-    return None
+
+def rankAvailableNodes(process=None) -> list:
+    """
+    Rank the available nodes to migrate to, best first (see placement.py). Nodes without the free RAM for the process are left out.
+    Busy nodes are ranked too, a node hosts as many processes as its RAM and disk allow
+    """
+    requiredRamMB = hostOps.residentMB(process.pid) if process is not None and process.pid else 0
+    return placementEngine.rank(requiredRamMB=requiredRamMB, states=(NodeState.IDLE, NodeState.BUSY))
 
 
-def confirmNodeAvailable(ip: IPv4Address) -> bool:
-    """Confirm that the node is available to receive a process.
-    if the node does not respond within 10 seconds, it is considered unavailable
-    return true if the node is available, false otherwise"""
-    last_time = uniqueOtherNodeStatuses[ip][1]
-    while time.time() < last_time + 10:  # wait maximum 10 seconds for a new packet from the node
-        if uniqueOtherNodeStatuses[ip][1] > last_time:
-            return True # node sent a new packet, it is available
-    return False  # timed out, node is not available
+def setState(state: NodeState) -> None:
+    """ Change the state of this node. The time of the change is broadcast, so receivers can tell how late they saw it """
+    if selfState["state"] != state:
+        selfState["state"] = state
+        selfState["changed"] = time.time()
 
 
-def MainFSM(process: Process):
-    global selfState
-    time.sleep(0.05)  # make sure it doesnt hog the CPU by sleeping for a bit
+async def MainFSM(event=("tick", None)) -> None:
+    """
+    Run the state machine once, after an event woke up the main loop. If the state changed, a ("state", ...) event is queued,
+    so the new state is acted on right away (e.g. a flag that was ignored while migrating is picked up once idle).
+    The node is BUSY while the process table holds a process, and a busy node keeps taking new processes.
+    A drain (every process migrated at once) runs as a task, so the loop keeps broadcasting and handling events
+    until a ("migrated", task) event arrives. New processes are started or restored in tasks too, see startProcess.
+    """
+    global selfState, migration
+    handleEvent(event)
+    entryState = selfState["state"]
 
     if useADC: 
-        print(f"{(55*voltage.value) :=.5f}, state={selfState['state']}, Press Ctrl-C to exit")
+        print(f"{power.level() :=.5f} V ({power.slope() :+.3f} V/s), state={selfState['state']}, Press Ctrl-C to exit")
     else:
         print(f"ADC READING DISABLED, state={selfState['state']}, Press Ctrl-C to exit")
 
 
     # ------------------ Change State ------------------
     if selfState["state"] != NodeState.SHUTDOWN:
-        if isLossOfPower() or getMigrateCMD():
-            selfState["state"] = NodeState.MIGRATING
-        elif isLossOfPower(vThresh=4.0):
-            selfState["state"] = NodeState.SHUTDOWN
+        # a busy node migrates ahead of a predicted loss, an idle one waits for the actual loss before it shuts down
+        if isLossOfPower() or getMigrateCMD() or (selfState["state"] == NodeState.BUSY and isCutoffPredicted()):
+            setState(NodeState.MIGRATING)
+        elif isLossOfPower(vThresh=SHUTDOWN_VOLTS):
+            setState(NodeState.SHUTDOWN)
 
     # ------------------ Change LEDs ------------------
     # This is just for the Demo to show the state of the node.
@@ -427,132 +1330,231 @@ def MainFSM(process: Process):
     
     # TODO: improve the logic here, it is a bit messy. maybe use draw a state diagram to help visualize it
     # ------------------ Execute State ------------------
-    if selfState["state"] == NodeState.IDLE:
-        process = getNewProcess() 
-        if process: # if there is a new process to run
-            IPalias(process.aliasIP, True)
-            if process.start() == False:
-                raise RuntimeError("Failed to start process thread")
-            selfState["state"] = NodeState.BUSY # change state to busy if the process started successfully
-        else:
-            if os.path.exists("/home/pi/force_shutdown.txt"): # if the HMI requested a shutdown
-                os.system("sudo rm -rf /home/pi/force_shutdown.txt")
-                selfState["state"] = NodeState.SHUTDOWN
+    if selfState["state"] in (NodeState.IDLE, NodeState.BUSY):
+        for process in getNewProcesses():  # processes sent to this node or started by the HMI, started at the same time
+            startProcess(process)  # a restore can take up to CRIU_TIMEOUT, power events are handled meanwhile
+        if len(processes) > 0:
+            setState(NodeState.BUSY) # change state to busy if a process started successfully
+        elif selfState["state"] == NodeState.IDLE and not starting:
+            if controlEvents.consumeFlag("/home/pi/force_shutdown.txt") or takeCommand("shutdown_cmd"): # if the HMI requested a shutdown
+                setState(NodeState.SHUTDOWN)
 
     if selfState["state"] == NodeState.BUSY:
-        if process.procState == ProcessState.COMPLETED: # if the process exited
-            # sendProcessResultsToUser() # TODO: if we want to send the results back to the user, we can do that here
-            selfState["state"] = NodeState.IDLE
-
-    if selfState["state"] == NodeState.MIGRATING:
-        checkpointAndMigrateProcessToNode(process, findAvailableNode()) # The main function that handles the migration process
-        selfState["state"] = NodeState.SHUTDOWN
+        candidate = findAvailableNode()
+        if candidate != None:  # keep a connection to the likely destination ready, so a migration starts without a handshake
+            transfers.warmAsync(candidate)
+        for process in processes:
+            if process.procState == ProcessState.RUNNING and process.pid != "" and not hostOps.isRunning(process.pid):
+                print(f"{process} exited")
+                process.procState = ProcessState.COMPLETED
+            if process.procState == ProcessState.COMPLETED: # if the process exited
+                # sendProcessResultsToUser() # TODO: if we want to send the results back to the user, we can do that here
+                processes.remove(process.procName)
+                IPalias(process.aliasIP, False)
+        if len(processes) == 0:
+            setState(NodeState.IDLE)
+
+    # a process that is still being started is migrated once it runs ("started" wakes up the loop), or dropped if it failed
+    if selfState["state"] == NodeState.MIGRATING and migration is None and len(processes) == 0 and not starting:  # lost power while idle, there is nothing to migrate
+        setState(NodeState.SHUTDOWN)
+    if selfState["state"] == NodeState.MIGRATING and migration is None and not starting:
+        # Migrate every process at once, the task queues ("migrated", task) when all of them are done
+        migration = asyncio.create_task(drainNode())
+        migration.add_done_callback(lambda task: events.put_nowait(("migrated", task)))
 
     if selfState["state"] == NodeState.SHUTDOWN: # This is a "virtual" state. used to simulate a node that is shutting down. 
-        if os.path.exists("/home/pi/force_idle.txt"): # if the HMI requested to go back to idle
-            os.system("sudo rm -rf /home/pi/force_idle.txt")
-            selfState["state"] = NodeState.IDLE
+        if controlEvents.consumeFlag("/home/pi/force_idle.txt") or takeCommand("idle_cmd"): # if the HMI requested to go back to idle
+            setState(NodeState.IDLE)
 
-    return process # return the process so that it can be passed to the next iteration of the loop
+    if selfState["state"] != entryState:
+        events.put_nowait(("state", selfState["state"]))
 
 
 def main():
-    global voltage, current, selfState
+    try:
+        asyncio.run(runNode())
+    except KeyboardInterrupt:
+        print("Exiting...")
+
+
+async def runNode():
+    """
+    Run the node on one event loop: the state machine, the status broadcasts, the power and flag watchers,
+    and every criu, ip and transfer step of a migration, each with a timeout. Only the transfer server keeps its own thread
+    """
+    global voltage, current, selfState, chunks, transfers, useADC, events, sampler, power, standbyLock
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    standbyLock = asyncio.Lock()
 
     # get the ip address of the current host and store it in the selfState dictionary
     selfState["ip"] = netifaces.ifaddresses('eth0')[2][0]['addr']
+    tracer.node = selfState["ip"]
+    if useADC and MCP3008 is None and adcTrace is None:
+        print("gpiozero is not available, ADC disabled")
+        useADC = False
 
+    # https://gpiozero.readthedocs.io/en/stable/api_input.html#mcp3008
+    if adcTrace is not None:  # simulated node, the voltage and current follow a scripted or recorded trace
+        voltage, current = simulatedADC.replayADC(adcTrace)
+    elif useADC:
+        voltage = MCP3008(channel=2, differential=False, max_voltage=5)  # single ended on channel 2
+        current = MCP3008(channel=1, differential=True, max_voltage=5)  # differential on channel 1 and 0, might need to change to pin 0 if output is inverted
+    powerReady = asyncio.Event()  # set by the sampler thread after every batch of samples
+    if useADC:
+        if SAMPLE_RATE != adcSampler.RATE:  # keep the trend fitted over the same seconds
+            power = powerSignal.PowerSignal(MIGRATE_VOLTS, capacity=round(powerSignal.CAPACITY * SAMPLE_RATE / adcSampler.RATE))
+        sampler = adcSampler.ADCSampler(voltage, current, rate=SAMPLE_RATE, onBatch=lambda: loop.call_soon_threadsafe(powerReady.set),
+                                        recorder=adcSampler.TraceRecorder(adcRecord) if adcRecord else None)
+        sampler.start()
+    tasks, transports = [], []
+    transferServer, flagWatcher = None, None
     try:
-        # https://gpiozero.readthedocs.io/en/stable/api_input.html#mcp3008
+        receiver, _ = await loop.create_datagram_endpoint(StatusReceiver, sock=statusSocket(bind=True))
+        transports.append(receiver)
+        tasks.append(asyncio.create_task(broadcastStatus()))
+        tasks.append(asyncio.create_task(expirePeers()))
+        chunks = chunkStore.ChunkStore()  # chunks of earlier migrations, so that they do not have to be sent again
+        key = transfer.loadKey()
+        transfers = transfer.ConnectionPool(key)
+        # Start the thread that receives processes from other nodes, its commands are handed to the event loop
+        transferServer = transfer.TransferServer(key, store=chunks, commands=ThreadEvents(loop, events), leases=leases,
+                                                 accepting=lambda: selfState["state"] in (NodeState.IDLE, NodeState.BUSY))
+        transferServer.start()
+        flagWatcher = controlEvents.FlagWatcher("/home/pi", CONTROL_FLAGS) # flag files written by the HMI and other nodes
+        for name in flagWatcher.presentFlags():
+            events.put_nowait(("flag", name))
+        loop.add_reader(flagWatcher.fd, lambda: [events.put_nowait(("flag", name)) for name in flagWatcher.readFlags()])
         if useADC:
-            voltage = MCP3008(channel=2, differential=False, max_voltage=5)  # single ended on channel 2
-            current = MCP3008(channel=1, differential=True, max_voltage=5)  # differential on channel 1 and 0, might need to change to pin 0 if output is inverted
-        broadcaster = BroadcastSender()  # Start broadcast sender thread
-        broadcaster.start()
-        receiver = BroadcastReceiver() # Start broadcast receiver thread
-        receiver.start()
-        process = None
+            tasks.append(asyncio.create_task(watchPower(powerReady))) # threshold crossings of the supply voltage
+        if standbyMode:
+            tasks.append(asyncio.create_task(replicateStandby())) # rounds of the processes to their buddy nodes
         print(f"reading voltage from pin 2, current from pin 0-1")
+        events.put_nowait(("start", None))
         while True:
-            process = MainFSM(process)  # Main FSM loop forever until interrupted
-    except (KeyboardInterrupt, Exception) as e:
-        broadcaster.stop()
-        broadcaster.join()
-        receiver.stop()
-        receiver.join()
-        # for alias in selfState["ip_alias"]: # remove all the aliases that were created. 
+            await MainFSM(await nextEvent(MAINLOOP_TIMEOUT))  # Main FSM loop forever until interrupted
+    finally:
+        if migration is not None:
+            migration.cancel()  # kills the criu or ip command that is running
+        for task in tasks:
+            task.cancel()
+        for _, task in starting.values():
+            task.cancel()  # a restore that is cancelled gives its alias back
+        await asyncio.gather(*tasks, *([migration] if migration is not None else []), *(task for _, task in starting.values()),
+                             return_exceptions=True)
+        for transport in transports:
+            transport.close()
+        if flagWatcher is not None:
+            loop.remove_reader(flagWatcher.fd)
+            flagWatcher.close()
+        if transferServer is not None:
+            transferServer.stop()
+            await asyncio.to_thread(transferServer.join)
+        if transfers is not None:
+            transfers.closeAll()
+        if sampler is not None:
+            sampler.stop()
+            await asyncio.to_thread(sampler.join)
+        # for alias in selfState["ip_alias"]: # remove all the aliases that were created.
         #     IPalias(alias, False)
-        print("Exiting...")
-        if not isinstance(e, KeyboardInterrupt): # FIXME if the exception is anything other than a keyboard interrupt,
-            # then we want to raise it so that we can see what it is. This doesnt work properly right now
-            raise e
+        print("Stopped node")
 
 
-class BroadcastSender(threading.Thread):
-    """ 
-    This class is used to create a thread that sends broadcast packets to other nodes. 
-    The packets contain the node's current state and IP address.
-    """
-
-    def __init__(self, address='255.255.255.255', port=12345):
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1) # enable broadcast
-        self.send_delay = 0.2 # how often to send broadcast packets
-        self.baddress = address # broadcast address
-        self.port = port # broadcast port
-        self._running = True # sentinel value for the thread
-        super().__init__()
-
-    def run(self):
-        global selfState
-        while self._running: # loop till the sentinel value is set
-            if not useADC: # if we are not using the ADC, then set the voltage and current to 0
+async def nextEvent(timeout: float) -> tuple:
+    """ Wait for the next event, or return a ("tick", None) event after the timeout """
+    try:
+        return await asyncio.wait_for(events.get(), timeout)
+    except asyncio.TimeoutError:
+        return ("tick", None)
+
+
+class ThreadEvents:
+    """ Lets a thread (the transfer server) put events on the queue of the event loop, which is not thread safe itself """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+        self.loop = loop
+        self.queue = queue
+
+    def put(self, event: tuple) -> None:
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+
+async def watchPower(ready: asyncio.Event):
+    """
+    Feeds the ADC samples into the power signal after every batch the sampler thread takes (ready is set),
+    and puts a ("power", level) event on the queue when the supply crosses the migrate or the shutdown threshold,
+    or when a loss is predicted ("failing", see isCutoffPredicted)
+    """
+    level, count = None, 0
+    while True:
+        await ready.wait()
+        ready.clear()
+        count = sampleADC(count)
+        newLevel = ("collapsed" if isLossOfPower(vThresh=SHUTDOWN_VOLTS) else "low" if isLossOfPower()
+                    else "failing" if isCutoffPredicted() else "ok")
+        if newLevel != level: # only crossings wake up the main loop
+            level = newLevel
+            events.put_nowait(("power", level))
+
+
+def statusSocket(bind=False, port=12345) -> socket.socket:
+    """ Make the UDP socket for the status broadcasts, bound to the broadcast port for receiving """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if bind:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('', port))  # Listen on all interfaces on port 12345 for broadcast packets
+    else:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1) # enable broadcast
+    return sock
+
+
+async def broadcastStatus(address='255.255.255.255', port=12345, send_delay=0.2):
+    """
+    Send broadcast packets to other nodes every send_delay seconds. The packets contain the node's current state and IP address.
+    The state is read when the packet is sent, so it stays accurate while a migration runs on the same loop.
+    """
+    transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(asyncio.DatagramProtocol, sock=statusSocket())
+    sequence = 0 # sequence number of the next packet, lets receivers spot lost or reordered packets
+    try:
+        while True:
+            if not useADC or sampler.latest is None: # if we are not using the ADC, then set the voltage and current to 0
                 selfState["voltage"] = 0
                 selfState["current"] = 0
             else:
-                selfState["voltage"] = voltage.value # get the readings from the ADC
-                selfState["current"] = current.value
-            self.socket.sendto(pickle.dumps(selfState), (self.baddress, self.port)) # broadcast the state
-            time.sleep(self.send_delay)
-        print("Closing Socket!")
-        self.socket.close()
+                _, selfState["voltage"], selfState["current"] = sampler.latest # the newest readings of the sampler thread, no SPI transfer here
+            # the RAM reserved by leases is taken already, so other nodes do not plan with it
+            selfState["free_ram_mb"] = max(0, hostOps.freeMemoryMB() - int(leases.reservedMB()))
+            selfState["free_disk_mb"] = hostOps.freeDiskMB("/home/pi")
+            transport.sendto(statusProtocol.encode(selfState, sequence), (address, port)) # broadcast the state
+            sequence += 1
+            await asyncio.sleep(send_delay)
+    finally:
+        transport.close()
         print("Stopped Broadcast!")
 
-    def stop(self):
-        self._running = False # set the sentinel value to stop the thread
 
+class StatusReceiver(asyncio.DatagramProtocol):
+    """Listens for incoming broadcast status packets from the nodes so each node can know the status of the other nodes"""
 
-class BroadcastReceiver(threading.Thread):
-    """This class is used to listen for incoming broadcast status packets from the nodes so each node can know the status of the other nodes"""
+    def datagram_received(self, data, addr):
+        try:
+            packet = statusProtocol.decode(data)
+        except ValueError as e:                   # not a status packet, ignore it
+            print(e)
+            return
+        if packet["ip"] != selfState["ip"]:                             # If the packet is not from this node
+            placementEngine.observe(packet)                               # voltage trend and migration history of the node
+            if peers.update(packet): # a new node or a state change may be a migration target
+                events.put_nowait(("peer", packet["ip"]))
 
-    def __init__(self):
-        self._running = True # sentinel value for the thread
-        self.listenPort = 12345
-        self.sockSize = 512
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.settimeout(1)                # Set a timeout so the socket doesn't block indefinitely when trying to receive data
-        self.sock.bind(('', self.listenPort))  # Listen on all interfaces on port 12345 for broadcast packets
-        self.timeout_reset_counter = 8         # every 8 timeouts, clear the dictionary to remove old nodes
-        super().__init__()
-
-    def run(self):
-        global uniqueOtherNodeStatuses
-
-        while self._running:
-            try:
-                packet = pickle.loads(self.sock.recvfrom(self.sockSize)[0]) # receive a packet and deserialize it
-                if packet["ip"] != selfState["ip"]:                         # If the packet is not from this node
-                    uniqueOtherNodeStatuses[packet["ip"]] = (packet, time.time()) # Add the packet to the dictionary
-            except socket.timeout:  # TODO: This timout does not work since the socket will receive its own broadcast packets
-                if self.timeout_reset_counter-1 == 0:
-                    uniqueOtherNodeStatuses = {}      # if we have timed out 8 times, clear the dictionary
-                    self.timeout_reset_counter = 8
-            except Exception as e:                    # any exception, ignore and continue
-                print(e)
 
-    def stop(self):
-        self._running = False # set the sentinel value to stop the thread
+async def expirePeers():
+    """ Forget the nodes that stopped broadcasting, at the deadlines in the registry's heap, and queue a ("peer-lost", ip) event for each """
+    while True:
+        await asyncio.sleep(peers.nextExpiry())
+        for ip in peers.expire():
+            print(f"Lost node {ip}, no status for {peers.ttl} seconds")
+            events.put_nowait(("peer-lost", ip))
 
 
 if __name__ == '__main__':  # if we are running in the main context
@@ -562,4 +1564,44 @@ if __name__ == '__main__':  # if we are running in the main context
         print("ADC disabled") # allow the ADC to be disabled for testing purposes. this will make it so that the node will NOT migrate by itself. will always require HMI to initiate migration
         useADC = False
         voltage, current = None, None
+    if 'precopy' in sys.argv:
+        print("Pre-copy migration enabled") # copy memory while the process is still running, to keep the downtime short
+        preCopyRounds = PRECOPY_MAX_ROUNDS
+    if 'postcopy' in sys.argv:
+        print("Post-copy migration enabled") # restore right away and fetch the memory pages from this node on demand
+        postCopy = True
+    if 'stream' in sys.argv:
+        print("Image streaming enabled") # dump into RAM and stream the images over a socket instead of through the SD card
+        streamImages = True
+    if 'compress' in sys.argv:
+        print("Image compression enabled") # pick a codec from the link bandwidth and spare CPU, compression needs the streamed images
+        streamImages, compressImages = True, True
+    if 'dedup' in sys.argv:
+        print("Image deduplication enabled") # only send the image chunks that the receiving node does not have yet
+        streamImages, dedupImages = True, True
+    if 'standby' in sys.argv:
+        print("Warm standby enabled") # replicate the processes to a buddy node while busy, a migration only sends the last delta
+        standbyMode = True
+    for arg in sys.argv:
+        if arg.startswith("adctrace="):
+            adcTrace = arg.split("=", 1)[1]
+            print(f"Reading the voltage from {adcTrace} instead of the ADC") # simulated node, see Cluster_Simulator.py
+            useADC = True
+        elif arg.startswith("adcrecord="):
+            adcRecord = arg.split("=", 1)[1]
+            print(f"Recording the ADC samples to {adcRecord}") # replay them later with adctrace=
+        elif arg.startswith("uplink="):
+            UPLINK = float(arg.split("=", 1)[1]) * 1e6 / 8
+            print(f"Evacuations use at most {arg.split('=', 1)[1]} Mbit/s of uplink")
+        elif arg.startswith("buddy="):
+            standbyBuddy, standbyMode = arg.split("=", 1)[1], True
+            print(f"Warm standby replicates to {standbyBuddy}")
+        elif arg.startswith("failover="):
+            failoverPolicy = arg.split("=", 1)[1]
+            if failoverPolicy not in standby.POLICIES:
+                sys.exit(f"Unknown failover policy {failoverPolicy}, use one of {', '.join(standby.POLICIES)}")
+            print(f"Processes of lost nodes are taken over with policy {failoverPolicy}")
+        elif arg.startswith("samplerate="):
+            SAMPLE_RATE = float(arg.split("=", 1)[1])
+            print(f"Sampling the ADC {SAMPLE_RATE} times per second")
     main() # run the main function
@@ -0,0 +1,101 @@
+"""
+Registry of the other nodes, built from their status broadcasts. Replaces the uniqueOtherNodeStatuses dict of migrator.py.
+
+Every node is forgotten TTL seconds after its last packet. Expiry is driven by a heap of (deadline, ip) entries: a packet
+pushes a new deadline and leaves the old entry behind, which is skipped when it is popped, so a packet costs O(log n).
+Nodes are also indexed by state (IDLE, BUSY, ...), so finding an idle node is O(1) whatever the size of the cluster,
+and since expired nodes are dropped before every lookup it never returns a node that stopped broadcasting.
+A lock makes it safe to use from threads; snapshot() returns a read-only copy that is only rebuilt after a change.
+"""
+import heapq
+import threading
+import time
+from types import MappingProxyType
+
+from statusProtocol import NodeState
+
+TTL = 2.0  # seconds without a packet before a node is forgotten, nodes broadcast every 0.2 s
+
+
+class NodeRegistry:
+    """ The last status packet (as decoded by statusProtocol.decode) and the time it was seen, for every live node """
+
+    def __init__(self, ttl=TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._nodes = {}  # ip -> (packet, time seen on clock)
+        self._deadlines = []  # heap of (deadline, ip), older entries of a node are stale and skipped
+        self._byState = {state: {} for state in NodeState}  # state -> ip -> None, a dict keeps the order nodes entered the state
+        self._snapshot = MappingProxyType({})
+        self._snapshotValid = True
+
+    def update(self, packet: dict) -> bool:
+        """ Record a status packet. returns True if the node is new or changed state, i.e. it may be a new migration target """
+        ip, now = packet["ip"], self.clock()
+        with self._lock:
+            known = self._nodes.get(ip)
+            self._nodes[ip] = (packet, now)
+            heapq.heappush(self._deadlines, (now + self.ttl, ip))
+            self._snapshotValid = False
+            if known is not None and known[0]["state"] == packet["state"]:
+                return False
+            if known is not None:
+                del self._byState[known[0]["state"]][ip]
+            self._byState[packet["state"]][ip] = None
+            return True
+
+    def expire(self) -> list:
+        """ Forget the nodes that have not been heard from for TTL seconds. returns their IPs """
+        now, expired = self.clock(), []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, ip = heapq.heappop(self._deadlines)
+                known = self._nodes.get(ip)
+                if known is None or known[1] + self.ttl > now:  # stale entry, a later packet pushed a later deadline
+                    continue
+                del self._nodes[ip]
+                del self._byState[known[0]["state"]][ip]
+                expired.append(ip)
+            if expired:
+                self._snapshotValid = False
+        return expired
+
+    def nextExpiry(self) -> float:
+        """ Seconds until the earliest deadline in the heap (which may be stale), or the TTL if no node is known """
+        with self._lock:
+            if not self._deadlines:
+                return self.ttl
+            return max(0.0, self._deadlines[0][0] - self.clock())
+
+    def anyInState(self, state: NodeState):
+        """ Get the IP of the node that has been in a state the longest, or None if no live node is in it """
+        self.expire()
+        with self._lock:
+            return next(iter(self._byState[state]), None)
+
+    def inState(self, state: NodeState) -> list:
+        """ Get the IPs of every live node in a state, longest in it first """
+        self.expire()
+        with self._lock:
+            return list(self._byState[state])
+
+    def get(self, ip: str):
+        """ Get the last (packet, time seen) of a node, or None if it is not known """
+        with self._lock:
+            return self._nodes.get(ip)
+
+    def snapshot(self) -> MappingProxyType:
+        """ Get a read-only ip -> (packet, time seen) copy, consistent with itself even while packets keep arriving """
+        self.expire()
+        with self._lock:
+            if not self._snapshotValid:
+                self._snapshot = MappingProxyType(dict(self._nodes))
+                self._snapshotValid = True
+            return self._snapshot
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __contains__(self, ip) -> bool:
+        return ip in self._nodes
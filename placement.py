@@ -0,0 +1,156 @@
+"""
+Ranks the idle nodes as destinations for a migration, instead of taking the first idle node.
+A migration to a node that is itself about to lose its supply only moves the process again a little later,
+so every idle node gets a score from 0 to 1, the weighted sum of the scorers in SCORERS:
+    voltage     supply voltage from the status packets, between the migrate threshold and a healthy supply
+    trend       slope of the supply voltage over the last TREND_WINDOW seconds, a falling supply scores low
+    history     how often the node migrated away or failed a handoff in the last HISTORY_WINDOW seconds
+    throughput  bandwidth measured on the last transfer to the node, relative to the fastest known node
+    resources   free RAM and disk from the status packets (version 2 and later)
+A scorer gets the candidate dict of a node (see PlacementEngine.candidate) and returns a score from 0 to 1, or None if it
+does not know (the weight is then spread over the other scorers). Scorers and weights can be replaced per engine.
+rank() returns every idle node (or every node in the given states) best first, so a failed handoff goes straight to the next one.
+"""
+import threading
+import time
+from collections import deque
+
+import powerSignal
+import simulatedADC
+from statusProtocol import NodeState
+
+MIGRATE_VOLTS = 12  # a node below the migration threshold (migrator.isLossOfPower) is never a candidate
+HEALTHY_VOLTS = 24  # a supply at or above this scores 1
+TREND_WINDOW = 60  # seconds of voltage samples the trend is fitted over
+TREND_FULL_SCALE = 6  # volts per minute: falling this fast scores 0, rising this fast scores 1
+HISTORY_WINDOW = 3600  # seconds a migration away from a node or a failed handoff counts against it
+WEIGHTS = {"voltage": 0.35, "trend": 0.25, "history": 0.2, "throughput": 0.1, "resources": 0.1}
+
+
+def clamp(value: float) -> float:
+    return max(0.0, min(1.0, value))
+
+
+def voltageScore(candidate: dict):
+    if candidate["volts"] is None:
+        return None
+    return clamp((candidate["volts"] - MIGRATE_VOLTS) / (HEALTHY_VOLTS - MIGRATE_VOLTS))
+
+
+def trendScore(candidate: dict):
+    if candidate["slope"] is None:
+        return None
+    return clamp(0.5 + candidate["slope"] / (2 * TREND_FULL_SCALE))
+
+
+def historyScore(candidate: dict):
+    return 1 / (1 + candidate["migrations"] + 2 * candidate["failures"])
+
+
+def throughputScore(candidate: dict):
+    if candidate["bandwidth"] is None or not candidate["best_bandwidth"]:
+        return None
+    return clamp(candidate["bandwidth"] / candidate["best_bandwidth"])
+
+
+def resourceScore(candidate: dict):
+    if candidate["free_ram_mb"] is None:
+        return None
+    return clamp(candidate["free_ram_mb"] / 1024) / 2 + clamp(candidate["free_disk_mb"] / 8192) / 2
+
+
+SCORERS = {"voltage": voltageScore, "trend": trendScore, "history": historyScore,
+           "throughput": throughputScore, "resources": resourceScore}
+
+
+def slope(samples) -> float:
+    """ Least squares slope of (seconds, volts) samples in volts per minute, None if it cannot be fit """
+    if not samples:
+        return None
+    value, _ = powerSignal.fitLine([t - samples[-1][0] for t, _ in samples], [v for _, v in samples])
+    return value * 60 if value is not None else None
+
+
+class PlacementEngine:
+    """ Scores the idle nodes of a nodeRegistry.NodeRegistry from what their status packets and past transfers showed """
+
+    def __init__(self, registry, bandwidth=None, scorers=None, weights=None, clock=time.monotonic):
+        self.registry = registry
+        self.bandwidth = bandwidth or (lambda ip: None)  # ip -> measured bytes per second, or None if nothing was sent to it yet
+        self.scorers = scorers or SCORERS
+        self.weights = weights or WEIGHTS
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._voltages = {}  # ip -> deque of (time, volts)
+        self._migrations = {}  # ip -> deque of times the node was seen migrating away
+        self._failures = {}  # ip -> deque of times a handoff to the node failed
+        self._states = {}  # ip -> last state seen, to count the transitions into MIGRATING
+
+    def observe(self, packet: dict) -> None:
+        """ Record a status packet (as decoded by statusProtocol.decode) for the voltage trend and the migration history """
+        ip, now = packet["ip"], self.clock()
+        with self._lock:
+            if packet["voltage"] > 0:  # a node without an ADC broadcasts 0
+                samples = self._voltages.setdefault(ip, deque())
+                samples.append((now, packet["voltage"] * simulatedADC.ADC_SCALE))
+                while samples[0][0] < now - TREND_WINDOW:
+                    samples.popleft()
+            if packet["state"] == NodeState.MIGRATING and self._states.get(ip) != NodeState.MIGRATING:
+                self._migrations.setdefault(ip, deque()).append(now)
+            self._states[ip] = packet["state"]
+
+    def recordFailure(self, ip) -> None:
+        """ Remember a failed handoff to a node, it ranks lower for HISTORY_WINDOW seconds """
+        with self._lock:
+            self._failures.setdefault(str(ip), deque()).append(self.clock())
+
+    def recent(self, events: dict, ip: str) -> int:
+        """ Count the events of a node in the history window, dropping older ones """
+        times = events.get(ip)
+        if not times:
+            return 0
+        while times and times[0] < self.clock() - HISTORY_WINDOW:
+            times.popleft()
+        return len(times)
+
+    def candidate(self, ip: str, packet: dict, bestBandwidth=None) -> dict:
+        """ Everything the scorers know about a node """
+        with self._lock:
+            samples = list(self._voltages.get(ip, ()))
+            migrations, failures = self.recent(self._migrations, ip), self.recent(self._failures, ip)
+        return {"ip": ip, "volts": packet["voltage"] * simulatedADC.ADC_SCALE if packet["voltage"] > 0 else None,
+                "slope": slope(samples), "migrations": migrations, "failures": failures,
+                "bandwidth": self.bandwidth(ip), "best_bandwidth": bestBandwidth,
+                "free_ram_mb": packet.get("free_ram_mb"), "free_disk_mb": packet.get("free_disk_mb")}
+
+    def score(self, candidate: dict) -> float:
+        """ Weighted mean of the scores that are known, from 0 to 1 """
+        total, weights = 0.0, 0.0
+        for name, scorer in self.scorers.items():
+            value = scorer(candidate)
+            if value is not None:
+                total += self.weights.get(name, 0) * value
+                weights += self.weights.get(name, 0)
+        return total / weights if weights else 0.0
+
+    def rank(self, requiredRamMB=0, requiredDiskMB=0, exclude=(), states=(NodeState.IDLE,), withScores=False) -> list:
+        """
+        Get the nodes in one of the states (idle by default) that can take a process, best first. Nodes below the migrate threshold,
+        nodes that report less free RAM or disk than required, and the excluded nodes are left out.
+        withScores gives (score, ip) pairs instead of the IPs
+        """
+        ips = [ip for state in states for ip in self.registry.inState(state) if ip not in exclude]
+        bandwidths = [b for b in map(self.bandwidth, ips) if b is not None]
+        candidates = []
+        for ip in ips:
+            known = self.registry.get(ip)
+            if known is None:  # expired since inState()
+                continue
+            candidate = self.candidate(ip, known[0], max(bandwidths, default=None))
+            if candidate["volts"] is not None and candidate["volts"] < MIGRATE_VOLTS:
+                continue
+            if candidate["free_ram_mb"] is not None and (candidate["free_ram_mb"] < requiredRamMB or candidate["free_disk_mb"] < requiredDiskMB):
+                continue
+            candidates.append((self.score(candidate), ip))
+        candidates.sort(key=lambda scored: -scored[0])  # stable, equal scores keep the longest idle node first
+        return candidates if withScores else [ip for _, ip in candidates]
@@ -0,0 +1,137 @@
+"""
+Streaming processing of the supply voltage samples, so a node can see a power loss coming instead of reacting after the drop.
+Every sample goes through two filters:
+    noise rejection  a sample more than SPIKE_VOLTS away from the median of the last MEDIAN_SAMPLES raw samples is replaced
+                     by that median, so a single spike from the ADC is dropped while ordinary samples pass unchanged
+    smoothing        an exponentially weighted moving average (EWMA), the level the thresholds are compared to
+The cleaned samples go into a fixed size ring buffer, and the slope is a least squares fit over it. The fit keeps running sums
+of the buffer (updated as a sample goes in and the oldest one drops out), so a sample costs the same however large the buffer
+is (it grows with the sample rate). The sums are recomputed from the buffer once per pass through it, relative to the newest
+sample time, so neither large monotonic times nor the rounding of the updates erode them. The slope only counts when
+it is significant (more than SIGNIFICANCE standard errors from 0), so noise on a steady supply does not look like a trend.
+timeToThreshold() extrapolates the level along the slope, and predictedTime() is the longest of the last HOLD_SAMPLES
+predictions, so a migration is only started ahead of a loss that has been predicted for a few samples in a row.
+"""
+import math
+from collections import deque
+
+CAPACITY = 60  # samples in the ring buffer, 3 s at the adcSampler.RATE of 20 samples per second
+MEDIAN_SAMPLES = 3
+SPIKE_VOLTS = 2  # a sample further than this from the median is a spike
+ALPHA = 0.3  # weight of a new sample in the EWMA, a time constant of about 3 samples
+SIGNIFICANCE = 4  # standard errors a slope has to be away from 0 to count
+HOLD_SAMPLES = 5  # predictions in a row that predictedTime() takes the longest of
+
+
+def lineFromSums(n: int, sumT: float, sumV: float, sumTT: float, sumTV: float, sumVV: float) -> tuple:
+    """ The fit of fitLine() from the sums of the times, values, their squares and products. returns (slope, standard error) """
+    if n < 3:
+        return None, None
+    spread = sumTT - sumT * sumT / n
+    if spread <= 0:
+        return None, None
+    covariance = sumTV - sumT * sumV / n
+    slope = covariance / spread
+    residuals = max(sumVV - sumV * sumV / n - slope * covariance, 0.0)  # rounding can take an exact fit just below 0
+    return slope, math.sqrt(residuals / (n - 2) / spread)
+
+
+def fitLine(times, values) -> tuple:
+    """ Least squares fit of values over times. returns (slope per unit of time, its standard error), (None, None) if it cannot be fit """
+    n = len(times)
+    if n < 3:
+        return None, None
+    meanT, meanV = sum(times) / n, sum(values) / n
+    spread = sum((t - meanT) ** 2 for t in times)
+    if spread == 0:
+        return None, None
+    slope = sum((t - meanT) * (v - meanV) for t, v in zip(times, values)) / spread
+    residuals = sum((v - meanV - slope * (t - meanT)) ** 2 for t, v in zip(times, values))
+    return slope, math.sqrt(residuals / (n - 2) / spread)
+
+
+class PowerSignal:
+    """ Filtered supply voltage with its trend and the predicted time until it falls to a threshold, fed one sample at a time """
+
+    def __init__(self, threshold: float, capacity=CAPACITY, alpha=ALPHA):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.alpha = alpha
+        self.times = [0.0] * capacity  # ring buffer of sample times
+        self.volts = [0.0] * capacity  # ring buffer of the samples, spikes replaced
+        self.count = 0  # samples added so far, the next one goes to count % capacity
+        self.raw = deque(maxlen=MEDIAN_SAMPLES)  # the last raw samples
+        self.predictions = deque(maxlen=HOLD_SAMPLES)  # the last results of timeToThreshold()
+        self.ewma = None
+        self.origin = 0.0  # the sums are of the sample times minus origin
+        self.sums = [0.0] * 5  # sums over the ring buffer of t, v, t*t, t*v and v*v
+
+    def add(self, time: float, volts: float) -> None:
+        """ Add a sample taken at time (seconds, monotonic) """
+        self.raw.append(volts)
+        median = sorted(self.raw)[len(self.raw) // 2]
+        if abs(volts - median) > SPIKE_VOLTS:
+            volts = median
+        self.ewma = volts if self.ewma is None else self.alpha * volts + (1 - self.alpha) * self.ewma
+        index = self.count % self.capacity
+        if self.count == 0:
+            self.origin = time
+        if self.count >= self.capacity:  # the oldest sample drops out
+            self.accumulate(self.times[index], self.volts[index], -1)
+        self.times[index], self.volts[index] = time, volts
+        self.accumulate(time, volts, 1)
+        self.count += 1
+        if self.count % self.capacity == 0:
+            self.rebase()
+        self.predictions.append(self.timeToThreshold())
+
+    def accumulate(self, time: float, volts: float, sign: int) -> None:
+        """ Add a sample to the running sums (sign 1) or take it out (sign -1) """
+        t = time - self.origin
+        for i, term in enumerate((t, volts, t * t, t * volts, volts * volts)):
+            self.sums[i] += sign * term
+
+    def rebase(self) -> None:
+        """ Recompute the sums from the ring buffer, relative to the newest sample time """
+        self.origin = self.times[(self.count - 1) % self.capacity]
+        self.sums = [0.0] * 5
+        for i in range(min(self.count, self.capacity)):
+            self.accumulate(self.times[i], self.volts[i], 1)
+
+    @property
+    def ready(self) -> bool:
+        """ True once the ring buffer is full, before that the slope is fit over few samples """
+        return self.count >= self.capacity
+
+    def level(self) -> float:
+        """ Filtered voltage, 0 before the first sample """
+        return self.ewma if self.ewma is not None else 0.0
+
+    def samples(self) -> tuple:
+        """ (times, volts) in the ring buffer, oldest first """
+        if self.count < self.capacity:
+            return self.times[:self.count], self.volts[:self.count]
+        start = self.count % self.capacity
+        return self.times[start:] + self.times[:start], self.volts[start:] + self.volts[:start]
+
+    def slope(self) -> float:
+        """ Volts per second over the ring buffer, 0 if the trend is not significant """
+        slope, error = lineFromSums(min(self.count, self.capacity), *self.sums)
+        if slope is None or abs(slope) < SIGNIFICANCE * error:
+            return 0.0
+        return slope
+
+    def timeToThreshold(self) -> float:
+        """ Predicted seconds until the level falls to the threshold: 0 if it is below already, infinite if it is not falling """
+        if self.level() <= self.threshold:
+            return 0.0
+        slope = self.slope()
+        if slope >= 0:
+            return math.inf
+        return (self.level() - self.threshold) / -slope
+
+    def predictedTime(self) -> float:
+        """ The longest of the last HOLD_SAMPLES predictions, infinite until the ring buffer is full """
+        if not self.ready:
+            return math.inf
+        return max(self.predictions)
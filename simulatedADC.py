@@ -0,0 +1,88 @@
+"""
+Stand-ins for the MCP3008 readings, so a node can run without the ADC (Cluster_Simulator.py, Power_Benchmark.py).
+A voltage trace is a text file of "<seconds> <volts>" lines, with the seconds counted from the start of the node.
+The voltage is interpolated linearly between the points and holds its last value after the end. Lines starting with # are comments.
+Traces recorded by adcSampler.TraceRecorder have the raw current reading as a third column, replayADC() plays back both.
+"""
+import bisect
+import random
+import time
+
+ADC_SCALE = 55  # volts of the PV supply per unit of ADC reading (vScale in migrator.isLossOfPower)
+
+
+def readTrace(path: str, column=1) -> list:
+    """ Read a voltage trace, returns (seconds, value) points sorted by time, the value from column (1 volts, 2 current) """
+    points = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split("#", 1)[0].split()
+            if len(fields) > column:
+                points.append((float(fields[0]), float(fields[column])))
+            elif fields:
+                raise ValueError(f"Voltage trace {path} has no column {column}: {line.strip()}")
+    if not points:
+        raise ValueError(f"Voltage trace {path} has no points")
+    return sorted(points)
+
+
+def writeTrace(path: str, points: list, comment="") -> None:
+    """ Write (seconds, volts) points as a voltage trace """
+    with open(path, "w") as f:
+        if comment:
+            f.write(f"# {comment}\n")
+        for seconds, volts in points:
+            f.write(f"{seconds} {volts}\n")
+
+
+class VoltageTrace:
+    """
+    Reads like MCP3008.value, following a voltage trace from the moment it is created.
+    The trace is a file or a list of (seconds, volts) points (a synthetic trace), noise adds gaussian noise of that many volts
+    """
+
+    def __init__(self, trace, scale=ADC_SCALE, column=1, noise=0.0, seed=None):
+        self.points = readTrace(trace, column) if isinstance(trace, str) else sorted(trace)
+        self.times = [seconds for seconds, _ in self.points]
+        self.scale = scale
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.start = time.monotonic()
+
+    def at(self, seconds: float) -> float:
+        """ Volts of the trace at seconds after its start, without noise """
+        index = bisect.bisect_right(self.times, seconds)
+        if index == 0:
+            return self.points[0][1]
+        if index == len(self.points):
+            return self.points[-1][1]
+        (t0, v0), (t1, v1) = self.points[index - 1], self.points[index]
+        return v0 + (v1 - v0) * (seconds - t0) / (t1 - t0)
+
+    @property
+    def value(self) -> float:
+        volts = self.at(time.monotonic() - self.start)
+        if self.noise:
+            volts += self.random.gauss(0, self.noise)
+        return volts / self.scale
+
+
+class FixedReading:
+    """ Reads like MCP3008.value, always the same value """
+
+    def __init__(self, value=0.0):
+        self.value = value
+
+
+def replayADC(trace, noise=0.0) -> tuple:
+    """
+    Make (voltage, current) channels that play back a trace in place of the two MCP3008 channels of migrator.runNode().
+    The current follows the third column of a recorded trace, a trace without one reads a current of 0
+    """
+    voltage = VoltageTrace(trace, noise=noise)
+    try:
+        current = VoltageTrace(trace, scale=1, column=2) if isinstance(trace, str) else FixedReading(0.0)
+    except ValueError:
+        current = FixedReading(0.0)
+    current.start = voltage.start  # both channels follow the same clock
+    return voltage, current
@@ -0,0 +1,87 @@
+"""
+Warm standby: while a node is BUSY, every process is checkpointed now and then and shipped to a buddy node, so when the
+power fails only the pages dirtied since the last round are left to send, and the buddy can take the process over
+if this node dies before it gets to migrate it.
+    rounds      criu dump --leave-running with --track-mem into precopy/<round>, on top of the previous round. Unlike a
+                pre-dump, a round can be restored on its own. The process is frozen while its delta is dumped
+    chain       every CHAIN_ROUNDS rounds a base round (every page) starts a new chain, so the buddy never restores through
+                a long chain of parents. The old chain is only removed once the new base round reached the buddy
+    period      adapts to the dirty rate of the process and the cost of a round, see nextPeriod()
+    RPO         the age of the newest checkpoint on the buddy, the state that is lost if the buddy has to take over
+    failover    when the buddy loses this node (no status for nodeRegistry.TTL seconds) and the alias of the process does not
+                answer, it acts on its POLICY: restore the newest checkpoint, restart the process from its files, or wait
+The buddy keeps a manifest of the newest checkpoint of every process it stands by for (transfer.standbyName), written
+only once the round arrived completely, so a round that was cut off halfway is never restored.
+"""
+import time
+
+import tracing
+
+MIN_PERIOD = 2  # seconds between rounds, at least
+MAX_PERIOD = 60  # seconds between rounds, at most, also the period of a process that dirties nothing
+LINK_SHARE = 0.2  # fraction of the link to the buddy the rounds may use, the processes themselves need the rest
+DELTA_SECONDS = 1.0  # seconds the final delta of a migration should take to send
+CHAIN_ROUNDS = 10  # rounds in a chain, including its base round
+SMOOTHING = 0.3  # weight of the newest round in the dirty rate and overhead estimates
+POLICIES = ("restore", "restart", "wait")  # what a buddy does when the source died before the final delta arrived
+
+
+def nextPeriod(dirtyRate: float, bandwidth: float, overhead: float, share=LINK_SHARE, deltaSeconds=DELTA_SECONDS) -> float:
+    """
+    Seconds until the next round. The delta of a round grows with the dirty rate (bytes per second), so a shorter period
+    keeps the final delta within deltaSeconds at the bandwidth to the buddy, and the RPO low. Every round also costs overhead
+    seconds (dump and round trip) besides sending its delta, so a shorter period uses more of the link:
+    (overhead + dirtyRate * period / bandwidth) / period must stay within share. When both cannot hold, the link share wins
+    """
+    if dirtyRate <= 0:
+        return MAX_PERIOD
+    fresh = deltaSeconds * bandwidth / dirtyRate  # longest period whose delta still sends in deltaSeconds
+    spare = share - dirtyRate / bandwidth  # share of the link left for the fixed cost of the rounds
+    cheap = overhead / spare if spare > 0 else MAX_PERIOD  # shortest period whose rounds stay within the share
+    return min(max(min(fresh, MAX_PERIOD), cheap, MIN_PERIOD), MAX_PERIOD)
+
+
+class Replica:
+    """ Standby state of one process on the source node: its buddy, the rounds it holds and the estimates for the period """
+
+    def __init__(self, name: str, buddy: str, clock=time.monotonic):
+        self.id = tracing.newMigrationId()  # ties together the spans of the rounds
+        self.name = name
+        self.buddy = buddy
+        self.clock = clock
+        self.round = 0  # newest round that reached the buddy, 0 before the first one
+        self.base = 0  # base round of the chain of self.round
+        self.taken = None  # clock time the newest round on the buddy was dumped, its age is the RPO
+        self.dirtyRate = 0.0  # bytes per second, from the deltas of the rounds
+        self.overhead = 1.0  # seconds a round costs besides sending its delta
+        self.period = MIN_PERIOD
+        self.due = clock()  # clock time of the next round
+
+    def parent(self):
+        """ The round the next one builds on, or None if it starts a new chain (the first round, or the chain is full) """
+        if self.round == 0 or self.round - self.base + 1 >= CHAIN_ROUNDS:
+            return None
+        return self.round
+
+    def shipped(self, round: int, size: int, taken: float, dumpSeconds: float, sendSeconds: float, bandwidth: float) -> None:
+        """ A round of size bytes, dumped at taken, reached the buddy. Update the estimates and schedule the next round """
+        if round - 1 == self.round and self.taken is not None and self.parent() is not None:  # a delta, not a base round
+            self.dirtyRate += SMOOTHING * (size / max(taken - self.taken, 1e-3) - self.dirtyRate)
+        if self.parent() is None:
+            self.base = round
+        self.overhead += SMOOTHING * (dumpSeconds + max(0.0, sendSeconds - size / bandwidth) - self.overhead)
+        self.round, self.taken = round, taken
+        self.period = nextPeriod(self.dirtyRate, bandwidth, self.overhead)
+        self.due = taken + self.period
+
+    def failed(self) -> None:
+        """ A round did not reach the buddy, the next one is tried after a period """
+        self.due = self.clock() + self.period
+
+    def delta(self) -> float:
+        """ Bytes the process dirtied since the newest round on the buddy, about what the final delta of a migration sends """
+        return self.dirtyRate * self.rpo() if self.taken is not None else float("inf")
+
+    def rpo(self) -> float:
+        """ Age of the newest checkpoint on the buddy in seconds, infinite before the first one arrived """
+        return self.clock() - self.taken if self.taken is not None else float("inf")
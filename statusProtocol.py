@@ -0,0 +1,75 @@
+"""
+Binary status packet that every node broadcasts five times a second, shared by migrator.py and hmi_code/frontend.py.
+It replaces the pickled selfState dict: decoding a fixed layout is faster, the packet is a tenth of the size,
+and a packet from a random host on the segment can no longer run code on the receiver.
+
+Layout (network byte order):
+    header   magic "SN" (2 bytes), version (1 byte), length of the body (1 byte)
+    body v1  state code (1 byte), flags (1 byte), node IPv4 address (4 bytes), sequence number (4 bytes),
+             voltage and current as signed fixed point in 1/10000 of an ADC reading (2 bytes each),
+             time of the last state change in seconds since the epoch (8 byte float)
+    body v2  v1 followed by free RAM and free disk space of the node in MiB (4 bytes each), used to place migrations
+A newer version only appends fields to the body, so older receivers decode the fields they know and skip the rest.
+"""
+import socket
+import struct
+from enum import Enum, auto
+
+MAGIC = b"SN"
+VERSION = 2
+HEADER = struct.Struct("!2sBB")
+BODY_V1 = struct.Struct("!BB4sIhhd")
+BODY_V2 = struct.Struct("!II")  # appended to BODY_V1
+FIXED_POINT = 10000  # voltage and current are sent in units of 1/FIXED_POINT
+FLAG_MANUAL = 0x01  # the node is in manual mode
+
+
+class NodeState(Enum):
+    """ Enum for the state of the node. This is used to determine if the node can accept processes or not"""
+    IDLE = auto()			# Node is idle and ready to accept
+    BUSY = auto()			# Node is busy with processes and cannot accept processes
+    MIGRATING = auto()  	# Node is migrating to another and cannot accept processes
+    SHUTDOWN = auto()		# Node is shutting down and cannot accept processes
+
+    def __str__(self):
+        return self.name
+
+
+STATES = {state.value: state for state in NodeState}  # state code -> state, faster than NodeState(code)
+
+
+def toFixed(value: float) -> int:
+    """ Convert an ADC reading to fixed point, clamped to the range of the field """
+    return max(-32768, min(32767, round(value * FIXED_POINT)))
+
+
+def encode(status: dict, sequence: int) -> bytes:
+    """ Encode the status of a node (the selfState dict of migrator.py) into a packet """
+    body = BODY_V1.pack(status["state"].value, FLAG_MANUAL if status.get("manual") else 0, socket.inet_aton(status["ip"]),
+                        sequence & 0xFFFFFFFF, toFixed(status["voltage"]), toFixed(status["current"]), status.get("changed", 0.0))
+    body += BODY_V2.pack(min(status.get("free_ram_mb", 0), 0xFFFFFFFF), min(status.get("free_disk_mb", 0), 0xFFFFFFFF))
+    return HEADER.pack(MAGIC, VERSION, len(body)) + body
+
+
+def decode(packet: bytes) -> dict:
+    """
+    Decode a status packet into a dict with the keys the receivers used to read from the pickled selfState
+    (ip, state, voltage, current, manual) plus version, seq and changed, and free_ram_mb and free_disk_mb (None before version 2).
+    raises ValueError if the packet is not a valid status packet
+    """
+    if len(packet) < HEADER.size:
+        raise ValueError("Status packet is too short")
+    magic, version, length = HEADER.unpack_from(packet)
+    if magic != MAGIC or version < 1:
+        raise ValueError("Not a status packet")
+    if len(packet) < HEADER.size + length or length < BODY_V1.size:
+        raise ValueError("Status packet is truncated")
+    code, flags, address, sequence, voltage, current, changed = BODY_V1.unpack_from(packet, HEADER.size)
+    if code not in STATES:
+        raise ValueError(f"Unknown node state {code}")
+    freeRam, freeDisk = None, None
+    if version >= 2 and length >= BODY_V1.size + BODY_V2.size:
+        freeRam, freeDisk = BODY_V2.unpack_from(packet, HEADER.size + BODY_V1.size)
+    return {"ip": socket.inet_ntoa(address), "state": STATES[code], "voltage": voltage / FIXED_POINT,
+            "current": current / FIXED_POINT, "manual": bool(flags & FLAG_MANUAL), "version": version,
+            "seq": sequence, "changed": changed, "free_ram_mb": freeRam, "free_disk_mb": freeDisk}
@@ -0,0 +1,56 @@
+"""
+Tests of the decisions of the main loop of a node, run from the repository root with python3 -m pytest
+"""
+import asyncio
+import math
+import unittest
+from unittest import mock
+
+import migrator
+import powerSignal
+from statusProtocol import NodeState
+
+
+class StartupTest(unittest.TestCase):
+    """ runNode queues the "start" event before watchPower has fed the first ADC batch, the FSM must not read that as 0 V """
+
+    def setUp(self):
+        patches = [mock.patch.object(migrator, "useADC", True, create=True),
+                   mock.patch.object(migrator, "power", powerSignal.PowerSignal(migrator.MIGRATE_VOLTS)),
+                   mock.patch.object(migrator, "getNewProcesses", return_value=[]),  # no /home/pi here
+                   mock.patch.dict(migrator.selfState, {"state": NodeState.IDLE})]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def runFSM(self, event: tuple) -> NodeState:
+        async def run():
+            with mock.patch.object(migrator, "events", asyncio.Queue()):
+                await migrator.MainFSM(event)
+        asyncio.run(run())
+        return migrator.selfState["state"]
+
+    def feed(self, volts: float, samples: int) -> None:
+        start = migrator.power.count * 0.05
+        for i in range(samples):
+            migrator.power.add(start + i * 0.05, volts)
+
+    def test_no_sample_is_no_power_loss(self):
+        self.assertFalse(migrator.isLossOfPower())
+        self.assertFalse(migrator.isLossOfPower(vThresh=migrator.SHUTDOWN_VOLTS))
+        self.assertFalse(migrator.isCutoffPredicted())
+        self.assertEqual(migrator.powerBudget(), math.inf)
+
+    def test_start_before_first_batch(self):
+        self.assertEqual(self.runFSM(("start", None)), NodeState.IDLE)
+        self.feed(24.0, 20)  # the first batch of a healthy supply
+        self.assertEqual(self.runFSM(("power", "ok")), NodeState.IDLE)
+
+    def test_collapse_after_first_batch(self):
+        self.feed(24.0, 20)
+        self.feed(2.0, 20)
+        self.assertEqual(self.runFSM(("power", "collapsed")), NodeState.SHUTDOWN)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+"""
+Tests of the transfer service on the loopback interface, run from the repository root with python3 -m pytest
+"""
+import os
+import tempfile
+import unittest
+
+import transfer
+
+KEY = b"test"
+
+
+class ProcessNameTest(unittest.TestCase):
+    """ A request whose process name is not one plain directory name must not touch the directories of the other processes """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.directory.name, "pi")
+        os.makedirs(os.path.join(self.root, "otherproc"))
+        for path in ("otherproc/main.py", ".migrator_key", "../sibling.txt"):
+            with open(os.path.join(self.root, path), "w") as f:
+                f.write("keep\n")
+        self.server = transfer.TransferServer(KEY, root=self.root, port=0)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.server.join()
+        self.directory.cleanup()
+
+    def request(self, request: dict) -> None:
+        """ Send one request on a new connection, the server closes a connection after it refused a request """
+        peer = transfer.PeerConnection("127.0.0.1", KEY, port=self.server.sock.getsockname()[1])
+        try:
+            transfer.sendMessage(peer.sock, request)
+            peer.reply()
+        finally:
+            peer.sock.close()
+
+    def test_refuses_dot_names(self):
+        for name in (".", "..", "", "a/b", "*"):
+            for op in ("files", "done", "standby"):
+                with self.subTest(name=name, op=op), self.assertRaises(transfer.TransferError):
+                    self.request({"op": op, "name": name, "files": [], "images": None})
+        for path in ("otherproc/main.py", ".migrator_key", "../sibling.txt"):
+            self.assertTrue(os.path.exists(os.path.join(self.root, path)), path)
+
+    def test_accepts_plain_name(self):
+        self.request({"op": "files", "name": "videoboard", "files": []})
+        self.assertTrue(os.path.exists(os.path.join(self.root, "otherproc/main.py")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+Span tracing for migrations. Every phase of a migration, on the source and on the receiving node, is recorded as a span
+in an append-only JSONL log, tagged with a migration ID that is shared by both nodes.
+Durations come from the monotonic clock. The wall clock start time is only kept to line up the spans of both nodes.
+Migration_Report.py aggregates the logs of many migrations into per-phase percentiles.
+"""
+import json
+import os
+import resource
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+SPAN_LOG = "/home/pi/migrate_spans.jsonl"
+
+
+def cpuTime() -> float:
+    """ Get the user and system CPU seconds used by this process and its waited-for children """
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def newMigrationId() -> str:
+    """ Create the ID that ties together the spans of one migration on every node """
+    return uuid.uuid4().hex[:12]
+
+
+class Tracer:
+    """ Appends spans to the span log of this node """
+
+    def __init__(self, path=SPAN_LOG, node=""):
+        self.path = path
+        self.node = node  # IP address of this node, set once it is known
+        self.lock = threading.Lock()  # spans are recorded from the main loop and from background threads
+
+    def record(self, migrationId: str, phase: str, start_ns: int, end_ns: int, **attributes) -> None:
+        """ Record a span from monotonic start and end times (time.monotonic_ns) """
+        span = {"migration": migrationId, "node": self.node, "phase": phase,
+                "start": time.time_ns() - (time.monotonic_ns() - start_ns),  # wall clock, to line up both nodes
+                "duration_ms": (end_ns - start_ns) / 1e6, **attributes}
+        line = (json.dumps(span) + "\n").encode()
+        with self.lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)  # a single append, so a crash never leaves half a span in the log
+            finally:
+                os.close(fd)
+
+    @contextmanager
+    def span(self, migrationId: str, phase: str, **attributes):
+        """
+        Record the time spent in a with block as a span. Attributes can be added to the yielded dict inside the block.
+        A span is recorded even if the block raises, with the error as an attribute.
+        The CPU time used by this process and the children it waited for (e.g. criu) is recorded as cpu_ms.
+        """
+        start, cpu = time.monotonic_ns(), cpuTime()
+        try:
+            yield attributes
+        except Exception as e:
+            attributes["error"] = str(e)
+            raise
+        finally:
+            attributes["cpu_ms"] = (cpuTime() - cpu) * 1000
+            self.record(migrationId, phase, start, time.monotonic_ns(), **attributes)
+
+
+def readSpans(paths) -> list:
+    """ Read the spans from the span logs of one or more nodes, skipping lines that are not valid JSON """
+    spans = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    spans.append(json.loads(line))
+                except ValueError:
+                    pass
+    return spans
+
+
+def percentile(values: list, p: float) -> float:
+    """ Get the p-th percentile (0-100) of the values, using the nearest rank """
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))  # ceil without floats
+    return ordered[int(rank) - 1]
@@ -0,0 +1,872 @@
+"""
+Transfer service used to migrate processes between nodes, replacing the per-call `scp` under pexpect.
+
+Every node runs a TransferServer. Other nodes connect to it once, authenticate with an HMAC challenge-response
+on the shared key, and keep the connection open in a ConnectionPool, so a migration does not pay for a new
+SSH handshake, key exchange and process spawn for every copy.
+
+Every message on a connection is length-prefixed (a 4 byte big endian size followed by a JSON payload or raw bytes).
+A request is a JSON message with an "op" field, followed by its data, and is answered with a JSON message that has "ok" set:
+- "images": stream CRIU images into the RAM-backed staging directory (tmpfs) of the process, so the images never touch
+  the SD card on either side. With deduplication, the header also carries the chunk manifest of every file (see chunkStore),
+  the receiver answers with the chunks missing from its chunk store, and only those are sent.
+- "files": mirror the process directory. Application files carry their digest from the hash manifest of the sender
+  (see appManifest.py), the receiver only wants the ones whose content it does not have in its own manifest. Image files are
+  all wanted, or in incremental mode only the ones whose size or modification time differ. Then only those are sent.
+- "begin", "range", "commit": parallel image stream. "begin" announces the image files and is answered with the ranges the
+  receiver already verified (so an interrupted transfer resumes where it stopped). Every "range" request carries a CRC32 of its
+  data, computed while sending, and the receiver checks it while receiving. The ranges are spread over several connections.
+  Ranges can be compressed with a codec picked from the measured link bandwidth and spare CPU (see chooseCodec),
+  ranges that do not compress are sent as they are.
+- "reserve", "release": a lease on a slot of the receiver for one process (see leaseTable.py), asked for before the process
+  is frozen. The answer carries the lease id, or no lease if the receiver does not accept processes or lacks the RAM.
+- "done": the transfer is complete. The receiver writes the finish flag of the process itself (see flagName), with the
+  images directory of the dump to restore, so no separate flag copy is needed. It also ends the lease of the process and drops its standby manifest.
+- "standby": a warm standby round of the process is complete (see standby.py), its files were mirrored by a "files" request
+  before. The receiver records the round in the standby manifest of the process (see standbyName), or drops the manifest
+  and the replicated directory when the source stops standing by.
+- "command": a "migrate", "shutdown" or "idle" command for the main loop of the receiver, the same as the HMI's force_*.txt flags.
+"""
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import socket
+import struct
+import queue
+import threading
+import time
+import zlib
+
+import appManifest
+import chunkStore
+import hostOps
+
+TRANSFER_PORT = 12346      # port the transfer server listens on
+STAGING_ROOT = "/dev/shm"  # tmpfs, so staged images live in RAM instead of on the SD card
+BUFFER_SIZE = 1024 * 1024  # size of the reads used when copying socket data into files
+KEY_FILE = "/home/pi/.migrator_key"  # shared key of the cluster, the same file on every node
+DEFAULT_KEY = b"pi"  # used when there is no key file, the same credential that the scp transfers typed in
+COMMANDS = ("migrate", "shutdown", "idle")  # commands a node accepts from other authenticated nodes
+RANGE_SIZE = 4 * 1024 * 1024  # image files are split into ranges of this size for the parallel stream
+MAX_STREAMS = 4  # upper bound for the number of parallel connections, the actual number is tuned during the transfer
+TUNE_PERIOD = 0.25  # seconds between the throughput measurements that decide whether to open another stream
+JOURNAL_FILE = ".transfer"  # in the staging directory, lists the verified ranges of an unfinished parallel stream
+DEFAULT_BANDWIDTH = 11e6  # bytes per second assumed for a node that nothing was sent to yet (100 Mbit ethernet of the Pi)
+CODEC_SAMPLE_SIZE = 256 * 1024  # bytes of the images that every codec compresses to estimate its speed and ratio
+INCOMPRESSIBLE = 0.9  # a range is sent uncompressed if compressing does not shrink it below this fraction
+LEASE_STREAM = "lease"  # pooled connection the source renews its leases on, so the renewals do not wait for a running handoff
+DEFAULT_WORKLOAD = "videoboard"  # the process of the single-process nodes, its flags keep the names the HMI writes
+
+# codec name -> (compress, decompress). lz4 and zstd are used when their packages are installed, zlib is always there
+CODECS = {"none": (bytes, bytes)}
+for level in (1, 6):
+    CODECS[f"zlib-{level}"] = (lambda data, level=level: zlib.compress(data, level), zlib.decompress)
+try:
+    import lz4.frame
+    CODECS["lz4"] = (lz4.frame.compress, lz4.frame.decompress)
+except ImportError:
+    pass
+try:
+    import zstandard
+    for level in (1, 3, 9):
+        CODECS[f"zstd-{level}"] = (lambda data, level=level: zstandard.ZstdCompressor(level=level).compress(data),
+                                   lambda data: zstandard.ZstdDecompressor().decompress(data))
+except ImportError:
+    pass
+
+
+class TransferError(Exception):
+    """ Raised when the other node refuses or fails a transfer request """
+
+
+def loadKey(path=KEY_FILE) -> bytes:
+    """ Read the shared key of the cluster """
+    try:
+        with open(path, "rb") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        print(f"WARNING: no key file at {path}, using the default key. Any host on the network can send processes and files "
+              f"to this node, create {path} with the same secret on every node")
+        return DEFAULT_KEY
+
+
+def stagingDir(name: str) -> str:
+    """ Get the RAM-backed directory that holds the images of the process with the given name """
+    return os.path.join(STAGING_ROOT, f"{name}-images")
+
+
+def sendMessage(sock: socket.socket, message: dict) -> None:
+    """ Send a JSON message prefixed with its length """
+    payload = json.dumps(message).encode()
+    sock.sendall(struct.pack("!I", len(payload)) + payload)
+
+
+def recvExactly(sock: socket.socket, size: int) -> bytes:
+    """ Receive exactly size bytes, raises ConnectionError if the peer closes the connection early """
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed in the middle of a message")
+        data += chunk
+    return bytes(data)
+
+
+def recvMessage(sock: socket.socket) -> dict:
+    """ Receive a JSON message prefixed with its length """
+    size, = struct.unpack("!I", recvExactly(sock, 4))
+    return json.loads(recvExactly(sock, size))
+
+
+def sendFrame(sock: socket.socket, data: bytes) -> None:
+    """ Send raw bytes prefixed with their length """
+    sock.sendall(struct.pack("!I", len(data)))
+    sock.sendall(data)
+
+
+def recvFrame(sock: socket.socket) -> bytes:
+    """ Receive raw bytes prefixed with their length """
+    size, = struct.unpack("!I", recvExactly(sock, 4))
+    return recvExactly(sock, size)
+
+
+def recvIntoFile(sock: socket.socket, path: str, size: int, buffer: memoryview, digest=None) -> None:
+    """ Receive exactly size bytes of raw file content into the file at path, and into the hash digest if one is given """
+    with open(path, "wb") as f:
+        while size > 0:
+            received = sock.recv_into(buffer[:min(size, len(buffer))])
+            if received == 0:
+                raise ConnectionError(f"connection closed in the middle of {path}")
+            f.write(buffer[:received])
+            if digest is not None:
+                digest.update(buffer[:received])
+            size -= received
+
+
+def availableCPUs() -> float:
+    """ Get the number of CPUs that are not busy, from the 1 minute load average """
+    return max(1.0, (os.cpu_count() or 1) - os.getloadavg()[0])
+
+
+def sampleFile(path: str, pieces=4) -> bytes:
+    """ Read CODEC_SAMPLE_SIZE bytes of a file, taken from evenly spread offsets so the sample represents the whole file """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        return b"".join(os.pread(f.fileno(), CODEC_SAMPLE_SIZE // pieces, size * i // pieces) for i in range(pieces))
+
+
+def chooseCodec(sample: bytes, bandwidth: float, cpus: float) -> str:
+    """
+    Pick the codec that moves the images fastest: every codec compresses the sample, and its effective throughput is
+    the slower of compressing (on the spare CPUs) and sending the compressed bytes over a link with the given bandwidth.
+    """
+    best, bestThroughput = "none", bandwidth
+    for name, (compress, _) in CODECS.items():
+        if name == "none" or not sample:
+            continue
+        start = time.perf_counter()
+        ratio = len(compress(sample)) / len(sample)
+        speed = len(sample) / max(time.perf_counter() - start, 1e-6)
+        throughput = min(speed * min(cpus, MAX_STREAMS), bandwidth / ratio)
+        if throughput > bestThroughput:
+            best, bestThroughput = name, throughput
+    return best
+
+
+def flagName(kind: str, name: str) -> str:
+    """ File name (in /home/pi) of the start or finish flag ("startflag" or "cpflag") of the process in /home/pi/<name> """
+    return f"{kind}.txt" if name == DEFAULT_WORKLOAD else f"{kind}-{name}.txt"
+
+
+def flagWorkload(flag: str) -> str:
+    """ Name of the process a start or finish flag file belongs to, the reverse of flagName """
+    stem = flag[:-len(".txt")]
+    return stem.split("-", 1)[1] if "-" in stem else DEFAULT_WORKLOAD
+
+
+def standbyName(name: str) -> str:
+    """ File name (in /home/pi) of the standby manifest of the process in /home/pi/<name>, on its buddy node """
+    return f"standby-{name}.json"
+
+
+def standbyWorkload(manifest: str) -> str:
+    """ Name of the process a standby manifest file belongs to, the reverse of standbyName """
+    return manifest[len("standby-"):-len(".json")]
+
+
+def writeFlag(path: str, migrationId=None, **fields) -> None:
+    """ Write a finish flag holding the migration ID, when it was written (monotonic clock of this node) and any other fields """
+    with open(path, "w") as f:
+        json.dump({"migration": migrationId, "written_ns": time.monotonic_ns(), **fields}, f)
+
+
+def readFlag(path: str) -> dict:
+    """ Read a finish flag. Flags written by hand (e.g. touch) are empty and give an empty dict """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def checkProcessName(name: str) -> str:
+    """ Make sure a process name received from another node is one plain directory name, its directory is mirrored and cleaned """
+    if not isinstance(name, str) or name in ("", ".", "..") or any(c in name for c in "/\\*?[]\0"):
+        raise ValueError(f"refusing the process name {name!r}")
+    return name
+
+
+def checkRelativePath(path: str) -> str:
+    """ Make sure a path received from another node stays inside the directory it is written to """
+    if os.path.isabs(path) or ".." in path.split("/") or path in ("", "."):
+        raise ValueError(f"refusing to write outside the process directory: {path!r}")
+    return path
+
+
+def checkLinkTarget(path: str, link: str) -> str:
+    """ Make sure a symlink received from another node (at path, pointing to link) points inside the directory it is written to """
+    if os.path.isabs(link):
+        raise ValueError(f"refusing a link outside the process directory: {path!r} -> {link!r}")
+    checkRelativePath(os.path.normpath(os.path.join(os.path.dirname(path), link)))
+    return link
+
+
+def checkInsideRoot(root: str, local: str) -> str:
+    """ Make sure no directory on the way to local is a symlink that leads out of root, before local is written """
+    realRoot = os.path.realpath(root)
+    if os.path.commonpath([realRoot, os.path.realpath(os.path.dirname(local))]) != realRoot:
+        raise ValueError(f"refusing to write through a symlink: {os.path.relpath(local, root)!r}")
+    return local
+
+
+def listFiles(root: str) -> list:
+    """ List the files below root as [relative path, size, modification time in ns, symlink target or None] """
+    entries = []
+    for directory, dirs, files in os.walk(root):
+        for name in dirs + files:
+            path = os.path.join(directory, name)
+            if os.path.islink(path):  # e.g. the `parent` links between pre-dump rounds, sent as links and never followed
+                entries.append([os.path.relpath(path, root), 0, 0, os.readlink(path)])
+            elif os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append([os.path.relpath(path, root), stat.st_size, stat.st_mtime_ns, None])
+    return entries
+
+
+class PeerConnection:
+    """ Authenticated connection to the transfer server of another node, reused for every transfer to that node """
+
+    def __init__(self, ip, key: bytes, port=TRANSFER_PORT, timeout=30):
+        self.ip = str(ip)
+        self.sock = socket.create_connection((self.ip, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # small control messages should not wait for more data
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        challenge = recvMessage(self.sock)
+        sendMessage(self.sock, {"hmac": hmac.new(key, bytes.fromhex(challenge["nonce"]), hashlib.sha256).hexdigest()})
+        self.reply()
+
+    def reply(self) -> dict:
+        """ Wait for the answer to a request, raises TransferError if the other node refused it """
+        answer = recvMessage(self.sock)
+        if not answer.get("ok"):
+            raise TransferError(f"{self.ip}: {answer.get('error', 'request refused')}")
+        return answer
+
+    def ping(self) -> None:
+        """ Check that the connection is still alive """
+        sendMessage(self.sock, {"op": "ping"})
+        self.reply()
+
+    def sendImages(self, name: str, directory=None, store=None) -> dict:
+        """
+        Stream every image file in the staging directory of the process to the other node.
+        If a chunk store is given, only the chunks the other node does not already have are sent,
+        and the sent images are added to the local store afterwards (the workload may come back to this node).
+        returns the transfer statistics (see sendImagesParallel).
+        """
+        start = time.monotonic()
+        directory = directory or stagingDir(name)
+        files = sorted(f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f)))
+        sizes = [os.path.getsize(os.path.join(directory, f)) for f in files]
+        wire = sum(sizes)
+        if store is None:
+            sendMessage(self.sock, {"op": "images", "name": name, "files": list(zip(files, sizes))})
+            for file in files:
+                with open(os.path.join(directory, file), "rb") as f:
+                    self.sock.sendfile(f)  # zero-copy from the tmpfs page cache into the socket
+        else:
+            wire = self.sendDeduplicated(name, directory, files, sizes)
+        self.reply()
+        if store is not None:  # off the critical path, the process is already on its way to the other node
+            threading.Thread(target=lambda: [store.putFile(os.path.join(directory, f)) for f in files], daemon=True).start()
+        return {"codec": "none", "streams": 1, "bytes": sum(sizes), "wire": wire, "seconds": time.monotonic() - start}
+
+    def sendDeduplicated(self, name: str, directory: str, files: list, sizes: list) -> int:
+        """ Send the chunk manifest of the images, then only the chunks that the other node asks for """
+        manifests = [chunkStore.fileManifest(os.path.join(directory, f)) for f in files]
+        sendMessage(self.sock, {"op": "images", "name": name, "dedup": True, "files": list(zip(files, sizes, manifests))})
+        missing = set(self.reply()["missing"])
+        sent = 0
+        for file, manifest in zip(files, manifests):
+            with open(os.path.join(directory, file), "rb") as f:
+                for digest in manifest:
+                    chunk = f.read(chunkStore.CHUNK_SIZE)
+                    if digest in missing:
+                        sendFrame(self.sock, chunk)
+                        missing.discard(digest)  # equal chunks (e.g. zero pages) are only sent once
+                        sent += len(chunk)
+        print(f"Sent {sent} of {sum(sizes)} image bytes, the rest was already on {self.ip}")
+        return sent
+
+    def sendFiles(self, name: str, root: str, incremental=False, lease=None) -> int:
+        """
+        Mirror the process directory at root into the directory with the same name on the other node.
+        Application files are only sent if the other node does not have their content (see appManifest.py). Image files are
+        always sent, in incremental mode only if their size or modification time changed (like rsync's quick check).
+        With a lease, the other node refuses the files if the lease ran out. returns the number of bytes of files sent
+        """
+        digests = appManifest.manifestFor(root, name).refresh()
+        files = [entry + [digests.get(entry[0])] for entry in listFiles(root)]  # image files and links have no digest
+        sendMessage(self.sock, {"op": "files", "name": name, "files": files, "incremental": incremental, "lease": lease})
+        sizes = {entry[0]: entry[1] for entry in files}
+        sent = 0
+        for path in self.reply()["wanted"]:
+            with open(os.path.join(root, path), "rb") as f:
+                # exactly the listed size, a file the process is still writing to must not spill into the next one
+                count = self.sock.sendfile(f, 0, sizes[path]) if sizes[path] > 0 else 0
+            if count < sizes[path]:  # it shrank since it was listed, the other node is still waiting for the rest
+                raise TransferError(f"{path} shrank while it was sent ({count} of {sizes[path]} bytes)")
+            sent += count
+        self.reply()
+        return sent
+
+    def sendRange(self, transferId: str, directory: str, file: str, offset: int, length: int, codec="none") -> int:
+        """
+        Send one range of an image file with the CRC32 of the bytes on the wire, for the parallel image stream.
+        The range is compressed with the codec, unless that does not make it noticeably smaller.
+        returns the number of bytes sent on the wire.
+        """
+        with open(os.path.join(directory, file), "rb") as f:
+            data = os.pread(f.fileno(), length, offset)
+        if codec != "none":
+            compressed = CODECS[codec][0](data)
+            if len(compressed) < len(data) * INCOMPRESSIBLE:
+                data = compressed
+            else:
+                codec = "none"  # incompressible (e.g. already compressed media), not worth the receiver's CPU
+        sendMessage(self.sock, {"op": "range", "id": transferId, "file": file, "offset": offset, "length": length,
+                                "wire": len(data), "codec": codec, "crc": zlib.crc32(data)})
+        self.sock.sendall(data)
+        self.reply()
+        return len(data)
+
+    def finish(self, name: str, migrationId=None, lease=None, images=None) -> None:
+        """ Tell the other node that the transfer of the process is complete, so it can restore it from images (None: from RAM) """
+        sendMessage(self.sock, {"op": "done", "name": name, "migration": migrationId, "lease": lease, "images": images})
+        self.reply()
+
+    def standby(self, name: str, images: str, ageSeconds: float) -> None:
+        """ Tell the buddy node that the standby round in images (relative to the process directory) arrived, dumped ageSeconds ago """
+        sendMessage(self.sock, {"op": "standby", "name": name, "images": images, "age": ageSeconds})
+        self.reply()
+
+    def dropStandby(self, name: str) -> None:
+        """ Tell the buddy node to drop the replica of a process, e.g. because it finished or was migrated to another node """
+        sendMessage(self.sock, {"op": "standby", "name": name, "images": None})
+        self.reply()
+
+    def reserve(self, name: str, ramMB=0, seconds=None) -> str:
+        """ Ask the other node for a lease on a slot for a process. returns the lease id, or None if the node has no slot for it """
+        sendMessage(self.sock, {"op": "reserve", "name": name, "ram_mb": ramMB, "seconds": seconds})
+        return self.reply().get("lease")
+
+    def renew(self, lease: str) -> bool:
+        """ Renew a lease while the process is dumped. returns False if the other node no longer holds it """
+        sendMessage(self.sock, {"op": "renew", "lease": lease})
+        return self.reply().get("held", False)
+
+    def release(self, lease: str) -> None:
+        """ Give a lease back, e.g. when the handoff failed and the process goes to another node """
+        sendMessage(self.sock, {"op": "release", "lease": lease})
+        self.reply()
+
+    def command(self, name: str) -> None:
+        """ Send a command (one of COMMANDS) to the main loop of the other node """
+        sendMessage(self.sock, {"op": "command", "name": name})
+        self.reply()
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+def sendImagesParallel(pool, ip, name: str, directory=None, maxStreams=MAX_STREAMS, retries=3, codec="none") -> dict:
+    """
+    Stream the images in the staging directory of the process to the other node, split into ranges that are sent
+    over several pooled connections. The number of connections starts at one and grows while it raises the throughput.
+    A range whose connection drops is retried on a new connection, and ranges the other node already verified
+    (from an earlier, interrupted call with the same images) are skipped, so calling this again resumes the transfer.
+    codec is "none", a name from CODECS, or "auto" to pick one from the measured bandwidth to the node and the spare CPUs.
+    returns the transfer statistics: codec, streams, bytes (image bytes sent), wire (bytes on the wire) and seconds.
+    raises TransferError if a range could not be sent.
+    """
+    start = time.monotonic()
+    directory = directory or stagingDir(name)
+    files = sorted(f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f)))
+    stats = [os.stat(os.path.join(directory, f)) for f in files]
+    sizes = [stat.st_size for stat in stats]
+    transferId = hashlib.blake2b(json.dumps([name, files, sizes, [stat.st_mtime_ns for stat in stats]]).encode(), digest_size=8).hexdigest()
+
+    control = pool.get(ip)
+    sendMessage(control.sock, {"op": "begin", "id": transferId, "name": name, "files": list(zip(files, sizes))})
+    verified = {(file, offset) for file, offset in control.reply()["verified"]}
+    pending = queue.Queue()
+    for file, size in zip(files, sizes):
+        for offset in range(0, max(size, 1), RANGE_SIZE):
+            if (file, offset) not in verified:
+                pending.put((file, offset, min(RANGE_SIZE, size - offset)))
+
+    if codec == "auto":
+        sample = sampleFile(os.path.join(directory, max(zip(sizes, files))[1])) if files else b""
+        codec = chooseCodec(sample, pool.bandwidth(ip), availableCPUs())
+        print(f"Compressing images to {ip} with {codec}")
+    sent = [0, 0]  # image bytes and wire bytes sent by all streams, read by the tuning loop below
+    lock = threading.Lock()
+    failed = threading.Event()
+
+    def stream(index: int) -> None:
+        while not failed.is_set():
+            try:
+                file, offset, length = pending.get_nowait()
+            except queue.Empty:
+                return
+            for attempt in range(retries):
+                try:
+                    wire = pool.get(ip, index).sendRange(transferId, directory, file, offset, length, codec)
+                    break
+                except (OSError, ValueError, TransferError) as e:
+                    print(f"Range {file}@{offset} to {ip} failed ({e}), retrying on a new connection")
+                    pool.discard(ip, index)
+            else:
+                failed.set()
+                return
+            with lock:
+                sent[0] += length
+                sent[1] += wire
+
+    streams = [threading.Thread(target=stream, args=(1,), daemon=True)]
+    streams[0].start()
+    best = 0
+    while any(s.is_alive() for s in streams):
+        before, periodStart = sent[0], time.monotonic()
+        streams[-1].join(TUNE_PERIOD)
+        throughput = (sent[0] - before) / (time.monotonic() - periodStart)
+        if len(streams) < maxStreams and not pending.empty() and throughput > best * 1.1:  # the last stream helped, try one more
+            best = throughput
+            streams.append(threading.Thread(target=stream, args=(len(streams) + 1,), daemon=True))
+            streams[-1].start()
+        elif len(streams) > 1 or pending.empty():
+            for s in streams:
+                s.join()
+    if failed.is_set():
+        raise TransferError(f"{ip}: could not send every image range, call again to resume")
+
+    sendMessage(control.sock, {"op": "commit", "id": transferId})
+    control.reply()
+    seconds = time.monotonic() - start
+    pool.measured(ip, sent[1], seconds)
+    print(f"Sent {sent[0]} of {sum(sizes)} image bytes ({sent[1]} on the wire) to {ip} over {len(streams)} streams"
+          + (f", {len(verified)} ranges were sent before an interruption" if verified else ""))
+    return {"codec": codec, "streams": len(streams), "bytes": sent[0], "wire": sent[1], "seconds": seconds}
+
+
+class ConnectionPool:
+    """ Keeps one open, authenticated connection to every node this node transfers processes to """
+
+    def __init__(self, key: bytes, port=TRANSFER_PORT, timeout=30):
+        self.key = key
+        self.port = port
+        self.timeout = timeout
+        self.connections = {}  # (ip, stream number or LEASE_STREAM) -> PeerConnection
+        self.lastWarmed = {}  # ip -> time of the last background warm up, so unreachable nodes are not retried constantly
+        self.bandwidths = {}  # ip -> bytes per second measured on the last transfer to that node
+        self.lock = threading.Lock()
+
+    def get(self, ip, stream=0, check=True) -> PeerConnection:
+        """
+        Get the connection to a node, checking that a pooled connection is still alive and opening a new one if not.
+        stream selects one of several connections to the same node, used by the parallel image stream.
+        Without check, a pooled connection is returned as it is, the caller retries on a new one if it turns out dead.
+        """
+        ip = str(ip)
+        with self.lock:
+            connection = self.connections.pop((ip, stream), None)
+        if connection is not None and check:
+            try:
+                connection.ping()
+            except (OSError, ValueError, TransferError):
+                connection.close()
+                connection = None
+        if connection is None:
+            connection = PeerConnection(ip, self.key, self.port, self.timeout)
+        with self.lock:
+            self.connections[(ip, stream)] = connection
+        return connection
+
+    def reserve(self, ip, name: str, ramMB=0, seconds=None) -> str:
+        """
+        Ask a node for a lease in one round trip on the pooled connection (a new connection if there is none, or if the
+        pooled one turns out dead). returns the lease id, or None if the node has no slot. raises if the node cannot be reached
+        """
+        try:
+            return self.get(ip, check=False).reserve(name, ramMB, seconds)
+        except (OSError, ValueError):  # the pooled connection was closed by the other node, try once more on a new one
+            self.discard(ip, 0)
+            return self.get(ip).reserve(name, ramMB, seconds)
+
+    def warm(self, ip) -> bool:
+        """ Open (or check) the connection to a node ahead of a migration. returns True if the node is reachable """
+        try:
+            self.get(ip)
+            return True
+        except (OSError, ValueError, TransferError) as e:
+            print(f"Could not connect to the transfer server of {ip}: {e}")
+            return False
+
+    def warmAsync(self, ip, interval=10) -> None:
+        """ Warm the connection to a node in the background, at most once every interval seconds """
+        ip = str(ip)
+        with self.lock:
+            if (ip, 0) in self.connections or time.monotonic() - self.lastWarmed.get(ip, -interval) < interval:
+                return
+            self.lastWarmed[ip] = time.monotonic()
+        threading.Thread(target=self.warm, args=(ip,), daemon=True).start()
+
+    def bandwidth(self, ip, default=DEFAULT_BANDWIDTH) -> float:
+        """ Get the bandwidth to a node in bytes per second, as measured on the last transfer to it (default if never measured) """
+        return self.bandwidths.get(str(ip), default)
+
+    def measured(self, ip, size: int, seconds: float) -> None:
+        """ Remember the bandwidth of a transfer, transfers of less than a second are too short to measure the link """
+        if seconds >= 1:
+            self.bandwidths[str(ip)] = size / seconds
+
+    def discard(self, ip, stream=None) -> None:
+        """ Close the connection to a node (all of them if no stream is given), e.g. after a transfer on it failed halfway """
+        with self.lock:
+            keys = [key for key in self.connections if key[0] == str(ip) and stream in (None, key[1])]
+            connections = [self.connections.pop(key) for key in keys]
+        for connection in connections:
+            connection.close()
+
+    def closeAll(self) -> None:
+        with self.lock:
+            connections, self.connections = list(self.connections.values()), {}
+        for connection in connections:
+            connection.close()
+
+
+class TransferServer(threading.Thread):
+    """ This class is used to create a thread that accepts connections from other nodes and serves their transfer requests """
+
+    def __init__(self, key: bytes, root="/home/pi", port=TRANSFER_PORT, store=None, commands=None, leases=None, accepting=None):
+        self._running = True  # sentinel value for the thread
+        self.key = key
+        self.root = root  # process directories are received into root/<name>, their finish flags are written to root
+        self.store = store  # chunk store used for deduplicated image streams
+        # queue that receives ("command", name) events for the main loop, commands are refused without it, and ("incoming", name)
+        # events for a process that is on its way, so the main loop can prepare its restore while it is still being transferred
+        self.commands = commands
+        self.leases = leases  # leaseTable.LeaseTable of this node, reservations are refused without it
+        self.accepting = accepting or (lambda: True)  # returns False while the node takes no processes (migrating, shut down)
+        self.incoming = {}  # transfer id -> state of a parallel image stream that is being received
+        self.lock = threading.Lock()  # the ranges of a parallel stream arrive on several connections at once
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.settimeout(1)  # Set a timeout so the thread can notice when it is stopped
+        self.sock.bind(('', port))
+        self.sock.listen()
+        super().__init__()
+
+    def run(self):
+        while self._running:
+            try:
+                conn, address = self.sock.accept()
+            except socket.timeout:
+                continue
+            threading.Thread(target=self.serve, args=(conn, address[0]), daemon=True).start()
+        self.sock.close()
+
+    def serve(self, conn: socket.socket, ip: str) -> None:
+        """ Authenticate a connection, then serve its requests until the other node closes it """
+        with conn:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            try:
+                nonce = os.urandom(16)
+                sendMessage(conn, {"nonce": nonce.hex()})
+                expected = hmac.new(self.key, nonce, hashlib.sha256).hexdigest()
+                if not hmac.compare_digest(str(recvMessage(conn).get("hmac", "")), expected):
+                    sendMessage(conn, {"ok": False, "error": "authentication failed"})
+                    print(f"Rejected transfer connection from {ip}, wrong key")
+                    return
+                sendMessage(conn, {"ok": True})
+                while self._running:
+                    request = recvMessage(conn)  # pooled connections stay idle here between migrations
+                    try:
+                        self.handle(conn, request, ip)
+                    except (ValueError, KeyError, OSError) as e:  # report it, the stream is out of sync so the connection is closed
+                        print(f"Failed {request.get('op')} request from {ip}: {e}")
+                        sendMessage(conn, {"ok": False, "error": str(e)})
+                        return
+            except (OSError, ValueError):  # connection closed or garbled, the other node opens a new one when needed
+                pass
+
+    def handle(self, conn: socket.socket, request: dict, ip="") -> None:
+        """ Serve one request """
+        op = request["op"]
+        if self.leases is not None and "name" in request and op in ("images", "files", "begin"):
+            self.leases.renew(checkProcessName(request["name"]))  # a long transfer keeps its slot
+        if op == "ping":
+            pass
+        elif op == "images":
+            self.receiveImages(conn, request)
+        elif op == "files":
+            self.receiveFiles(conn, request)
+            self.announce(request["name"])  # its manifest is here now
+        elif op == "begin":
+            sendMessage(conn, {"ok": True, "verified": self.beginParallel(request)})
+            return
+        elif op == "range":
+            self.receiveRange(conn, request)
+        elif op == "commit":
+            self.commitParallel(request)
+        elif op == "done":
+            # the finish flag of the process, the main loop restores the process when it sees it
+            self.checkLease(request)
+            name = checkProcessName(request["name"])
+            images = checkRelativePath(request["images"]) if request.get("images") is not None else None
+            writeFlag(os.path.join(self.root, flagName("cpflag", name)), request.get("migration"), images=images)
+            if self.leases is not None:
+                self.leases.arrived(name, request.get("lease"))
+            hostOps.removePaths(standbyName(name), directory=self.root)  # it runs here now
+        elif op == "standby":
+            self.recordStandby(request, ip)
+        elif op == "reserve":
+            if self.leases is None:
+                raise ValueError("reservations are not supported")
+            lease = None
+            if self.accepting():
+                lease = self.leases.grant(ip, checkProcessName(request["name"]), float(request.get("ram_mb") or 0),
+                                          hostOps.freeMemoryMB(), request.get("seconds"))
+            sendMessage(conn, {"ok": True, "lease": lease})
+            if lease is not None:
+                self.announce(request["name"])
+            return
+        elif op == "renew":
+            sendMessage(conn, {"ok": True, "held": self.leases is not None and self.leases.extend(request.get("lease"))})
+            return
+        elif op == "release":
+            if self.leases is not None:
+                self.leases.release(request.get("lease"))
+        elif op == "command":
+            if self.commands is None or request.get("name") not in COMMANDS:
+                raise ValueError(f"unsupported command {request.get('name')!r}")
+            self.commands.put(("command", request["name"]))
+        else:
+            raise ValueError(f"unknown request {op!r}")
+        sendMessage(conn, {"ok": True})
+
+    def checkLease(self, request: dict) -> None:
+        """ Refuse a request under a lease that ran out, its slot may have been granted to another process meanwhile """
+        if self.leases is not None and request.get("lease") is not None and not self.leases.holds(request["lease"]):
+            raise ValueError(f"lease {request['lease']} of {request.get('name')} ran out")
+
+    def announce(self, name: str) -> None:
+        """ Tell the main loop that a process is on its way here """
+        if self.commands is not None:
+            self.commands.put(("incoming", os.path.basename(name)))
+
+    def recordStandby(self, request: dict, ip: str) -> None:
+        """ Write the standby manifest of a process, or drop it and the replica if the request has no images """
+        name = checkProcessName(request["name"])
+        path = os.path.join(self.root, standbyName(name))
+        if request.get("images") is None:
+            if os.path.exists(path):
+                hostOps.removePaths(standbyName(name), name, directory=self.root)
+            return
+        checkRelativePath(request["images"])
+        with open(path + ".tmp", "w") as f:  # replaced in one step, so the manifest always names a complete round
+            json.dump({"source": ip, "images": request["images"], "age": float(request.get("age") or 0), "received": time.time()}, f)
+        os.replace(path + ".tmp", path)
+
+    def receiveImages(self, conn: socket.socket, header: dict) -> None:
+        """ Receive one image stream and write it into the staging directory of the process """
+        for file, *_ in header["files"]:
+            if os.path.basename(file) != file or file in ("", ".", ".."):
+                raise ValueError(f"refusing to write image file outside the staging directory: {file!r}")
+        directory = stagingDir(checkProcessName(header["name"]))
+        shutil.rmtree(directory, ignore_errors=True)  # never mix images of two dumps
+        os.makedirs(directory)
+        if header.get("dedup"):
+            self.receiveDeduplicated(conn, directory, header["files"])
+            return
+        buffer = memoryview(bytearray(BUFFER_SIZE))
+        for file, size in header["files"]:
+            recvIntoFile(conn, os.path.join(directory, file), size, buffer)
+
+    def beginParallel(self, header: dict) -> list:
+        """
+        Prepare the staging directory for a parallel image stream and return the ranges that are already verified.
+        If the journal in the staging directory belongs to the same transfer, it is resumed instead of started over.
+        """
+        for file, _ in header["files"]:
+            if os.path.basename(file) != file or file in ("", ".", "..", JOURNAL_FILE):
+                raise ValueError(f"refusing to write image file outside the staging directory: {file!r}")
+        directory = stagingDir(checkProcessName(header["name"]))
+        journal = os.path.join(directory, JOURNAL_FILE)
+        verified = {}
+        try:
+            with open(journal) as f:
+                if f.readline().strip() == header["id"]:
+                    for line in f:
+                        file, offset, length = line.split()
+                        verified[(file, int(offset))] = int(length)
+        except (FileNotFoundError, ValueError):
+            pass
+        if not verified:  # a new transfer, never mix images of two dumps
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(directory)
+            for file, size in header["files"]:
+                with open(os.path.join(directory, file), "wb") as f:
+                    f.truncate(size)  # the ranges are written in place, in any order
+            with open(journal, "w") as f:
+                f.write(header["id"] + "\n")
+        with self.lock:
+            self.incoming[header["id"]] = {"directory": directory, "sizes": dict(header["files"]), "verified": verified}
+        return list(verified)
+
+    def receiveRange(self, conn: socket.socket, header: dict) -> None:
+        """ Receive one range of a parallel image stream, checking its CRC32 while receiving, and write it in place """
+        with self.lock:
+            state = self.incoming[header["id"]]
+        file, offset, length, wire = header["file"], header["offset"], header["length"], header.get("wire", header["length"])
+        if file not in state["sizes"] or offset < 0 or offset + length > state["sizes"][file]:
+            raise ValueError(f"range {file}@{offset} is outside the announced images")
+        if header.get("codec", "none") not in CODECS:
+            raise ValueError(f"range {file}@{offset} uses the codec {header['codec']}, which is not installed on this node")
+        data = bytearray(wire)
+        view = memoryview(data)
+        received, crc = 0, 0
+        while received < wire:
+            count = conn.recv_into(view[received:])
+            if count == 0:
+                raise ConnectionError(f"connection closed in the middle of {file}@{offset}")
+            crc = zlib.crc32(view[received:received + count], crc)
+            received += count
+        if crc != header["crc"]:
+            raise ValueError(f"range {file}@{offset} was corrupted in transit")
+        if header.get("codec", "none") != "none":
+            data = CODECS[header["codec"]][1](bytes(data))
+            if len(data) != length:
+                raise ValueError(f"range {file}@{offset} did not decompress to its length")
+        fd = os.open(os.path.join(state["directory"], file), os.O_WRONLY)
+        try:
+            os.pwrite(fd, data, offset)
+        finally:
+            os.close(fd)
+        with self.lock:
+            state["verified"][(file, offset)] = length
+            with open(os.path.join(state["directory"], JOURNAL_FILE), "a") as f:
+                f.write(f"{file} {offset} {length}\n")
+
+    def commitParallel(self, header: dict) -> None:
+        """ Check that every byte of a parallel image stream was received and verified """
+        with self.lock:
+            state = self.incoming.pop(header["id"])
+        for file, size in state["sizes"].items():
+            if sum(length for (f, _), length in state["verified"].items() if f == file) != size:
+                raise ValueError(f"{file} is incomplete")
+        os.remove(os.path.join(state["directory"], JOURNAL_FILE))
+
+    def receiveDeduplicated(self, conn: socket.socket, directory: str, files: list) -> None:
+        """ Ask for the chunks missing from the store, then rebuild the files from the received chunks and the store """
+        if self.store is None:
+            raise ValueError("deduplicated stream received but this node has no chunk store")
+        missing = self.store.missing(digest for _, _, manifest in files for digest in manifest)
+        sendMessage(conn, {"ok": True, "missing": missing})
+        received = {}
+        for digest in missing:
+            chunk = recvFrame(conn)
+            if chunkStore.chunkDigest(chunk) != digest:
+                raise ValueError(f"chunk {digest} was corrupted in transit")
+            received[digest] = chunk
+        for file, size, manifest in files:
+            with open(os.path.join(directory, file), "wb") as f:
+                for digest in manifest:
+                    f.write(received[digest] if digest in received else self.store.get(digest))
+            if os.path.getsize(os.path.join(directory, file)) != size:
+                raise ValueError(f"rebuilt {file} does not match its manifest")
+        # the new chunks go into the store after the files are staged, so the restore does not wait for the SD card
+        threading.Thread(target=lambda: [self.store.put(d, c) for d, c in received.items()], daemon=True).start()
+
+    def receiveFiles(self, conn: socket.socket, header: dict) -> None:
+        """ Mirror a process directory: ask for the files that differ, receive them, and remove files the sender does not have """
+        self.checkLease(header)
+        name = checkProcessName(header["name"])
+        root = os.path.join(self.root, name)
+        entries = {checkRelativePath(path): (size, mtime, link if link is None else checkLinkTarget(path, link), digest)
+                   for path, size, mtime, link, digest in header["files"]}
+        manifest = appManifest.manifestFor(root, name)
+        have = manifest.refresh()  # application files this node has, e.g. from an earlier migration of the process
+        wanted = []
+        for path, (size, mtime, link, digest) in entries.items():
+            local = checkInsideRoot(root, os.path.join(root, path))  # e.g. <link>/x, refused before anything is received
+            if link is not None:
+                continue
+            if digest is not None:
+                if have.get(path) != digest or os.path.islink(local):
+                    wanted.append(path)
+                continue
+            if header.get("incremental") and not os.path.islink(local) and os.path.isfile(local):
+                stat = os.stat(local)
+                if stat.st_size == size and stat.st_mtime_ns == mtime:
+                    continue  # unchanged since the last round
+            wanted.append(path)
+        sendMessage(conn, {"ok": True, "wanted": wanted})
+
+        for path, *_ in listFiles(root) if os.path.isdir(root) else []:  # stale files (e.g. images of an older dump) must not mix in
+            if path not in entries:
+                os.remove(os.path.join(root, path))
+        buffer = memoryview(bytearray(BUFFER_SIZE))
+        corrupt = []  # application files whose content does not match the digest the sender listed
+        for path in wanted:
+            size, mtime, _, digest = entries[path]
+            local = os.path.join(root, path)
+            os.makedirs(os.path.dirname(local), exist_ok=True)
+            if os.path.islink(local):
+                os.remove(local)
+            received = appManifest.newDigest() if digest is not None else None
+            recvIntoFile(conn, local, size, buffer, received)
+            os.utime(local, ns=(mtime, mtime))  # keep the modification time, so the next incremental round can skip it
+            if digest is None:
+                continue
+            if received.hexdigest() != digest:  # never recorded, or the file would count as present on every later sync
+                os.remove(local)
+                corrupt.append(path)
+                continue
+            manifest.received(path, size, mtime, digest)
+        manifest.save()
+        if corrupt:  # raised once every file is read, so the connection is still in step for the error reply
+            raise ValueError(f"received files that do not match their digest: {', '.join(corrupt)}")
+        for path, (_, _, link, _) in entries.items():
+            if link is not None:
+                local = os.path.join(root, path)
+                os.makedirs(os.path.dirname(local), exist_ok=True)
+                if os.path.lexists(local):
+                    os.remove(local)
+                os.symlink(link, local)
+
+    def stop(self):
+        self._running = False  # set the sentinel value to stop the thread